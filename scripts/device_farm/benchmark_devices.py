@@ -0,0 +1,281 @@
+""" benchmark devices
+runs interface_mod_script, interface_mod_script_async and
+QuickDeploy.run_commands against simulated device farms of growing size and records the throughput and per device
+latency of every run in benchmark_devices.json. every run is compared to
+the last recorded run of the same script and size, anything more than 20%
+slower is reported as a regression
+
+the farm runs in its own process, so that the simulated devices and the
+script being measured do not fight over the same interpreter
+
+usage: python benchmark_devices.py [devices ...]
+example: python benchmark_devices.py 1 10 100 1000
+"""
+
+from contextlib import redirect_stdout
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from devicefarm import DeviceFarm
+
+# the scripts being benchmarked live next door
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, 'p01_interface_mod'))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, 'p02_quick_deploy'))
+
+import interface_mod
+import quick_deploy
+from sshfw import SSHProfiler, percentile
+
+
+# login of every simulated device
+CREDENTIALS = ('admin', 'cisco', 'cisco')
+
+# results of earlier runs, compared against to find regressions
+RESULTS_FILE = 'benchmark_devices.json'
+
+# slowdown allowed before a run counts as a regression
+TOLERANCE = 0.2
+
+# sessions hung up at the end of every run are expected, not worth a warning
+logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+logging.getLogger('asyncssh').setLevel(logging.CRITICAL)
+
+
+def serve_farm(connection, count, latency, jitter):
+    """ serve farm
+    runs a device farm in a child process, hands the device addresses back
+    and serves them until told to stop """
+
+    with DeviceFarm(count, latency=latency, jitter=jitter) as farm:
+        connection.send(farm.addresses())
+        connection.recv()
+
+def start_farm(count, latency, jitter):
+    """ start farm
+    starts a fresh farm process, every run gets devices in the lab state
+
+    output -> (process, connection, addresses)
+    """
+
+    connection, child_connection = multiprocessing.Pipe()
+
+    process = multiprocessing.Process(
+        target=serve_farm, args=(child_connection, count, latency, jitter),
+        daemon=True,
+        )
+    process.start()
+
+    return process, connection, connection.recv()
+
+def stop_farm(process, connection):
+    connection.send('stop')
+    process.join()
+
+def device_latencies(events):
+    """ device latencies
+    total time spent on every device, out of the profiler events """
+
+    totals = {}
+
+    for event in events:
+        totals[event['switch']] = totals.get(event['switch'], 0.0) + event['duration']
+
+    return list(totals.values())
+
+def run_interface_mod(addresses, max_workers=10):
+    """ run interface mod
+    runs the interface modification script against the devices
+
+    output -> (elapsed, device latencies, errors)
+    """
+
+    profiler = SSHProfiler()
+    session_pool = interface_mod.SSHSessionPool(
+        credentials=CREDENTIALS, profiler=profiler,
+        )
+
+    start_timer = time.perf_counter()
+
+    # the script reports every router, which would drown the results
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        results, errors = interface_mod.interface_mod_script(
+            addresses, max_workers=max_workers, session_pool=session_pool,
+            profiler=profiler,
+            )
+
+    elapsed = time.perf_counter() - start_timer
+
+    session_pool.close_all()
+
+    return elapsed, device_latencies(profiler.events), len(errors)
+
+def run_interface_mod_async(addresses, max_sessions=500):
+    """ run interface mod async
+    runs the asyncio version of the interface modification script against
+    the devices. there is no profiler on the event loop, so every device is
+    timed from the end of its login to the end of its job
+
+    output -> (elapsed, device latencies, errors)
+    """
+
+    latencies = []
+    modify_router_async = interface_mod.modify_router_async
+
+    async def timed_modify_router(conn, router):
+        start = time.perf_counter()
+        try:
+            return await modify_router_async(conn, router)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    start_timer = time.perf_counter()
+
+    # the script reports every router, which would drown the results
+    interface_mod.modify_router_async = timed_modify_router
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            results, errors = interface_mod.interface_mod_script_async(
+                addresses, max_sessions=max_sessions, credentials=CREDENTIALS,
+                )
+    finally:
+        interface_mod.modify_router_async = modify_router_async
+
+    elapsed = time.perf_counter() - start_timer
+
+    return elapsed, latencies, len(errors)
+
+def run_quick_deploy(addresses, max_workers=10):
+    """ run quick deploy
+    runs the quick deploy script, with its own commands.txt, against the
+    devices
+
+    output -> (elapsed, device latencies, errors)
+    """
+
+    with open(os.path.join(SCRIPTS_DIR, 'p02_quick_deploy', 'commands.txt'), 'r') as fn:
+        commands = [line for line in fn.read().splitlines() if line]
+
+    profiler = SSHProfiler()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        qd_script = quick_deploy.QuickDeploy(
+            max_workers=max_workers,
+            profiler=profiler,
+            devices={address: 'cisco_ios' for address in addresses},
+            commands=commands,
+            logname=os.path.join(temp_dir, 'quick_deploy.txt'),
+            print_screen=False,
+            credentials=CREDENTIALS,
+            )
+
+        start_timer = time.perf_counter()
+
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            qd_script.run_commands()
+
+        elapsed = time.perf_counter() - start_timer
+
+        # every device that made it through has a log
+        errors = len(addresses) - len(qd_script.log)
+
+        qd_script.write_log()
+        qd_script.connection_pool.close_all()
+
+    return elapsed, device_latencies(profiler.events), errors
+
+def load_results(filename=RESULTS_FILE):
+    """ load results
+    results of earlier runs, {'script/devices' : result} """
+
+    try:
+        with open(filename, 'r') as fn:
+            return json.load(fn)
+    except FileNotFoundError:
+        return {}
+
+def find_regressions(result, previous, tolerance=TOLERANCE):
+    """ find regressions
+    what got worse than the previous run by more than the tolerance """
+
+    regressions = []
+
+    if result['devices_per_second'] < previous['devices_per_second'] * (1 - tolerance):
+        regressions.append('throughput %.1f -> %.1f devices/s' % (
+            previous['devices_per_second'], result['devices_per_second'],
+            ))
+
+    if result['p95'] > previous['p95'] * (1 + tolerance):
+        regressions.append('p95 latency %.3f -> %.3f s' % (
+            previous['p95'], result['p95'],
+            ))
+
+    return regressions
+
+def main():
+    # farm sizes to run, a thousand devices take a few minutes per script
+    counts = [int(count) for count in sys.argv[1:]] or [1, 10, 100, 1000]
+
+    # latency of every answer of the simulated devices, in seconds
+    latency = 0.05
+    jitter = 0.01
+
+    results = load_results()
+    regressions = []
+
+    print('%-16s %8s %9s %10s %9s %9s %7s' % (
+        'SCRIPT', 'DEVICES', 'TOTAL(s)', 'DEVICES/s', 'P50(s)', 'P95(s)', 'ERRORS'))
+
+    for count in counts:
+        for name, run in (
+                ('interface_mod', run_interface_mod),
+                ('interface_async', run_interface_mod_async),
+                ('quick_deploy', run_quick_deploy)):
+            process, connection, addresses = start_farm(count, latency, jitter)
+
+            try:
+                elapsed, latencies, errors = run(addresses)
+            finally:
+                stop_farm(process, connection)
+
+            result = {
+                'time': time.time(),
+                'latency': latency,
+                'jitter': jitter,
+                'seconds': elapsed,
+                'devices_per_second': count / elapsed,
+                'p50': percentile(latencies, 50) if latencies else 0.0,
+                'p95': percentile(latencies, 95) if latencies else 0.0,
+                'errors': errors,
+            }
+
+            print('%-16s %8d %9.2f %10.1f %9.3f %9.3f %7d' % (
+                name, count, elapsed, result['devices_per_second'],
+                result['p50'], result['p95'], errors,
+                ))
+
+            # compare with the last run of the same script and size
+            key = name + '/' + str(count)
+            previous = results.get(key)
+
+            if previous is not None and previous['latency'] == latency:
+                for regression in find_regressions(result, previous):
+                    regressions.append(key + ': ' + regression)
+
+            results[key] = result
+
+    with open(RESULTS_FILE, 'w') as fn:
+        json.dump(results, fn, indent=2, sort_keys=True)
+
+    if regressions:
+        print('\nREGRESSIONS:')
+        for regression in regressions:
+            print(regression)
+
+if __name__ == '__main__':
+    main()
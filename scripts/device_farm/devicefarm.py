@@ -0,0 +1,742 @@
+""" device farm
+simulated cisco ios devices served over ssh on localhost, built on the
+server side of paramiko, so that the scripts can be run and benchmarked
+without any real routers. every device gets its own port and behaves like
+the routers of the interface modification lab
+
+    - user mode 'R1>', enable mode 'R1#' behind an enable password
+    - show ip int brief, show interface x/x, show interfaces description,
+      show ip bgp, show version, and the '| include' style filters
+    - configuration mode, with descriptions and shutdowns applied to the
+      interfaces for the next show commands to see
+    - an 80 column terminal that scrolls the echo of long lines, until it
+      is widened with 'terminal width'
+
+every answer is held back for the configured latency, plus or minus the
+jitter, counted from the moment the command reached the device. commands
+that are written ahead are answered in order, just like a real router on
+the far end of a slow link. the output size is set by the number of
+interfaces and bgp routes of every device
+
+usage: python devicefarm.py [devices] [latency]
+example: python devicefarm.py 10 0.05
+"""
+
+import random
+import re
+import selectors
+import socket
+import sys
+import threading
+import time
+
+import paramiko
+
+
+# interfaces of every device, on top of the host ports on slot 1
+# (name, ip address, status, protocol, description)
+BASE_INTERFACES = (
+    ('FastEthernet0/0', '10.0.0.1', 'up', 'up', 'npcap ethernet adapter connection'),
+    ('FastEthernet0/1', 'unassigned', 'up', 'up', ''),
+    ('Serial0/1', 'unassigned', 'administratively down', 'down', ''),
+)
+
+# full interface names, looked up by the abbreviation typed in
+INTERFACE_TYPES = ('FastEthernet', 'GigabitEthernet', 'Serial', 'Loopback')
+
+# first words accepted in configuration mode, anything else is rejected
+CONFIG_KEYWORDS = (
+    'interface', 'description', 'shutdown', 'no', 'ip', 'switchport',
+    'hostname', 'exit', 'end', 'do',
+)
+
+INVALID_INPUT = "% Invalid input detected at '^' marker.\n"
+
+# one host key for the whole farm, generated on first use
+host_key = None
+host_key_lock = threading.Lock()
+
+
+def farm_host_key():
+    """ farm host key
+    ecdsa keys are much faster to generate and sign with than rsa keys,
+    which matters once a thousand devices are logged into """
+
+    global host_key
+
+    with host_key_lock:
+        if host_key is None:
+            host_key = paramiko.ECDSAKey.generate()
+
+    return host_key
+
+def interface_name(name):
+    """ interface name
+    full interface name out of what was typed in, for example 'fa0/1' and
+    'fastEthernet 0/1' both become 'FastEthernet0/1'. None if the interface
+    type is unknown """
+
+    match = re.match(r'([A-Za-z]+)\s*(\d.*)$', name.strip())
+    if match is None:
+        return None
+
+    interface_type, numbering = match.groups()
+
+    for full_type in INTERFACE_TYPES:
+        if full_type.lower().startswith(interface_type.lower()):
+            return full_type + numbering
+
+    return None
+
+def short_interface_name(name):
+    """ short interface name
+    'show interfaces description' style name, FastEthernet0/1 -> Fa0/1 """
+
+    numbering = name.lstrip('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz')
+
+    return name[:2] + numbering
+
+def stable_hash(text):
+    """ stable hash
+    hash of a string that, unlike hash(), is the same on every run """
+
+    value = 0
+    for char in text:
+        value = (value * 31 + ord(char)) & 0xffffffff
+
+    return value
+
+def filter_output(output, pipe):
+    """ filter output
+    applies the '| include', '| exclude' and '| begin' filters, which can be
+    shortened down to '| in', '| ex' and '| be' like on a real router """
+
+    filter_type, _, pattern = pipe.strip().partition(' ')
+    regex = re.compile(pattern.strip())
+    lines = output.splitlines(True)
+
+    if 'include'.startswith(filter_type) and filter_type:
+        return ''.join(line for line in lines if regex.search(line))
+    if 'exclude'.startswith(filter_type) and filter_type:
+        return ''.join(line for line in lines if not regex.search(line))
+    if 'begin'.startswith(filter_type) and filter_type:
+        for i, line in enumerate(lines):
+            if regex.search(line):
+                return ''.join(lines[i:])
+        return ''
+
+    return INVALID_INPUT
+
+class SimulatedDevice:
+    """ simulated device
+    interfaces and bgp table of a single device, shared by every session
+    logged into it. the show commands are answered from here and the
+    configuration commands change it """
+
+    def __init__(self, hostname, index=1, interfaces=16, bgp_routes=1000,
+                 enable_secret='cisco'):
+        self.hostname = hostname
+        self.index = index
+        self.host_ports = interfaces
+        self.bgp_routes = bgp_routes
+        self.enable_secret = enable_secret
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+        self.reset()
+
+    def reset(self):
+        """ reset
+        back to the lab state, every host port admin up yet link down """
+
+        # {name : [ip address, status, protocol, description]}
+        interfaces = {}
+
+        for name, address, status, protocol, description in BASE_INTERFACES:
+            interfaces[name] = [address, status, protocol, description]
+
+        for port in range(self.host_ports):
+            interfaces['FastEthernet1/' + str(port)] = ['unassigned', 'up', 'down', 'host']
+
+        with self.lock:
+            self.interfaces = interfaces
+
+    def show_ip_int_brief(self):
+        lines = ['Interface                  IP-Address      OK? Method Status                Protocol\n']
+
+        with self.lock:
+            for name, (address, status, protocol, description) in self.interfaces.items():
+                lines.append('%-26s %-15s YES NVRAM  %-21s %s\n' % (
+                    name, address, status, protocol,
+                    ))
+
+        return ''.join(lines)
+
+    def show_interface(self, name):
+        with self.lock:
+            if name not in self.interfaces:
+                return INVALID_INPUT
+            address, status, protocol, description = self.interfaces[name]
+
+        # the mac address follows the device and the port
+        mac = 'c2%02x.%04x.%04x' % (
+            self.index & 255, self.index >> 8 & 0xffff, stable_hash(name) & 0xffff,
+            )
+
+        lines = [name + ' is ' + status + ', line protocol is ' + protocol + '\n',
+                 '  Hardware is Fast Ethernet, address is ' + mac + ' (bia ' + mac + ')\n']
+
+        if description:
+            lines.append('  Description: ' + description + '\n')
+
+        if address != 'unassigned':
+            lines.append('  Internet address is ' + address + '/24\n')
+
+        lines.extend((
+            '  MTU 1500 bytes, BW 100000 Kbit/sec, DLY 100 usec,\n',
+            '     reliability 255/255, txload 1/255, rxload 1/255\n',
+            '  Encapsulation ARPA, loopback not set\n',
+            '  Keepalive set (10 sec)\n',
+            '  Full-duplex, 100Mb/s, 100BaseTX/FX\n',
+            '  ARP type: ARPA, ARP Timeout 04:00:00\n',
+            '  Last input never, output 00:00:01, output hang never\n',
+            '  Last clearing of "show interface" counters never\n',
+            '  Input queue: 0/75/0/0 (size/max/drops/flushes); Total output drops: 0\n',
+            '  Queueing strategy: fifo\n',
+            '  Output queue: 0/40 (size/max)\n',
+            '  5 minute input rate 0 bits/sec, 0 packets/sec\n',
+            '  5 minute output rate 0 bits/sec, 0 packets/sec\n',
+            '     0 packets input, 0 bytes, 0 no buffer\n',
+            '     Received 0 broadcasts (0 IP multicasts)\n',
+            '     0 runts, 0 giants, 0 throttles\n',
+            '     0 input errors, 0 CRC, 0 frame, 0 overrun, 0 ignored\n',
+            '     0 watchdog\n',
+            '     0 input packets with dribble condition detected\n',
+            '     0 packets output, 0 bytes, 0 underruns\n',
+            '     0 output errors, 0 collisions, 1 interface resets\n',
+            '     0 unknown protocol drops\n',
+            '     0 babbles, 0 late collision, 0 deferred\n',
+            '     0 lost carrier, 0 no carrier\n',
+            '     0 output buffer failures, 0 output buffers swapped out\n',
+            ))
+
+        return ''.join(lines)
+
+    def show_interfaces_description(self):
+        lines = ['Interface                      Status         Protocol Description\n']
+
+        with self.lock:
+            for name, (address, status, protocol, description) in self.interfaces.items():
+                if status == 'administratively down':
+                    status = 'admin down'
+                lines.append('%-30s %-14s %-8s %s\n' % (
+                    short_interface_name(name), status, protocol, description,
+                    ))
+
+        return ''.join(lines)
+
+    def show_ip_bgp(self):
+        # the same table every time for the same device
+        rng = random.Random(self.hostname)
+
+        lines = [
+            'BGP table version is ' + str(self.bgp_routes) + ', local router ID is 10.0.0.1\n',
+            'Status codes: s suppressed, d damped, h history, * valid, > best, i - internal\n',
+            'Origin codes: i - IGP, e - EGP, ? - incomplete\n',
+            '\n',
+            '   Network          Next Hop            Metric LocPrf Weight Path\n',
+            ]
+
+        for route in range(self.bgp_routes):
+            network = (1 << 24) + (route << 8)
+            prefix = '%d.%d.%d.0/24' % (
+                network >> 24, network >> 16 & 255, network >> 8 & 255,
+                )
+            path = ' '.join(str(rng.randint(1, 65000)) for _ in range(rng.randint(2, 6)))
+            lines.append('*> %-18s %-19s %6d %13d %s i\n' % (
+                prefix, '10.2.0.1', 0, 0, path,
+                ))
+
+        return ''.join(lines)
+
+    def show_version(self):
+        uptime = int(time.time() - self.started) // 60
+
+        return (
+            'Cisco IOS Software, 3700 Software (C3725-ADVENTERPRISEK9-M), Version 12.4(15)T14\n'
+            '\n' +
+            self.hostname + ' uptime is ' + str(uptime // 60) + ' hours, ' +
+            str(uptime % 60) + ' minutes\n'
+            'System image file is "flash:c3725-adventerprisek9-mz.124-15.T14.bin"\n'
+            )
+
+    def configure_interface(self, name, command):
+        """ configure interface
+        applies an interface configuration line, returns the error if any """
+
+        words = command.split()
+        negate = words[0] == 'no'
+        if negate:
+            words = words[1:]
+
+        if not words:
+            return INVALID_INPUT
+
+        with self.lock:
+            interface = self.interfaces[name]
+
+            if 'description'.startswith(words[0]) and len(words[0]) >= 4:
+                # everything after the keyword is the description
+                interface[3] = ''
+                if not negate and len(words) > 1:
+                    interface[3] = command.split(None, 1)[1]
+            elif 'shutdown'.startswith(words[0]) and len(words[0]) >= 4:
+                if negate:
+                    # back up, the line protocol follows the cable
+                    interface[1] = 'up'
+                    interface[2] = 'down' if name.startswith('FastEthernet1/') else 'up'
+                else:
+                    interface[1] = 'administratively down'
+                    interface[2] = 'down'
+
+        return ''
+
+class DeviceSession:
+    """ device session
+    one shell logged into a simulated device. keeps track of the mode and
+    answers every line typed in with the echo, the output and the prompt """
+
+    def __init__(self, device):
+        self.device = device
+
+        # 'user', 'password', 'enable', 'config' or 'config-if'
+        self.mode = 'user'
+        self.interface = None
+        self.closed = False
+
+        # columns of the terminal, 0 for no limit
+        self.width = 80
+
+    def prompt(self):
+        hostname = self.device.hostname
+
+        if self.mode == 'user':
+            return hostname + '>'
+        if self.mode == 'password':
+            return 'Password: '
+        if self.mode == 'config':
+            return hostname + '(config)#'
+        if self.mode == 'config-if':
+            return hostname + '(config-if)#'
+
+        return hostname + '#'
+
+    def banner(self):
+        return '\r\n\r\nUser Access Verification\r\n\r\n' + self.prompt()
+
+    def echo(self, line):
+        """ echo
+        the line as echoed behind the prompt. a line that does not fit the
+        terminal is scrolled, only its end is shown behind a '$' """
+
+        room = self.width - len(self.prompt()) - 2
+
+        if self.width and len(line) > room + 1:
+            return '$' + line[-room:]
+
+        return line
+
+    def handle(self, line):
+        """ handle
+        everything the device sends back for one line typed in """
+
+        # the password is not echoed
+        if self.mode == 'password':
+            if line == self.device.enable_secret:
+                self.mode = 'enable'
+                return '\r\n' + self.prompt()
+            self.mode = 'user'
+            return '\r\n% Access denied\r\n\r\n' + self.prompt()
+
+        # echoed at the prompt the line was typed at
+        echo = self.echo(line)
+        output = self.execute(line.strip())
+
+        if self.closed:
+            return echo + '\r\n'
+
+        return echo + '\r\n' + output.replace('\n', '\r\n') + self.prompt()
+
+    def execute(self, command):
+        """ execute
+        runs the command in the current mode and returns its output """
+
+        # empty lines and comments only bring the prompt back
+        if not command or command.startswith('!'):
+            return ''
+
+        if self.mode in ('config', 'config-if'):
+            return self.execute_config(command)
+
+        words = command.split()
+
+        if 'enable'.startswith(words[0]) and len(words[0]) >= 2:
+            if self.mode == 'user':
+                self.mode = 'password'
+            return ''
+
+        if words[0] in ('exit', 'logout', 'quit'):
+            self.closed = True
+            return ''
+
+        if 'disable'.startswith(words[0]) and len(words[0]) >= 4:
+            self.mode = 'user'
+            return ''
+
+        if 'terminal'.startswith(words[0]) and len(words[0]) >= 3:
+            if len(words) == 3 and 'width'.startswith(words[1]) and \
+                    len(words[1]) >= 2 and words[2].isdigit():
+                self.width = int(words[2])
+            return ''
+
+        if 'configure'.startswith(words[0]) and len(words[0]) >= 4:
+            if self.mode == 'user':
+                return INVALID_INPUT
+            self.mode = 'config'
+            return 'Enter configuration commands, one per line.  End with CNTL/Z.\n'
+
+        if 'show'.startswith(words[0]) and len(words[0]) >= 2:
+            command, _, pipe = command.partition('|')
+            output = self.show(command.split()[1:])
+            if pipe and output != INVALID_INPUT:
+                output = filter_output(output, pipe)
+            return output
+
+        return INVALID_INPUT
+
+    def show(self, words):
+        """ show
+        output of the show command, without the 'show' itself """
+
+        device = self.device
+
+        if not words:
+            return '% Incomplete command.\n'
+
+        if words[0] == 'ip' and len(words) >= 2:
+            if 'interface'.startswith(words[1]) and len(words) == 3 and \
+                    'brief'.startswith(words[2]):
+                return device.show_ip_int_brief()
+            if words[1] == 'bgp':
+                return device.show_ip_bgp()
+            return INVALID_INPUT
+
+        if 'interfaces'.startswith(words[0]) and len(words[0]) >= 3:
+            if len(words) == 2 and 'description'.startswith(words[1]):
+                return device.show_interfaces_description()
+
+            name = interface_name(''.join(words[1:]))
+            if name is None:
+                return INVALID_INPUT
+            return device.show_interface(name)
+
+        if 'version'.startswith(words[0]) and len(words[0]) >= 3:
+            return device.show_version()
+
+        if 'running-config'.startswith(words[0]) and len(words[0]) >= 3:
+            return '!\nhostname ' + device.hostname + '\n!\nend\n'
+
+        return INVALID_INPUT
+
+    def execute_config(self, command):
+        """ execute config
+        runs a configuration mode command """
+
+        words = command.split()
+
+        if words[0] == 'end':
+            self.mode = 'enable'
+            self.interface = None
+            return ''
+
+        if words[0] == 'exit':
+            if self.mode == 'config-if':
+                self.mode = 'config'
+                self.interface = None
+            else:
+                self.mode = 'enable'
+            return ''
+
+        # show commands from within configuration mode
+        if words[0] == 'do' and len(words) > 2 and 'show'.startswith(words[1]):
+            return self.show(words[2:])
+
+        if 'interface'.startswith(words[0]) and len(words[0]) >= 3 and len(words) > 1:
+            name = interface_name(''.join(words[1:]))
+            if name is None or name not in self.device.interfaces:
+                return INVALID_INPUT
+            self.mode = 'config-if'
+            self.interface = name
+            return ''
+
+        if not any(keyword.startswith(words[0]) for keyword in CONFIG_KEYWORDS):
+            return INVALID_INPUT
+
+        if self.mode == 'config-if':
+            return self.device.configure_interface(self.interface, command)
+
+        return ''
+
+class DeviceServer(paramiko.ServerInterface):
+    """ device server
+    paramiko server side of a simulated device, a password login followed
+    by a shell with a pty """
+
+    def __init__(self, user, password):
+        self.user = user
+        self.password = password
+        self.shell_requested = threading.Event()
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if username == self.user and password == self.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height,
+                                  pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_window_change_request(self, channel, width, height,
+                                            pixelwidth, pixelheight):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell_requested.set()
+        return True
+
+class DeviceFarm:
+    """ device farm
+    count simulated devices, each listening on its own localhost port. the
+    devices are served from a few background threads until stop is called,
+    use it as a context manager to have that done automatically """
+
+    def __init__(self, count=1, latency=0.0, jitter=0.0, interfaces=16,
+                 bgp_routes=1000, credentials=('admin', 'cisco', 'cisco'),
+                 host='127.0.0.1'):
+        # answers are held back for latency seconds, give or take jitter
+        self.latency = latency
+        self.jitter = jitter
+
+        self.host = host
+        self.user, self.password, enable_secret = credentials
+
+        self.devices = [
+            SimulatedDevice(
+                'R' + str(index), index, interfaces, bgp_routes, enable_secret,
+                )
+            for index in range(1, count + 1)
+        ]
+
+        # {listening socket : device}
+        self.listeners = {}
+        self.selector = selectors.DefaultSelector()
+        self.running = False
+
+        # transports of every connection, closed when the farm stops
+        self.transports = []
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """ start
+        binds a free port for every device and starts accepting logins """
+
+        farm_host_key()
+
+        for device in self.devices:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((self.host, 0))
+            listener.listen(64)
+            listener.setblocking(False)
+
+            self.listeners[listener] = device
+            self.selector.register(listener, selectors.EVENT_READ, device)
+
+        self.running = True
+
+        # a single thread accepts the logins of every device
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    def addresses(self):
+        """ addresses
+        'host:port' of every device, in device order
+
+        output -> ['127.0.0.1:40001', '127.0.0.1:40002', ...]
+        """
+
+        ports = {}
+        for listener, device in self.listeners.items():
+            ports[device.hostname] = listener.getsockname()[1]
+
+        return [self.host + ':' + str(ports[device.hostname]) for device in self.devices]
+
+    def reset(self):
+        """ reset
+        every device back to the lab state """
+
+        for device in self.devices:
+            device.reset()
+
+    def stop(self):
+        """ stop
+        stops accepting logins and drops every connection """
+
+        self.running = False
+
+        for listener in self.listeners:
+            self.selector.unregister(listener)
+            listener.close()
+
+        self.listeners = {}
+
+        with self.lock:
+            transports = self.transports
+            self.transports = []
+
+        for transport in transports:
+            transport.close()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                events = self.selector.select(timeout=0.5)
+            except (OSError, ValueError):
+                return
+
+            for key, _ in events:
+                try:
+                    connection, _ = key.fileobj.accept()
+                except OSError:
+                    continue
+
+                connection.setblocking(True)
+                threading.Thread(
+                    target=self.serve_connection, args=(connection, key.data),
+                    daemon=True,
+                    ).start()
+
+    def serve_connection(self, connection, device):
+        """ serve connection
+        ssh server side of a single login, up to the end of its shell """
+
+        transport = paramiko.Transport(connection)
+        transport.add_server_key(farm_host_key())
+
+        with self.lock:
+            self.transports.append(transport)
+
+        server = DeviceServer(self.user, self.password)
+
+        try:
+            transport.start_server(server=server)
+
+            channel = transport.accept(20)
+            if channel is None or not server.shell_requested.wait(20):
+                return
+
+            self.serve_shell(channel, DeviceSession(device))
+        except (EOFError, OSError, paramiko.SSHException):
+            pass
+        finally:
+            transport.close()
+
+            with self.lock:
+                if transport in self.transports:
+                    self.transports.remove(transport)
+
+    def delay(self):
+        return max(self.latency + random.uniform(-self.jitter, self.jitter), 0.0)
+
+    def serve_shell(self, channel, session):
+        """ serve shell
+        reads the lines typed in and sends every answer once its latency is
+        up. answers are queued instead of slept on, so that commands that are
+        written ahead are answered on time and in order """
+
+        # [(due time, answer), ...] in the order they were typed in
+        pending = [(time.perf_counter() + self.delay(), session.banner())]
+        buffered = b''
+
+        while not session.closed or pending:
+            now = time.perf_counter()
+
+            # send every answer that is due
+            while pending and pending[0][0] <= now:
+                channel.sendall(pending.pop(0)[1])
+
+            if session.closed:
+                if pending:
+                    time.sleep(pending[0][0] - now)
+                continue
+
+            # wait for more input, or until the next answer is due
+            channel.settimeout(pending[0][0] - now if pending else None)
+
+            try:
+                data = channel.recv(4096)
+            except socket.timeout:
+                continue
+
+            if not data:
+                return
+
+            buffered += data
+            received = time.perf_counter()
+
+            while b'\n' in buffered and not session.closed:
+                line, buffered = buffered.split(b'\n', 1)
+                answer = session.handle(line.decode('utf-8', errors='replace').rstrip('\r'))
+
+                # never overtake the answer before this one
+                due = received + self.delay()
+                if pending:
+                    due = max(due, pending[-1][0])
+
+                pending.append((due, answer))
+
+        channel.close()
+
+def main():
+    # number of devices and latency in seconds
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+
+    with DeviceFarm(count, latency=latency) as farm:
+        print('Serving ' + str(count) + ' devices, login admin / cisco, enable cisco\n')
+
+        for device, address in zip(farm.devices, farm.addresses()):
+            print(device.hostname + ' ' + address)
+
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
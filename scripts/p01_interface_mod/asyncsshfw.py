@@ -0,0 +1,200 @@
+""" asyncio ssh framework
+asyncssh based version of the expect trailing method in sshfw, meant for
+driving thousands of routers from a single event loop instead of one os
+thread per router. the surface is the same as the sshfw classes, only every
+method has to be awaited """
+
+import asyncio
+import time
+
+from sshfw import (
+    SSHCommandTimeout, PromptMatcher, compile_prompt, learned_prompt,
+    user_credentials_prompt,
+    )
+
+
+class SSHAsyncMethod:
+
+    # connection and shell, once login got that far
+    ssh_connection = None
+    ssh_session = None
+
+    def __init__(self, credentials=None, prompt_pattern=None, command_timeout=30):
+        # credentials can be shared between sessions, prompt user otherwise
+        if credentials is None:
+            credentials = user_credentials_prompt()
+
+        self.user, self.user_pw, self.enable_pw = credentials
+
+        # optional user supplied prompt regex, learned after login otherwise
+        self.prompt_pattern = prompt_pattern
+
+        # hard limit in seconds for a single command to return a prompt
+        self.command_timeout = command_timeout
+
+    async def login(self, switch, port=22):
+        """ login
+        logs into specified switch, switches that do not listen on port 22
+        can be given as 'host:port' """
+
+        # only required once a switch is logged into, so imported here
+        import asyncssh
+
+        host, _, switch_port = switch.partition(':')
+        if switch_port:
+            port = int(switch_port)
+
+        # connect to switch, host keys are not checked just like the
+        # auto add policy of the paramiko framework
+        self.ssh_connection = await asyncssh.connect(
+            host,
+            port=port,
+            username=self.user,
+            password=self.user_pw,
+            known_hosts=None,
+            client_keys=None,
+            agent_path=None,
+            )
+
+        # invoke an interactive shell with a pty, raw bytes in and out
+        self.ssh_session = await self.ssh_connection.create_process(
+            term_type='vt100',
+            encoding=None,
+            )
+
+        # wait for the first prompt and learn the prompt of this switch
+        await self.learn_prompt()
+
+    async def learn_prompt(self):
+        """ learn prompt
+        reads the login banner up to the first prompt and learns the prompt
+        of this switch out of its hostname, unless the user asked for a
+        prompt of their own """
+
+        # start with the generic prompt or whatever the user asked for
+        self.prompt_regex = compile_prompt(self.prompt_pattern)
+        banner = await self.read_until_prompt()
+
+        if not self.prompt_pattern:
+            self.prompt_regex = learned_prompt(banner)
+
+    async def read_until_prompt(self, skip_config_prompts=False):
+        """ read until prompt
+        waits on the event loop until data arrives and returns as soon as the
+        last line of the output matches the prompt regex. configuration mode
+        prompts can be skipped to wait for the end of a config block """
+
+        prompt_matcher = PromptMatcher(self.prompt_regex, skip_config_prompts)
+
+        # hard deadline for this command
+        deadline = time.time() + self.command_timeout
+
+        while True:
+            # time left before the switch is considered hung
+            time_left = deadline - time.time()
+
+            try:
+                # read everything that is currently available
+                chunk = await asyncio.wait_for(
+                    self.ssh_session.stdout.read(65535), max(time_left, 0),
+                    )
+            except asyncio.TimeoutError:
+                raise SSHCommandTimeout(
+                    'no prompt received within ' + str(self.command_timeout) +
+                    ' seconds, last output: ' + prompt_matcher.tail()
+                    )
+
+            # an empty read means the switch closed the session on us
+            if not chunk:
+                raise EOFError('ssh session closed while waiting for prompt')
+
+            if prompt_matcher.feed(chunk):
+                break
+
+        return prompt_matcher.output()
+
+    async def enable_mode(self):
+        """ enable mode
+        get into enable mode """
+
+        await self.send_command('enable')
+        await self.send_command(self.enable_pw)
+
+    async def no_paging(self):
+        """ no paging
+        remove any paging, and widen the terminal so that long lines are
+        echoed whole instead of scrolled """
+
+        await self.send_command('terminal len 0')
+        await self.send_command('terminal width 511')
+
+    async def send_command(self, command):
+        """ send command
+        sends our command to the switch and waits for the prompt """
+
+        # send command over to the switch
+        self.ssh_session.stdin.write((command + '\n').encode('utf-8'))
+
+        # wait for the prompt to show up at the end of the output
+        return await self.read_until_prompt()
+
+    async def send_config_block(self, commands):
+        """ send config block
+        writes the entire configuration block in one go and waits once for
+        the final prompt, the block is expected to leave configuration mode
+        with 'end' as its last line """
+
+        # send every line over to the switch at the same time
+        self.ssh_session.stdin.write(('\n'.join(commands) + '\n').encode('utf-8'))
+
+        # wait for the enable mode prompt after the configuration prompts
+        return await self.read_until_prompt(skip_config_prompts=True)
+
+    async def close_ssh_session(self):
+        """ close ssh session
+        closes the current session and its connection, whatever part of
+        them a failed login got to open """
+
+        if self.ssh_session is not None:
+            self.ssh_session.close()
+
+        if self.ssh_connection is not None:
+            self.ssh_connection.close()
+            await self.ssh_connection.wait_closed()
+
+
+async def run_on_routers(routers, router_job, max_sessions=500, device_timeout=300):
+    """ run on routers
+    runs the router_job coroutine function against every router from a single
+    event loop. a semaphore caps how many routers are worked on at the same
+    time and every router has its own timeout
+
+    input -> router_job = async function(router) returning the router result
+    output -> results = {router : result, ...}
+              errors = {router : exception, ...}
+    """
+
+    # limit the number of open sessions at any given time
+    semaphore = asyncio.Semaphore(max_sessions)
+
+    async def run_one(router):
+        async with semaphore:
+            return await asyncio.wait_for(router_job(router), device_timeout)
+
+    # start every router and wait for all of them, errors included
+    outcomes = await asyncio.gather(
+        *[run_one(router) for router in routers],
+        return_exceptions=True,
+        )
+
+    # initialize the per router results and errors
+    results = {}
+    errors = {}
+
+    for router, outcome in zip(routers, outcomes):
+        if isinstance(outcome, Exception):
+            errors[router] = outcome
+        else:
+            results[router] = outcome
+
+    return results, errors
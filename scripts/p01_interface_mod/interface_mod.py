@@ -10,6 +10,9 @@ from sshfw import *
 # import over the time library to keep track of execution time
 import time
 
+# import a thread pool to work on several routers at the same time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 def parse_show_ip_int_brief(conn, router):
     """ parse show ip int brief
     this will contain the logic that we need to go through the
@@ -22,9 +25,19 @@ def parse_show_ip_int_brief(conn, router):
     # track of what's going on currently in the script
     print("ROUTER " + router + ": RUNNING 'SHOW IP INT BRIEF'")
 
-    # collect the show ip int brief output
+    # collect the show ip int brief output, parsed right away so that the
+    # down ports can be cached along with it
     command = 'show ip int brief'
-    show_ip_int_brief_output = conn.send_command(command)
+    show_ip_int_brief_output, down_port_list = conn.cached_command(
+        command, find_down_ports,
+        )
+
+    return down_port_list
+
+def find_down_ports(show_ip_int_brief_output):
+    """ find down ports
+    goes through the 'show ip int brief' output and returns the ports that
+    are admin up yet link-down, no matter how the output was collected """
 
     # initialize the down port list
     down_port_list = []
@@ -56,49 +69,203 @@ def parse_show_interface(conn, router, down_port_list):
     # initialize our new dictionary
     description_dictionary = {}
 
-    # now iterate through the newly generated down port list
-    for down_port in down_port_list:
-        # further initialize our dictionary using down port as key
-        description_dictionary[down_port] = ''
+    # no down ports, nothing to ask the switch
+    if not down_port_list:
+        return description_dictionary
 
-        # initialize the exact command string to send to switch
-        command = 'show interface ' + down_port
+    # initialize the exact command strings to send to switch
+    commands = ['show interface ' + down_port for down_port in down_port_list]
 
+    for command in commands:
         # useful CLI message to send so that we can keep
         # track of what's going on currently in the script
         print("ROUTER " + router + ": RUNNING '" + command.upper() + "'")
 
-        # run show interface x/x to collect the exact description we need
-        show_interface_output = conn.send_command(command)
-
-        # check if description in the output at all
-        if 'Description:' in show_interface_output:
-            # iterate through output to find the exact description location
-            # and then replace the empty description in our dictionary
-            for line in show_interface_output.splitlines():
-                # once the exact line with the description has been located...
-                if 'Description:' in line:
-                    # proceed to replace the existing empty description
-                    # within our dictionary, note how this is being split
-                    # is based off our expected command output
-                    # "Description: host" <- expected line
-                    description = line.split(':')[1]
-                    description_dictionary[down_port] = description
+    # run show interface x/x for every port to collect the exact descriptions
+    # we need, pipelined when the session method supports it
+    show_interface_outputs = conn.cached_commands(commands, find_description)
+
+    # now iterate through the newly generated down port list
+    for down_port, (show_interface_output, description) in zip(
+            down_port_list, show_interface_outputs):
+        # replace the empty description in our dictionary
+        description_dictionary[down_port] = description
+
+    return description_dictionary
+
+def find_description(show_interface_output):
+    """ find description
+    goes through the 'show interface x/x' output and returns the description
+    of the port, or an empty description if there is none """
+
+    # initialize the empty description
+    description = ''
+
+    # check if description in the output at all
+    if 'Description:' in show_interface_output:
+        # iterate through output to find the exact description location
+        for line in show_interface_output.splitlines():
+            # once the exact line with the description has been located...
+            if 'Description:' in line:
+                # proceed to replace the existing empty description,
+                # note how this is being split is based off our expected
+                # command output
+                # "Description: host" <- expected line, the description
+                # itself may contain ':' as well
+                description = line.split(':', 1)[1].strip()
+
+    return description
+
+def short_interface_name(port):
+    """ short interface name
+    'show interfaces description' abbreviates the port names, so we shorten
+    the full names from 'show ip int brief' the same way in order to match
+    them, for example FastEthernet0/1 -> Fa0/1 and Serial0/1 -> Se0/1 """
+
+    # split the port into its name and its numbering
+    name = port
+    for i, char in enumerate(port):
+        if char.isdigit():
+            name = port[:i]
+            break
+
+    return name[:2].capitalize() + port[len(name):]
+
+def parse_show_interfaces_description(conn, router):
+    """ parse show interfaces description
+    collects the status and description of every port on the router with one
+    single command instead of one 'show interface x/x' per port. the output
+    is parsed in one pass using the column positions of the header line
+
+    output -> interface_dictionary = {port1 : (status1, description1), ...}
+    """
+
+    # useful CLI message to send so that we can keep
+    # track of what's going on currently in the script
+    print("ROUTER " + router + ": RUNNING 'SHOW INTERFACES DESCRIPTION'")
+
+    # collect the show interfaces description output
+    command = 'show interfaces description'
+    show_interfaces_description_output, interface_dictionary = conn.cached_command(
+        command, find_interface_descriptions,
+        )
+
+    return interface_dictionary
+
+def find_interface_descriptions(show_interfaces_description_output):
+    """ find interface descriptions
+    goes through the 'show interfaces description' output in one pass using
+    the column positions of the header line
+
+    output -> interface_dictionary = {port1 : (status1, description1), ...}
+    """
+
+    # initialize our new dictionary
+    interface_dictionary = {}
+
+    # column positions, known once the header line has been found
+    status_column = None
+
+    for line in show_interfaces_description_output.splitlines():
+        # the header line tells us where each column starts
+        # "Interface   Status   Protocol Description" <- expected header
+        if status_column is None:
+            if line.startswith('Interface') and 'Description' in line:
+                status_column = line.index('Status')
+                protocol_column = line.index('Protocol')
+                description_column = line.index('Description')
+            continue
+
+        # skip the echoed prompt and any empty lines
+        if len(line) < status_column or not line[:status_column].strip():
+            continue
+
+        port = line[:status_column].strip()
+        status = line[status_column:protocol_column].strip()
+        description = line[description_column:].strip()
+
+        interface_dictionary[short_interface_name(port)] = (status, description)
+
+    return interface_dictionary
+
+def use_bulk_descriptions(down_port_list, bulk_threshold=4):
+    """ use bulk descriptions
+    tells how to collect the descriptions of the down ports. a few ports are
+    cheaper one by one, but once there are more than bulk_threshold ports a
+    single 'show interfaces description' saves a round trip per port """
+
+    return len(down_port_list) > bulk_threshold
+
+def collect_descriptions(conn, router, down_port_list, bulk_threshold=4):
+    """ collect descriptions
+    collects the descriptions of the down ports, one by one or all at once
+    as picked by use_bulk_descriptions
+
+    output -> description_dictionary = {downport1 : description1, downport2...}
+    """
+
+    # not many ports, stick to 'show interface x/x' for each port
+    if not use_bulk_descriptions(down_port_list, bulk_threshold):
+        return parse_show_interface(conn, router, down_port_list)
+
+    # collect every port at once
+    interface_dictionary = parse_show_interfaces_description(conn, router)
+
+    return pick_down_port_descriptions(interface_dictionary, down_port_list)
+
+def pick_down_port_descriptions(interface_dictionary, down_port_list):
+    """ pick down port descriptions
+    keeps only the down ports out of the 'show interfaces description' data
+
+    output -> description_dictionary = {downport1 : description1, downport2...}
+    """
+
+    # initialize our new dictionary
+    description_dictionary = {}
+
+    # keep only the down ports, using the description if there is one
+    for down_port in down_port_list:
+        status, description = interface_dictionary.get(
+            short_interface_name(down_port), ('', ''),
+            )
+        description_dictionary[down_port] = description
 
     return description_dictionary
 
-def configure_interfaces(conn, router, description_dictionary):
+def configure_interfaces(conn, router, description_dictionary, batch=True):
     """ configure interfaces
     enter into 'config t' mode and actually start the configuration of our
     interfaces based off the newly created description dictionary. our goal
     is to make sure to append existing descriptions with our message and also
-    shutting down each description as well per our requirements """
+    shutting down each description as well per our requirements. in batch mode
+    the whole configuration is sent to the router in one go and any lines the
+    router rejected are raised as an SSHConfigError """
+
+    # the full list of conf t commands for this router
+    config_block = build_config_block(router, description_dictionary)
+
+    # one line at a time, waiting for the router after every line
+    if not batch:
+        for command in config_block:
+            conn.send_command(command)
+        return
+
+    # the whole configuration block at once, with a single wait
+    config_output = conn.send_config_block(config_block)
+
+    # check which lines, if any, were rejected by the router
+    check_config_output(router, config_block, config_output)
+
+def build_config_block(router, description_dictionary):
+    """ build config block
+    builds the list of configuration lines, from 'config t' to 'end', that
+    appends our message to the descriptions and shuts down every port """
 
     # our message that we need to append to our descriptions
     append = '(audit item - admin down 2017)'
 
     # enter into configuration terminal
-    conn.send_command('config t')
+    config_block = ['config t']
 
     # iterate through our existing description dictionary
     for down_port, description in sorted(description_dictionary.items()):
@@ -116,59 +283,216 @@ def configure_interfaces(conn, router, description_dictionary):
             description = append
 
         # these are our conf t commands to configure the interface
-        conn.send_command('interface ' + down_port)
-        conn.send_command('desc ' + description)
-        conn.send_command('shutdown')
+        config_block.append('interface ' + down_port)
+        config_block.append('desc ' + description)
+        config_block.append('shutdown')
 
     # end out of configuration terminal after updates have been made
-    conn.send_command('end')
+    config_block.append('end')
 
-def interface_mod_script(routers):
-    """ main method to run the logic for the interface modification script """
+    return config_block
 
-    # pick and choose which conceptual idea to run by uncommenting
-    #conn = SSHTimerMethod()
-    conn = SSHTrailingMethod()
+def check_config_output(router, config_block, config_output):
+    """ check config output
+    reports every line of the configuration block the router rejected and
+    raises them as an SSHConfigError """
 
-    # start timer to measure elapsed time
-    start_timer = time.time()
+    config_errors = find_config_errors(config_block, config_output)
 
-    # log into each router by iterating list
-    for router in routers:
-        # log into specified router
-        conn.login(router)
+    for command, error in config_errors:
+        print("ROUTER " + router + ": ERROR ON '" + command + "' - " + error)
 
-        # enter into enable mode
-        conn.enable_mode()
+    if config_errors:
+        raise SSHConfigError(config_errors)
 
-        # run term len 0 to prevent paging
-        conn.no_paging()
+def modify_router(session_pool, router, output_cache=None, dry_run=False):
+    """ modify router
+    runs the full interface modification logic against a single router.
+    every router gets its own session object out of the session pool so that
+    routers can be worked on at the same time without overwriting each other's
+    ssh session, and a warm session is reused when there is one. a dry run
+    only audits the router, and with an output cache it may not even have to
+    log in """
 
+    # borrow a logged in, enabled and no paging session for this router
+    with session_pool.session(router, output_cache) as conn:
         # launch our parser function for show ip int brief output and
         # generate our down port list as a direct result
         down_port_list = parse_show_ip_int_brief(conn, router)
 
-        # launch our parser function for show interface output and
+        # launch our parser function for show interface output, or show
+        # interfaces description if there are a lot of down ports, and
         # generate our description dictionary as a direct result
-        description_dictionary = parse_show_interface(conn, router, down_port_list)
+        description_dictionary = collect_descriptions(conn, router, down_port_list)
+
+        # launch our configuration function, unless only auditing
+        if not dry_run:
+            configure_interfaces(conn, router, description_dictionary)
+
+    return description_dictionary
+
+def interface_mod_script(routers, max_workers=10, session_pool=None, profiler=None,
+                         output_cache=None, dry_run=False):
+    """ main method to run the logic for the interface modification script
+    up to max_workers routers are modified at the same time, so the total
+    execution time follows the slowest router instead of the sum of them.
+    pass in an existing session pool to keep the sessions warm for later runs.
+    pass in a profiler to get a timing summary of every router at the end.
+    pass in an output cache to reuse the show outputs of earlier runs, and
+    dry_run to only report the ports that would be modified
+
+    output -> results = {router : description_dictionary, ...}
+              errors = {router : exception, ...}
+    """
 
-        # launch our configuration function
-        configure_interfaces(conn, router, description_dictionary)
+    # without a pool from the caller, the sessions only live for this run
+    close_pool = session_pool is None
 
-        # close the entire session to that switch
-        conn.close_ssh_session()
+    if session_pool is None:
+        # pick and choose which conceptual idea to run by uncommenting
+        #session_pool = SSHSessionPool(session_method=SSHTimerMethod, profiler=profiler)
+        #session_pool = SSHSessionPool(session_method=SSHAdaptiveTimerMethod, profiler=profiler)
+        session_pool = SSHSessionPool(session_method=SSHTrailingMethod, profiler=profiler)
+
+    # initialize the per router results and errors
+    results = {}
+    errors = {}
+
+    # start timer to measure elapsed time
+    start_timer = time.time()
+
+    # hand every router over to the bounded worker pool
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for router in routers:
+            future = executor.submit(
+                modify_router, session_pool, router, output_cache, dry_run,
+                )
+            futures[future] = router
+
+        # collect each router as soon as it has finished
+        for future in as_completed(futures):
+            router = futures[future]
+            try:
+                results[router] = future.result()
+            except Exception as error:
+                # one broken router should not stop the others
+                print("ROUTER " + router + ": FAILED - " + str(error))
+                errors[router] = error
 
     # end timer
     end_timer = time.time()
 
     print("\nExecution Time: " + str(end_timer-start_timer))
 
+    # where the time went, per router and per phase
+    if profiler is not None:
+        profiler.summary()
+
+    # close the entire session to every switch
+    if close_pool:
+        session_pool.close_all()
+
+    return results, errors
+
+async def modify_router_async(conn, router, bulk_threshold=4):
+    """ modify router async
+    same logic as modify_router, driven through an asyncio session """
+
+    # enter into enable mode and prevent paging
+    await conn.enable_mode()
+    await conn.no_paging()
+
+    # collect the admin up yet link-down ports
+    print("ROUTER " + router + ": RUNNING 'SHOW IP INT BRIEF'")
+    output = await conn.send_command('show ip int brief')
+    down_port_list = find_down_ports(output)
+
+    # collect the descriptions, all at once if there are a lot of down ports
+    if not use_bulk_descriptions(down_port_list, bulk_threshold):
+        description_dictionary = {}
+        for down_port in down_port_list:
+            command = 'show interface ' + down_port
+            print("ROUTER " + router + ": RUNNING '" + command.upper() + "'")
+            output = await conn.send_command(command)
+            description_dictionary[down_port] = find_description(output)
+    else:
+        print("ROUTER " + router + ": RUNNING 'SHOW INTERFACES DESCRIPTION'")
+        output = await conn.send_command('show interfaces description')
+        description_dictionary = pick_down_port_descriptions(
+            find_interface_descriptions(output), down_port_list,
+            )
+
+    # push the whole configuration block at once
+    config_block = build_config_block(router, description_dictionary)
+    config_output = await conn.send_config_block(config_block)
+    check_config_output(router, config_block, config_output)
+
+    return description_dictionary
+
+def interface_mod_script_async(routers, max_sessions=500, device_timeout=300,
+                               credentials=None):
+    """ asyncio version of the interface modification script
+    every router runs on a single event loop, up to max_sessions at the same
+    time, which scales to thousands of routers without a thread per router.
+    the credentials are asked for once unless they are passed in
+
+    output -> results = {router : description_dictionary, ...}
+              errors = {router : exception, ...}
+    """
+
+    # only required for this mode, so imported here
+    import asyncio
+    from asyncsshfw import SSHAsyncMethod, run_on_routers
+
+    # ask for the credentials once, they are shared by every session
+    if credentials is None:
+        credentials = user_credentials_prompt()
+
+    async def router_job(router):
+        # every router gets its own session
+        conn = SSHAsyncMethod(credentials=credentials)
+        try:
+            # a login that fails or times out half way is cleaned up as well
+            await conn.login(router)
+            return await modify_router_async(conn, router)
+        finally:
+            await conn.close_ssh_session()
+
+    # start timer to measure elapsed time
+    start_timer = time.time()
+
+    results, errors = asyncio.run(
+        run_on_routers(routers, router_job, max_sessions, device_timeout)
+        )
+
+    for router, error in sorted(errors.items()):
+        print("ROUTER " + router + ": FAILED - " + repr(error))
+
+    # end timer
+    end_timer = time.time()
+
+    print("\nExecution Time: " + str(end_timer-start_timer))
+
+    return results, errors
+
 def main():
     # set up a list for all routers we need to log into
     routers = ['10.0.0.1', '10.2.0.1', '10.3.0.1']
 
-    # run the main logic of our script
-    interface_mod_script(routers)
+    # run the main logic of our script, 10 routers at a time
+    interface_mod_script(routers, max_workers=10)
+
+    # same, with every phase and command timed and logged as json lines
+    #profiler = SSHProfiler('interface_mod_profile.jsonl')
+    #interface_mod_script(routers, max_workers=10, profiler=profiler)
+    #profiler.close()
+
+    # audit only, with the show outputs cached for the real run afterwards
+    #output_cache = OutputCache('interface_mod_cache.db', ttl=600)
+    #interface_mod_script(routers, max_workers=10, output_cache=output_cache, dry_run=True)
+    #interface_mod_script(routers, max_workers=10, output_cache=output_cache)
+    #output_cache.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
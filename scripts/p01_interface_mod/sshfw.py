@@ -4,8 +4,589 @@ demonstrates the two techniques as described in the conceptual article """
 
 import paramiko
 import getpass
+import json
+import select
+import socket
+import sqlite3
+import threading
 import time
+import re
 
+from contextlib import contextmanager
+
+
+class SSHCommandTimeout(Exception):
+    """ ssh command timeout
+    raised when a switch does not return a prompt within the command timeout """
+
+
+class SSHConfigError(Exception):
+    """ ssh config error
+    raised when a switch rejects lines of a configuration block """
+
+    def __init__(self, config_errors):
+        self.config_errors = config_errors
+
+        super().__init__(
+            '; '.join(command + ' -> ' + error for command, error in config_errors)
+            )
+
+
+def find_config_errors(commands, output):
+    """ find config errors
+    scans the combined output of a configuration block for error markers
+    such as '% Invalid input' and attributes each of them back to the line
+    that caused it. the switch echoes every line back in order, so we follow
+    the echoes to know which line the error messages belong to
+
+    output -> config_errors = [(command1, error1), (command2, error2), ...]
+    """
+
+    # initialize the errors found and the position in the commands sent
+    config_errors = []
+    next_command = 0
+    current_command = ''
+
+    for line in output.splitlines():
+        line = line.strip()
+
+        # echo of the next command that was sent, possibly after a prompt
+        if next_command < len(commands) and commands[next_command] and \
+                echoes_command(line, commands[next_command]):
+            current_command = commands[next_command]
+            next_command += 1
+            continue
+
+        # error messages all start with '%'
+        if line.startswith('%') and (
+                'Invalid' in line or 'Error' in line or
+                'Incomplete' in line or 'Ambiguous' in line):
+            config_errors.append((current_command, line))
+
+    return config_errors
+
+def echoes_command(line, command):
+    """ echoes command
+    tells if the line is the echo of the command, possibly after a prompt.
+    a line that does not fit the terminal width is scrolled by the switch,
+    which only echoes part of it with a '$' where the rest was cut off,
+    for example 'R1(config-if)#$ption uplink (audit item - admin down 2017)' """
+
+    if line.endswith(command):
+        return True
+
+    # what was typed after the prompt, without the scroll markers
+    echo = re.sub(r'^\S*?[#>]', '', line).strip()
+    scrolled_left = echo.startswith('$')
+    scrolled_right = echo.endswith('$') and len(echo) > 1
+    echo = echo.strip('$').strip()
+
+    if not echo or not (scrolled_left or scrolled_right):
+        return False
+
+    # scrolled on both sides, only the middle of the line is echoed
+    if scrolled_left and scrolled_right:
+        return echo in command
+    if scrolled_left:
+        return command.endswith(echo)
+
+    return command.startswith(echo)
+
+def wait_readable(channel, timeout):
+    """ wait readable
+    waits up to timeout seconds for the channel to have data to read. poll
+    is used where there is one, select cannot watch file descriptors past
+    1024, which a few hundred open sessions easily go beyond """
+
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(channel, select.POLLIN)
+        return bool(poller.poll(timeout * 1000))
+
+    readable, _, _ = select.select([channel], [], [], timeout)
+
+    return bool(readable)
+
+# generic prompt used until the real prompt has been learned after login
+# any space free last line that ends with '#' or '>'
+DEFAULT_PROMPT_PATTERN = rb'\s*\S+[#>]\s*$'
+
+def compile_prompt(prompt_pattern=None):
+    """ compile prompt
+    prompt regex out of a user supplied pattern, str or bytes, or the
+    generic prompt if there is none """
+
+    if not prompt_pattern:
+        prompt_pattern = DEFAULT_PROMPT_PATTERN
+
+    if isinstance(prompt_pattern, str):
+        prompt_pattern = prompt_pattern.encode('utf-8')
+
+    return re.compile(prompt_pattern)
+
+def learned_prompt(banner):
+    """ learned prompt
+    builds the prompt regex of a switch out of the hostname at the end of
+    its login banner, for example 'R1>' allows 'R1>', 'R1#', 'R1(config)#'
+    and 'R1(config-if)#' as well as a password prompt """
+
+    # the hostname is the last line without the trailing '>' or '#'
+    hostname = banner.splitlines()[-1].strip()[:-1].encode('utf-8')
+
+    # hostname prompt in any mode or a password prompt
+    return re.compile(
+        rb'\s*(?:' + re.escape(hostname) + rb'(?:\([\w.\-]+\))?[#>]'
+        rb'|\S*[Pp]assword:)\s*$'
+        )
+
+class PromptMatcher:
+    """ prompt matcher
+    collects the raw output of a switch as it comes in, and tells as soon as
+    its last line matches the prompt regex. only the new trailing line is
+    checked, not the entire output collected so far. configuration mode
+    prompts can be skipped to wait for the end of a config block. shared by
+    the paramiko and the asyncio frameworks, which only differ in how they
+    wait for the chunks """
+
+    def __init__(self, prompt_regex, skip_config_prompts=False):
+        self.prompt_regex = prompt_regex
+        self.skip_config_prompts = skip_config_prompts
+
+        # collect the raw bytes, decoded only once at the very end
+        self.data = bytearray()
+
+        # start of the current last line of data
+        self.last_line_start = 0
+
+    def feed(self, chunk):
+        """ feed
+        adds a chunk of output, True once the switch is back at its prompt """
+
+        data = self.data
+        data += chunk
+
+        # move the start of the last line forward if a new line came in
+        newline = data.rfind(b'\n', self.last_line_start)
+        if newline != -1:
+            self.last_line_start = newline + 1
+
+        # enable mode, config mode, user mode or password prompt
+        if not self.prompt_regex.match(data, self.last_line_start):
+            return False
+
+        # keep going while still inside the configuration block
+        if self.skip_config_prompts and \
+                data.find(b'(config', self.last_line_start) != -1:
+            return False
+
+        return True
+
+    def output(self):
+        """ output
+        everything collected so far, decoded """
+
+        return self.data.decode('utf-8', errors='replace')
+
+    def tail(self):
+        """ tail
+        the end of the output, for error messages """
+
+        return repr(bytes(self.data[-80:]))
+
+def percentile(values, percent):
+    """ percentile
+    nearest rank percentile of a list of values """
+
+    values = sorted(values)
+
+    # the smallest value that has at least percent of the values at or below it
+    rank = max(int(-(-len(values) * percent // 100)), 1)
+
+    return values[rank - 1]
+
+class SSHProfiler:
+    """ ssh profiler
+    collects how long every login phase and every command took on every
+    switch, along with the bytes received and the number of reads it took.
+    events are kept in memory for the summary at the end of the run, and
+    optionally streamed to a json lines file as they happen. quick deploy
+    records its devices through the same profiler """
+
+    def __init__(self, filename=None):
+        # every event recorded so far
+        self.events = []
+        self.lock = threading.Lock()
+
+        # json lines file, one event per line
+        self.log_file = open(filename, 'a') if filename else None
+
+    def record(self, switch, phase, duration, command=None, bytes_received=0,
+               recv_loops=0):
+        """ record
+        records a single event, the command is left out of phases such as
+        enable_mode so that the enable password never ends up in the log """
+
+        event = {
+            'time': time.time(),
+            'switch': switch,
+            'phase': phase,
+            'command': command,
+            'duration': duration,
+            'bytes': bytes_received,
+            'recv_loops': recv_loops,
+        }
+
+        with self.lock:
+            self.events.append(event)
+
+            if self.log_file is not None:
+                self.log_file.write(json.dumps(event) + '\n')
+                self.log_file.flush()
+
+    def summary(self):
+        """ summary
+        prints the total time per switch, where it was spent, and the
+        p50 / p95 / p99 duration of every phase across all switches """
+
+        with self.lock:
+            events = list(self.events)
+
+        # {switch : [events]}, {phase : [durations]}
+        switch_events = {}
+        phase_durations = {}
+
+        for event in events:
+            switch_events.setdefault(event['switch'], []).append(event)
+            phase_durations.setdefault(event['phase'], []).append(event['duration'])
+
+        print('\n%-20s %8s %9s %10s  %s' % (
+            'SWITCH', 'EVENTS', 'TOTAL(s)', 'BYTES', 'SLOWEST'))
+
+        # slowest switch first
+        for switch, switch_event_list in sorted(
+                switch_events.items(),
+                key=lambda item: -sum(event['duration'] for event in item[1])):
+            slowest = max(switch_event_list, key=lambda event: event['duration'])
+
+            print('%-20s %8d %9.3f %10d  %s %.3fs' % (
+                switch,
+                len(switch_event_list),
+                sum(event['duration'] for event in switch_event_list),
+                sum(event['bytes'] for event in switch_event_list),
+                slowest['command'] or slowest['phase'],
+                slowest['duration'],
+                ))
+
+        print('\n%-20s %8s %9s %9s %9s %9s' % (
+            'PHASE', 'COUNT', 'P50(s)', 'P95(s)', 'P99(s)', 'MAX(s)'))
+
+        for phase, durations in sorted(phase_durations.items()):
+            print('%-20s %8d %9.3f %9.3f %9.3f %9.3f' % (
+                phase,
+                len(durations),
+                percentile(durations, 50),
+                percentile(durations, 95),
+                percentile(durations, 99),
+                max(durations),
+                ))
+
+    def close(self):
+        """ close
+        closes the json lines file """
+
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+class OutputCache:
+    """ output cache
+    raw and parsed outputs of show commands, kept on disk by switch and
+    command so that later runs do not have to ask the switch again. entries
+    expire after ttl seconds, and the least recently used ones are evicted
+    once there are more than max_entries of them or once they take up more
+    than max_bytes. parsed results are stored as json. quick deploy keeps
+    the outputs of its devices in the same kind of cache """
+
+    def __init__(self, filename='output_cache.db', ttl=300, max_entries=10000,
+                 max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        # shared by every worker thread, one at a time
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+
+        # cheap commits, every lookup updates the last use of its entry
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS outputs ('
+            'switch TEXT, command TEXT, raw TEXT, parsed TEXT, '
+            'stored REAL, used REAL, size INTEGER, '
+            'PRIMARY KEY (switch, command))'
+            )
+        self.db.execute('CREATE INDEX IF NOT EXISTS outputs_used ON outputs (used)')
+        self.db.commit()
+
+    def get(self, switch, command):
+        """ get
+        cached output of the command on the switch, None if there is none or
+        it expired
+
+        output -> (raw, parsed)
+        """
+
+        now = time.time()
+
+        with self.lock:
+            row = self.db.execute(
+                'SELECT raw, parsed, stored FROM outputs '
+                'WHERE switch = ? AND command = ?', (switch, command),
+                ).fetchone()
+
+            if row is None:
+                return None
+
+            raw, parsed, stored = row
+
+            if now - stored > self.ttl:
+                self.db.execute(
+                    'DELETE FROM outputs WHERE switch = ? AND command = ?',
+                    (switch, command),
+                    )
+                self.db.commit()
+                return None
+
+            self.db.execute(
+                'UPDATE outputs SET used = ? WHERE switch = ? AND command = ?',
+                (now, switch, command),
+                )
+            self.db.commit()
+
+        return raw, json.loads(parsed)
+
+    def put(self, switch, command, raw, parsed=None):
+        """ put
+        caches the raw and parsed output of the command on the switch """
+
+        now = time.time()
+        parsed = json.dumps(parsed)
+
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (switch, command, raw, parsed, now, now, len(raw) + len(parsed)),
+                )
+            self.evict(now)
+            self.db.commit()
+
+    def evict(self, now):
+        """ evict
+        drops the expired entries, then the least recently used ones until
+        the cache is back within its bounds. called with the lock held """
+
+        self.db.execute('DELETE FROM outputs WHERE stored < ?', (now - self.ttl,))
+
+        entries, total = self.db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM outputs',
+            ).fetchone()
+
+        excess_entries = entries - self.max_entries
+        excess_bytes = total - self.max_bytes
+
+        if excess_entries <= 0 and excess_bytes <= 0:
+            return
+
+        evicted = []
+
+        for switch, command, size in self.db.execute(
+                'SELECT switch, command, size FROM outputs ORDER BY used'):
+            if excess_entries <= 0 and excess_bytes <= 0:
+                break
+
+            evicted.append((switch, command))
+            excess_entries -= 1
+            excess_bytes -= size
+
+        self.db.executemany(
+            'DELETE FROM outputs WHERE switch = ? AND command = ?', evicted,
+            )
+
+    def invalidate(self, switch):
+        """ invalidate
+        forgets every output of the switch, for when its config changed """
+
+        with self.lock:
+            self.db.execute('DELETE FROM outputs WHERE switch = ?', (switch,))
+            self.db.commit()
+
+    def close(self):
+        """ close
+        closes the cache file """
+
+        with self.lock:
+            self.db.close()
+
+class TimedSSHClient(paramiko.SSHClient):
+    """ timed ssh client
+    paramiko client that remembers how long the authentication took, so
+    that the key exchange and the authentication can be told apart """
+
+    auth_time = 0.0
+
+    def _auth(self, *args, **kwargs):
+        start = time.perf_counter()
+
+        try:
+            return super()._auth(*args, **kwargs)
+        finally:
+            self.auth_time = time.perf_counter() - start
+
+def connect_shell(switch, user, user_pw, profiler=None, port=22):
+    """ connect shell
+    logs into the switch and opens an interactive shell with a pty, shared
+    by both methods. with a profiler, the tcp connect, key exchange,
+    authentication and shell setup are each recorded as their own phase.
+    switches that do not listen on port 22 can be given as 'host:port' """
+
+    host, _, switch_port = switch.partition(':')
+    if switch_port:
+        port = int(switch_port)
+
+    # set up ssh client
+    ssh_setup = TimedSSHClient()
+
+    # add missing host key policy (set as auto)
+    ssh_setup.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+    start = time.perf_counter()
+
+    # open the tcp connection ourselves, so that it can be timed on its own
+    sock = socket.create_connection((host, port))
+
+    if profiler is not None:
+        connected = time.perf_counter()
+        profiler.record(switch, 'tcp_connect', connected - start)
+
+    # a failed key exchange, authentication or shell setup leaves the socket
+    # and the transport of the client behind otherwise
+    try:
+        # connect to switch
+        ssh_setup.connect(
+            host,
+            port=port,
+            username=user,
+            password=user_pw,
+            look_for_keys=False,
+            allow_agent=False,
+            sock=sock,
+            )
+
+        if profiler is not None:
+            authenticated = time.perf_counter()
+            profiler.record(
+                switch, 'ssh_kex', authenticated - connected - ssh_setup.auth_time,
+                )
+            profiler.record(switch, 'ssh_auth', ssh_setup.auth_time)
+
+        # set up transport channel for session
+        transport = ssh_setup.get_transport()
+
+        # invoke session
+        ssh_session = transport.open_session()
+
+        # set up for interactive mode, multiple commands - pty
+        ssh_session.get_pty()
+
+        # invoke session's shell
+        ssh_session.invoke_shell()
+    except Exception:
+        ssh_setup.close()
+        sock.close()
+        raise
+
+    # keep session active with parameters while class is initialized
+    ssh_session.keep_this = ssh_setup
+
+    if profiler is not None:
+        profiler.record(switch, 'open_shell', time.perf_counter() - authenticated)
+
+    return ssh_session
+
+class SSHProfiledSession:
+    """ ssh profiled session
+    timing hooks and fallbacks shared by both methods. nothing is measured
+    unless the session was given a profiler, and phases do not nest, so the
+    commands sent by enable_mode are part of the enable_mode phase """
+
+    profiler = None
+
+    # phase currently being timed, if any
+    current_phase = None
+
+    # bytes and reads of the current phase, counted by the read loops
+    recv_bytes = 0
+    recv_loops = 0
+
+    @contextmanager
+    def timed(self, phase, command=None):
+        """ timed
+        records the duration, bytes and reads of the block as one event """
+
+        # profiling disabled, or already inside another phase
+        if self.profiler is None or self.current_phase is not None:
+            yield
+            return
+
+        self.current_phase = phase
+        self.recv_bytes = 0
+        self.recv_loops = 0
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.current_phase = None
+            self.profiler.record(
+                self.switch, phase, time.perf_counter() - start, command,
+                self.recv_bytes, self.recv_loops,
+                )
+
+    def send_commands(self, commands):
+        """ send commands
+        one command after the other, for the methods that cannot tell where
+        the output of one command ends and the next one begins
+
+        output -> [output1, output2, ...]
+        """
+
+        return [self.send_command(command) for command in commands]
+
+    def cached_command(self, command, parse=None):
+        """ cached command
+        sends the command and parses its output, sessions handed out with
+        an output cache answer out of the cache instead
+
+        output -> (raw, parsed)
+        """
+
+        raw = self.send_command(command)
+
+        return raw, parse(raw) if parse is not None else None
+
+    def cached_commands(self, commands, parse=None):
+        """ cached commands
+        same as cached_command, for several commands at once
+
+        output -> [(raw1, parsed1), (raw2, parsed2), ...]
+        """
+
+        return [
+            (raw, parse(raw) if parse is not None else None)
+            for raw in self.send_commands(commands)
+        ]
 
 def user_credentials_prompt():
     """ user credentials prompt """
@@ -24,174 +605,696 @@ def user_credentials_prompt():
 
     return user, user_pw, enable_pw
 
-class SSHTimerMethod:
+class SSHTimerMethod(SSHProfiledSession):
 
-    def __init__(self):
-        self.user, self.user_pw, self.enable_pw = user_credentials_prompt()
+    def __init__(self, credentials=None, profiler=None):
+        # credentials can be shared between sessions, prompt user otherwise
+        if credentials is None:
+            credentials = user_credentials_prompt()
+
+        self.user, self.user_pw, self.enable_pw = credentials
+
+        # optional profiler that records the timing of every phase
+        self.profiler = profiler
 
     def login(self, switch):
         """ login
         logs into specified switch """
 
-        # set up ssh client
-        ssh_setup = paramiko.SSHClient()
-
-        # add missing host key policy (set as auto)
-        ssh_setup.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.switch = switch
 
-        # connect to switch
-        ssh_setup.connect(
-            switch, 
-            username=self.user, 
-            password=self.user_pw, 
-            look_for_keys=False, 
-            allow_agent=False,
+        # connect to switch and invoke an interactive shell
+        self.ssh_session = connect_shell(
+            switch, self.user, self.user_pw, self.profiler,
             )
-        # set up transport channel for session
-        transport = ssh_setup.get_transport()
-
-        # invoke session
-        self.ssh_session = transport.open_session()
-
-        # set up for interactive mode, multiple commands - pty
-        self.ssh_session.get_pty()
-
-        # invoke session's shell
-        self.ssh_session.invoke_shell()
-
-        # keep session active with parameters while class is initialized
-        self.ssh_session.keep_this = ssh_setup
 
     def enable_mode(self):
         """ enable mode timer method
         user the timer method to get into enable mode """
 
-        self.send_command('enable')
-        self.send_command(self.enable_pw)
+        with self.timed('enable_mode'):
+            self.send_command('enable')
+            self.send_command(self.enable_pw)
 
     def no_paging(self):
         """ no paging timer method
-        user the timer method to remove any paging """
+        user the timer method to remove any paging. the terminal is widened
+        as well, so that long lines are echoed whole instead of scrolled,
+        both lines are sent together to only wait once """
 
-        self.send_command('terminal len 0')
+        with self.timed('no_paging'):
+            self.send_config_block(['terminal len 0', 'terminal width 511'])
 
     def send_command(self, command):
         """ send command timer method
         this sends our commands to the switches, but through the timer
         method, the default delay set as 5 seconds! """
 
-        # send command over to switch
-        self.ssh_session.send(command + '\n')
+        with self.timed('command', command):
+            # send command over to switch
+            self.ssh_session.send(command + '\n')
 
-        # delay by specified delay
-        time.sleep(5)
+            # delay by specified delay
+            time.sleep(5)
 
-        # initialize the data received from switch
-        data = self.ssh_session.recv(1).decode('utf-8')
+            # initialize the data received from switch
+            data = self.ssh_session.recv(1).decode('utf-8')
+            self.recv_bytes += len(data)
+            self.recv_loops += 1
 
-        # read from socket while there is data
-        while self.ssh_session.recv_ready():
-            # keep reading 512 bytes of data from socket
-            data += self.ssh_session.recv(512).decode('utf-8')
+            # read from socket while there is data
+            while self.ssh_session.recv_ready():
+                # keep reading 512 bytes of data from socket
+                chunk = self.ssh_session.recv(512)
+                data += chunk.decode('utf-8')
+                self.recv_bytes += len(chunk)
+                self.recv_loops += 1
+
+                # minor delay to allow cpu some breathing room
+                time.sleep(.0001)
+
+
+        return data
 
-            # minor delay to allow cpu some breathing room
-            time.sleep(.0001)
+    def send_config_block(self, commands):
+        """ send config block timer method
+        writes the entire configuration block in one go and waits only once,
+        instead of waiting 5 seconds for every single line """
 
+        with self.timed('config_block'):
+            # send every line over to switch at the same time
+            self.ssh_session.sendall('\n'.join(commands) + '\n')
+
+            # delay by specified delay
+            time.sleep(5)
+
+            # initialize the data received from switch
+            data = self.ssh_session.recv(1).decode('utf-8')
+            self.recv_bytes += len(data)
+            self.recv_loops += 1
+
+            # read from socket while there is data
+            while self.ssh_session.recv_ready():
+                chunk = self.ssh_session.recv(65535)
+                data += chunk.decode('utf-8')
+                self.recv_bytes += len(chunk)
+                self.recv_loops += 1
 
         return data
 
+    def is_alive(self):
+        """ is alive
+        cheap health check of the session, the timer method cannot afford
+        to send a command so only the transport and channel are checked """
+
+        transport = self.ssh_session.get_transport()
+
+        if transport is None or not transport.is_active():
+            return False
+
+        return not self.ssh_session.closed
+
     def close_ssh_session(self):
         """ close ssh session
         closes the current session so that there are no hanging ssh threads """
 
         self.ssh_session.close()
 
-class SSHTrailingMethod:
+class LatencyHistory:
+    """ latency history
+    what the switches looked like on earlier commands, used by the adaptive
+    timer method to pick how long a quiet channel has to stay quiet before
+    the output is considered complete. two things are kept:
+
+    - the gaps between the reads of every switch, the recent ones only
+    - per switch and command, the time to the first byte, the total time
+      and the longest gap seen in the middle of its output
+
+    it is shared by every session and can be saved to a json file, so that
+    later runs start out with tight waits right away """
+
+    # number of recent gaps kept per switch
+    max_gaps = 200
+
+    # gaps needed before the gaps of a switch are trusted
+    min_gaps = 10
 
     def __init__(self):
-        self.user, self.user_pw, self.enable_pw = user_credentials_prompt()
+        # {switch : [gap1, gap2, ...]}
+        self.switch_gaps = {}
+
+        # {switch : {command : {'first_byte', 'duration', 'max_gap', 'runs'}}}
+        self.commands = {}
+
+        self.lock = threading.Lock()
+
+    def quiet_interval(self, switch, command, initial=1.0, floor=0.05, ceiling=5.0):
+        """ quiet interval
+        seconds of silence after which the output of the command on the
+        switch is considered complete. a few times the usual gap between
+        reads of the switch, but never less than the longest pause this
+        command has shown in the middle of its output, within floor and
+        ceiling. initial is used until either the switch or the command has
+        some history """
+
+        with self.lock:
+            gaps = self.switch_gaps.get(switch, [])
+            command_history = self.commands.get(switch, {}).get(command)
+
+            if len(gaps) >= self.min_gaps:
+                quiet = 3 * percentile(gaps, 95)
+            elif command_history is not None and command_history['runs']:
+                quiet = 0.0
+            else:
+                quiet = initial
+
+            if command_history is not None:
+                quiet = max(quiet, 1.5 * command_history['max_gap'])
+
+        return min(max(quiet, floor), ceiling)
+
+    def record(self, switch, command, first_byte, duration, gaps):
+        """ record
+        adds the timing of one command to the history """
+
+        with self.lock:
+            switch_gaps = self.switch_gaps.setdefault(switch, [])
+            switch_gaps.extend(gaps)
+            del switch_gaps[:-self.max_gaps]
+
+            command_history = self.commands.setdefault(switch, {}).get(command)
+            max_gap = max(gaps) if gaps else 0.0
+
+            if command_history is None:
+                self.commands[switch][command] = {
+                    'first_byte': first_byte,
+                    'duration': duration,
+                    'max_gap': max_gap,
+                    'runs': 1,
+                }
+                return
+
+            # moving averages, the longest gap is never forgotten
+            command_history['first_byte'] += (first_byte - command_history['first_byte']) / 4
+            command_history['duration'] += (duration - command_history['duration']) / 4
+            command_history['max_gap'] = max(command_history['max_gap'], max_gap)
+            command_history['runs'] += 1
+
+    def record_late_output(self, switch, command, gap):
+        """ record late output
+        output of the command showed up after it was considered complete,
+        so the command pauses longer than thought in the middle of its
+        output. the next run waits at least this long """
+
+        with self.lock:
+            command_history = self.commands.setdefault(switch, {}).setdefault(
+                command,
+                {'first_byte': 0.0, 'duration': 0.0, 'max_gap': 0.0, 'runs': 0},
+                )
+            command_history['max_gap'] = max(command_history['max_gap'], gap)
+
+    def save(self, filename):
+        """ save
+        writes the history to a json file """
+
+        with self.lock:
+            history = {'switch_gaps': self.switch_gaps, 'commands': self.commands}
+
+            with open(filename, 'w') as fn:
+                json.dump(history, fn)
+
+    @classmethod
+    def load(cls, filename):
+        """ load
+        reads the history back from a json file, an empty history if the
+        file does not exist yet """
+
+        latency_history = cls()
+
+        try:
+            with open(filename, 'r') as fn:
+                history = json.load(fn)
+        except FileNotFoundError:
+            return latency_history
+
+        latency_history.switch_gaps = history['switch_gaps']
+        latency_history.commands = history['commands']
+
+        return latency_history
+
+class SSHAdaptiveTimerMethod(SSHTimerMethod):
+    """ ssh adaptive timer method
+    timer method without the fixed 5 second delay. the output is considered
+    complete once the channel has been quiet for a while, and that while is
+    tuned per switch and per command out of the latency history. still does
+    not need to recognize the prompt, so it works on the same switches as
+    the timer method """
+
+    # shared by every session unless one is handed in
+    shared_latency_history = LatencyHistory()
+
+    def __init__(self, credentials=None, profiler=None, latency_history=None,
+                 initial_quiet=1.0, quiet_floor=0.05, quiet_ceiling=5.0,
+                 command_timeout=30):
+        super().__init__(credentials=credentials, profiler=profiler)
+
+        if latency_history is None:
+            latency_history = self.shared_latency_history
+
+        self.latency_history = latency_history
+
+        # quiet interval used until the switch has a history, and the
+        # lowest and highest quiet interval ever used
+        self.initial_quiet = initial_quiet
+        self.quiet_floor = quiet_floor
+        self.quiet_ceiling = quiet_ceiling
+
+        # hard limit in seconds for a command to send anything back at all
+        self.command_timeout = command_timeout
+
+        # previous command and when its output was considered complete
+        self.last_command = None
+        self.settled_at = 0.0
+
+    def drain_late_output(self):
+        """ drain late output
+        output of the previous command that came in after it was considered
+        complete, it paused longer than the history knew of. the pause is
+        recorded so the next run waits long enough, and the output is read
+        and dropped, so that it does not show up as the start of the output
+        of the next command. the login banner is dropped the same way """
+
+        if not self.ssh_session.recv_ready():
+            return
+
+        # before the first command, it is the login banner instead
+        if self.last_command is not None:
+            self.latency_history.record_late_output(
+                self.switch, self.last_command, time.perf_counter() - self.settled_at,
+                )
+
+        while self.ssh_session.recv_ready():
+            chunk = self.ssh_session.recv(65535)
+
+            # the switch closed the session, nothing more will come
+            if not chunk:
+                break
+
+            self.recv_bytes += len(chunk)
+            self.recv_loops += 1
+
+    def read_until_settled(self, command, echo=None):
+        """ read until settled
+        reads until the channel has been quiet for the quiet interval of the
+        command on this switch, and records how the output came in. the
+        switch echoes the command right away, long before the output of a
+        slow command, so the quiet interval only counts once output beyond
+        the echoed line came in, until then at least initial_quiet is waited.
+        echo is the line the switch echoes back, the command unless given """
+
+        # the end of the echo is enough to find it, even when the switch
+        # scrolled a long line and only echoed its end
+        if echo is None:
+            echo = command
+        echo = echo.encode('utf-8')[-32:]
+
+        quiet = self.latency_history.quiet_interval(
+            self.switch, command, self.initial_quiet, self.quiet_floor,
+            self.quiet_ceiling,
+            )
+
+        # collect the raw bytes, decoded only once at the very end
+        data = bytearray()
+
+        # gaps between reads, and when the first and latest read came in,
+        # all of them counted from the first output beyond the echo
+        gaps = []
+        first_byte = None
+        last_read = None
+        beyond_echo = False
+
+        start = time.perf_counter()
+        deadline = start + self.command_timeout
+
+        while True:
+            now = time.perf_counter()
+
+            # wait as long as it takes for the first byte, then at least
+            # initial_quiet while there is no more than the echo, and only
+            # the quiet interval after that
+            if last_read is None:
+                timeout = deadline - now
+                if timeout <= 0:
+                    raise SSHCommandTimeout(
+                        'no output received within ' + str(self.command_timeout) +
+                        ' seconds'
+                        )
+            elif not beyond_echo:
+                timeout = max(quiet, self.initial_quiet)
+            else:
+                timeout = quiet
+
+            readable = wait_readable(self.ssh_session, timeout)
+
+            if not readable:
+                # the channel stayed quiet, the output is complete
+                if last_read is not None:
+                    break
+                continue
+
+            chunk = self.ssh_session.recv(65535)
+
+            # the switch closed the session, nothing more will come
+            if not chunk:
+                break
+
+            now = time.perf_counter()
+
+            data += chunk
+            self.recv_bytes += len(chunk)
+            self.recv_loops += 1
+
+            if beyond_echo:
+                gaps.append(now - last_read)
+            else:
+                # anything after the end of the echoed line is output
+                echo_start = data.find(echo)
+                newline = -1
+                if echo_start != -1:
+                    newline = data.find(b'\n', echo_start + len(echo))
+                beyond_echo = newline != -1 and newline + 1 < len(data)
+
+                if beyond_echo:
+                    first_byte = now - start
+
+            last_read = now
+
+        if first_byte is not None:
+            self.latency_history.record(
+                self.switch, command, first_byte, last_read - start, gaps,
+                )
+
+        self.last_command = command
+        self.settled_at = time.perf_counter()
+
+        return data.decode('utf-8', errors='replace')
+
+    def enable_mode(self):
+        """ enable mode adaptive timer method
+        same as the timer method, except that the enable password is kept
+        out of the latency history and the history file """
+
+        with self.timed('enable_mode'):
+            self.send_command('enable')
+
+            self.drain_late_output()
+            # the password is not echoed
+            self.ssh_session.send(self.enable_pw + '\n')
+            self.read_until_settled('enable password', echo='')
+
+    def send_command(self, command):
+        """ send command adaptive timer method
+        sends our command and waits until the output has settled """
+
+        with self.timed('command', command):
+            self.drain_late_output()
+
+            # send command over to switch
+            self.ssh_session.send(command + '\n')
+
+            return self.read_until_settled(command)
+
+    def send_config_block(self, commands):
+        """ send config block adaptive timer method
+        writes the entire configuration block in one go and waits until the
+        output of all of it has settled """
+
+        with self.timed('config_block'):
+            self.drain_late_output()
+
+            # send every line over to switch at the same time
+            self.ssh_session.sendall('\n'.join(commands) + '\n')
+
+            return self.read_until_settled('config block', echo=commands[0])
+
+class SSHTrailingMethod(SSHProfiledSession):
+
+    # pipelined commands get a unique marker each, counted per session
+    marker_count = 0
+
+    def __init__(self, credentials=None, prompt_pattern=None, command_timeout=30,
+                 profiler=None, pipeline_window=8):
+        # credentials can be shared between sessions, prompt user otherwise
+        if credentials is None:
+            credentials = user_credentials_prompt()
+
+        self.user, self.user_pw, self.enable_pw = credentials
+
+        # optional user supplied prompt regex, learned after login otherwise
+        self.prompt_pattern = prompt_pattern
+
+        # hard limit in seconds for a single command to return a prompt
+        self.command_timeout = command_timeout
+
+        # optional profiler that records the timing of every phase
+        self.profiler = profiler
+
+        # most commands written ahead of the output read by send_commands
+        self.pipeline_window = pipeline_window
 
     def login(self, switch):
         """ login
         logs into specified switch """
 
-        # set up ssh client
-        ssh_setup = paramiko.SSHClient()
+        self.switch = switch
 
-        # add missing host key policy (set as auto)
-        ssh_setup.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-        # connect to switch
-        ssh_setup.connect(
-            switch, 
-            username=self.user, 
-            password=self.user_pw, 
-            look_for_keys=False, 
-            allow_agent=False,
+        # connect to switch and invoke an interactive shell
+        self.ssh_session = connect_shell(
+            switch, self.user, self.user_pw, self.profiler,
             )
-        # set up transport channel for session
-        transport = ssh_setup.get_transport()
 
-        # invoke session
-        self.ssh_session = transport.open_session()
+        # wait for the first prompt and learn the prompt of this switch
+        with self.timed('first_prompt'):
+            self.learn_prompt()
 
-        # set up for interactive mode, multiple commands - pty
-        self.ssh_session.get_pty()
+    def learn_prompt(self):
+        """ learn prompt
+        reads the login banner up to the first prompt and learns the prompt
+        of this switch out of its hostname, unless the user asked for a
+        prompt of their own """
 
-        # invoke session's shell
-        self.ssh_session.invoke_shell()
+        # start with the generic prompt or whatever the user asked for
+        self.prompt_regex = compile_prompt(self.prompt_pattern)
+        banner = self.read_until_prompt()
+
+        if not self.prompt_pattern:
+            self.prompt_regex = learned_prompt(banner)
+
+    def read_until_prompt(self, skip_config_prompts=False):
+        """ read until prompt
+        blocks on the channel until data arrives and returns as soon as the
+        last line of the output matches the prompt regex. configuration mode
+        prompts can be skipped to wait for the end of a config block """
+
+        prompt_matcher = PromptMatcher(self.prompt_regex, skip_config_prompts)
+
+        # hard deadline for this command
+        deadline = time.time() + self.command_timeout
+
+        while True:
+            # time left before the switch is considered hung
+            time_left = deadline - time.time()
+            if time_left <= 0:
+                raise SSHCommandTimeout(
+                    'no prompt received within ' + str(self.command_timeout) +
+                    ' seconds, last output: ' + prompt_matcher.tail()
+                    )
+
+            # wait until the socket has data to be read, without spinning
+            readable = wait_readable(self.ssh_session, time_left)
+            if not readable:
+                continue
 
-        # keep session active with parameters while class is initialized
-        self.ssh_session.keep_this = ssh_setup
+            # read everything that is currently available
+            chunk = self.ssh_session.recv(65535)
+
+            # an empty read means the switch closed the session on us
+            if not chunk:
+                raise EOFError('ssh session closed while waiting for prompt')
+
+            self.recv_bytes += len(chunk)
+            self.recv_loops += 1
+
+            if prompt_matcher.feed(chunk):
+                break
+
+        return prompt_matcher.output()
 
     def enable_mode(self):
         """ enable mode expect trailing method
         user the expect trailing method to get into enable mode """
 
-        self.send_command('enable')
-        self.send_command(self.enable_pw)
+        with self.timed('enable_mode'):
+            self.send_command('enable')
+            self.send_command(self.enable_pw)
 
     def no_paging(self):
         """ no paging expect trailing method
-        user the expect trailing method to remove any paging """
+        user the expect trailing method to remove any paging. the terminal
+        is widened as well, so that long lines are echoed whole instead of
+        scrolled """
 
-        self.send_command('terminal len 0')
+        with self.timed('no_paging'):
+            self.send_command('terminal len 0')
+            self.send_command('terminal width 511')
 
     def send_command(self, command):
         """ send command expect trailing method
         this sends our command to the switches, but through the expect
         trailing method! """
 
-        # send command over to the switch
-        self.ssh_session.send(command + '\n')
+        with self.timed('command', command):
+            # send command over to the switch
+            self.ssh_session.send(command + '\n')
 
-        # initialize the data received from switch
-        data = self.ssh_session.recv(1).decode('utf-8')
+            # wait for the prompt to show up at the end of the output
+            return self.read_until_prompt()
 
-        while True:
-            # read from socket, if there is data to be read
-            if self.ssh_session.recv_ready():
-                # keep reading 512 bytes of data from socket
-                data += self.ssh_session.recv(512).decode('utf-8')
+    def send_commands(self, commands, window=None):
+        """ send commands expect trailing method
+        pipelines the commands instead of paying a round trip for each one.
+        every command is followed by a comment line with a unique marker,
+        which the switch simply echoes back at its prompt once the command
+        is done. no more than window commands are written ahead of the
+        output read so far, so the input buffer of the switch is never
+        overrun, and the combined output is split back up at the markers
 
-            # grab current last line from collected socket, subject to
-            # keep changing as more data flows in
-            current_last_line = data.splitlines()[-1].strip()
+        output -> [output1, output2, ...] same as send_command for each one
+        """
 
-            # check if there are spaces in the line, skip if so
-            if ' ' in current_last_line:
-                continue
-            # enable mode
-            elif current_last_line.endswith('#'):
-                break
-            # password prompt
-            elif current_last_line.endswith(':'):
-                break
+        # nothing to send, and no prompt would ever come back to wait for
+        if not commands:
+            return []
 
-            # minor delay to allow cpu some breathing room
-            time.sleep(.0001)
+        if window is None:
+            window = self.pipeline_window
 
-        return data
+        # one marker per command, unique within this session
+        markers = []
+        for command in commands:
+            self.marker_count += 1
+            markers.append('!pyability-marker-' + str(self.marker_count))
+
+        outputs = []
+
+        # collect the raw bytes, decoded once per command
+        data = bytearray()
+
+        # start of the output of the oldest command in flight, the prompt
+        # it was typed at and the number of commands written so far
+        output_start = 0
+        prompt = b''
+        sent = 0
+
+        with self.timed('pipelined_commands'):
+            # hard deadline for the oldest command in flight
+            deadline = time.time() + self.command_timeout
+
+            while True:
+                # split off every command whose marker has been echoed back
+                while len(outputs) < sent:
+                    marker_start = data.find(
+                        markers[len(outputs)].encode('utf-8'), output_start,
+                        )
+                    if marker_start == -1:
+                        break
+
+                    marker_end = data.find(b'\n', marker_start)
+                    if marker_end == -1:
+                        break
+
+                    # the command was typed at the prompt the previous
+                    # marker left behind, and its output ends with the
+                    # prompt this marker was typed at
+                    output = data[output_start:marker_start]
+                    if prompt and output.startswith(prompt):
+                        output = output[len(prompt):]
+
+                    outputs.append(output.decode('utf-8', errors='replace'))
+
+                    prompt = bytes(data[data.rfind(b'\n', 0, marker_start) + 1:marker_start])
+                    output_start = marker_end + 1
+                    deadline = time.time() + self.command_timeout
+
+                # done once the switch is back at its prompt after the last marker
+                if len(outputs) == len(commands) and \
+                        self.prompt_regex.match(data, output_start):
+                    break
+
+                # keep the window of commands in flight full
+                if sent < len(commands) and sent - len(outputs) < window:
+                    while sent < len(commands) and sent - len(outputs) < window:
+                        self.ssh_session.sendall(
+                            commands[sent] + '\n' + markers[sent] + '\n'
+                            )
+                        sent += 1
+                    continue
+
+                # time left before the switch is considered hung
+                time_left = deadline - time.time()
+                if time_left <= 0:
+                    raise SSHCommandTimeout(
+                        'no marker received within ' + str(self.command_timeout) +
+                        ' seconds, last output: ' + repr(bytes(data[-80:]))
+                        )
+
+                # wait until the socket has data to be read, without spinning
+                readable = wait_readable(self.ssh_session, time_left)
+                if not readable:
+                    continue
+
+                chunk = self.ssh_session.recv(65535)
+
+                # an empty read means the switch closed the session on us
+                if not chunk:
+                    raise EOFError('ssh session closed while waiting for marker')
+
+                data += chunk
+                self.recv_bytes += len(chunk)
+                self.recv_loops += 1
+
+        return outputs
+
+    def send_config_block(self, commands):
+        """ send config block expect trailing method
+        writes the entire configuration block in one go and waits once for
+        the final prompt, the block is expected to leave configuration mode
+        with 'end' as its last line """
+
+        with self.timed('config_block'):
+            # send every line over to the switch at the same time
+            self.ssh_session.sendall('\n'.join(commands) + '\n')
+
+            # wait for the enable mode prompt after the configuration prompts
+            return self.read_until_prompt(skip_config_prompts=True)
+
+    def is_alive(self):
+        """ is alive
+        health check of the session, the transport has to be up and the
+        switch has to answer an empty line with its prompt """
+
+        transport = self.ssh_session.get_transport()
+
+        if transport is None or not transport.is_active():
+            return False
+
+        try:
+            with self.timed('health_check'):
+                self.send_command('')
+        except (SSHCommandTimeout, EOFError, OSError, paramiko.SSHException):
+            return False
+
+        return True
 
     def close_ssh_session(self):
         """ close ssh session
@@ -199,3 +1302,231 @@ class SSHTrailingMethod:
 
         self.ssh_session.close()
 
+class SSHSessionPool:
+    """ ssh session pool
+    keeps logged in, enabled and no paging sessions warm so that repeated
+    jobs against the same switches skip the key exchange, authentication,
+    enable and terminal length cost. sessions are keyed by switch and
+    credentials, and every session is only ever handed to one user at a time """
+
+    def __init__(self, session_method=SSHTrailingMethod, credentials=None,
+                 max_idle=300, profiler=None):
+        # credentials are shared by every session of the pool
+        if credentials is None:
+            credentials = user_credentials_prompt()
+
+        self.session_method = session_method
+        self.credentials = credentials
+
+        # optional profiler handed to every new session
+        self.profiler = profiler
+
+        # sessions idle for longer than this many seconds are not reused
+        self.max_idle = max_idle
+
+        # idle sessions -> {(switch, user, user_pw, enable_pw) : [(session, last_used), ...]}
+        self.idle_sessions = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, switch):
+        """ acquire
+        returns a healthy idle session for the switch or logs in a new one """
+
+        key = (switch,) + tuple(self.credentials)
+
+        while True:
+            # grab the most recently used idle session, if there is one
+            with self.lock:
+                if not self.idle_sessions.get(key):
+                    break
+                session, last_used = self.idle_sessions[key].pop()
+
+            # drop sessions that were idle too long or went stale
+            if time.time() - last_used > self.max_idle or not session.is_alive():
+                self.discard(session)
+                continue
+
+            return session
+
+        # nothing warm available, pay the full login cost once
+        session = self.session_method(
+            credentials=self.credentials, profiler=self.profiler,
+            )
+
+        # a login that fails half way, for example while waiting for the
+        # first prompt or on a wrong enable password, still has an open
+        # client that has to be closed
+        try:
+            session.login(switch)
+            session.enable_mode()
+            session.no_paging()
+        except Exception:
+            self.discard(session)
+            raise
+
+        # remember where this session belongs for later release
+        session.pool_key = key
+
+        return session
+
+    def release(self, session):
+        """ release
+        hands a session back to the pool so that it can be reused """
+
+        with self.lock:
+            self.idle_sessions.setdefault(session.pool_key, []).append(
+                (session, time.time())
+                )
+
+    def discard(self, session):
+        """ discard
+        closes a session that should not be reused, including its client """
+
+        try:
+            session.close_ssh_session()
+            session.ssh_session.keep_this.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def session(self, switch, output_cache=None):
+        """ session
+        context manager around acquire and release, a session that failed
+        in the middle of a job is discarded instead of going back in the pool.
+        with an output cache, the show commands are answered out of the cache
+        and the switch is only logged into once it is really needed """
+
+        if output_cache is not None:
+            with self.cached_session(switch, output_cache) as session:
+                yield session
+            return
+
+        session = self.acquire(switch)
+
+        try:
+            yield session
+        except Exception:
+            self.discard(session)
+            raise
+
+        self.release(session)
+
+    @contextmanager
+    def cached_session(self, switch, output_cache):
+        """ cached session
+        same as session, around a cached session that may never log in """
+
+        cached_session = CachedSession(self, switch, output_cache)
+
+        try:
+            yield cached_session
+        except Exception:
+            if cached_session.session is not None:
+                self.discard(cached_session.session)
+            raise
+
+        if cached_session.session is not None:
+            self.release(cached_session.session)
+
+    def close_all(self):
+        """ close all
+        closes every idle session in the pool """
+
+        with self.lock:
+            idle_sessions = self.idle_sessions
+            self.idle_sessions = {}
+
+        for sessions in idle_sessions.values():
+            for session, last_used in sessions:
+                self.discard(session)
+
+class CachedSession:
+    """ cached session
+    stands in for a session of the pool. show commands sent through
+    cached_command are answered out of the output cache while they are
+    fresh, and the switch is only logged into once something actually has
+    to be sent to it. anything else sent to the switch, such as a
+    configuration block, invalidates every cached output of the switch """
+
+    def __init__(self, session_pool, switch, output_cache):
+        self.session_pool = session_pool
+        self.switch = switch
+        self.output_cache = output_cache
+
+        # the real session, once logged in
+        self.session = None
+
+    def __getattr__(self, name):
+        # everything else is handled by the real session
+        return getattr(self.connect(), name)
+
+    def connect(self):
+        """ connect
+        the real session out of the pool, logged in on first use """
+
+        if self.session is None:
+            self.session = self.session_pool.acquire(self.switch)
+
+        return self.session
+
+    def cached_command(self, command, parse=None):
+        """ cached command
+        raw and parsed output of the command, out of the cache if it is
+        there, from the switch otherwise
+
+        output -> (raw, parsed)
+        """
+
+        return self.cached_commands([command], parse)[0]
+
+    def cached_commands(self, commands, parse=None):
+        """ cached commands
+        same as cached_command for several commands, the ones that are not
+        cached are sent to the switch together
+
+        output -> [(raw1, parsed1), (raw2, parsed2), ...]
+        """
+
+        outputs = [self.output_cache.get(self.switch, command) for command in commands]
+
+        missing = [command for command, output in zip(commands, outputs) if output is None]
+
+        if missing:
+            # a lone command gains nothing from being pipelined
+            if len(missing) == 1:
+                raw_outputs = iter([self.connect().send_command(missing[0])])
+            else:
+                raw_outputs = iter(self.connect().send_commands(missing))
+
+            for i, output in enumerate(outputs):
+                if output is not None:
+                    continue
+
+                raw = next(raw_outputs)
+                outputs[i] = (raw, parse(raw) if parse is not None else None)
+                self.output_cache.put(self.switch, commands[i], *outputs[i])
+
+        return outputs
+
+    def send_command(self, command):
+        """ send command
+        sent straight to the switch, anything but a show command or an empty
+        line may change what the show commands return """
+
+        words = command.split()
+
+        try:
+            return self.connect().send_command(command)
+        finally:
+            if words and not (len(words[0]) >= 2 and 'show'.startswith(words[0])):
+                self.output_cache.invalidate(self.switch)
+
+    def send_config_block(self, commands):
+        """ send config block
+        sent straight to the switch, the cached outputs are stale afterwards,
+        even when the block failed half way through """
+
+        try:
+            return self.connect().send_config_block(commands)
+        finally:
+            self.output_cache.invalidate(self.switch)
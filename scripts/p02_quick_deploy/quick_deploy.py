@@ -1,7 +1,31 @@
 from netmiko import ConnectHandler
 from colorama import init
 from colorama import Fore
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import namedtuple
+import threading
 import getpass
+import time
+import sys
+import os
+import re
+
+# the profiler and the output cache are shared with the ssh framework of
+# the interface modification script, one folder over
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'p01_interface_mod',
+    ))
+
+from sshfw import OutputCache, SSHProfiler
+
+# execution plan steps, compiled once out of commands.txt and replayed as is
+# on every device
+# a single show (or any other non configuration) command
+Show = namedtuple('Show', ['command'])
+# read-only show commands that can be written to the device all at once
+ShowPipeline = namedtuple('ShowPipeline', ['commands'])
+# configuration lines between 'conf' and 'end'
+ConfigBlock = namedtuple('ConfigBlock', ['commands'])
 
 def quick_deploy_introduction():
     user_message = Fore.YELLOW + "# Quick Deploy Script v1.0"
@@ -21,21 +45,240 @@ def user_credentials_prompt():
 
     return user, password, secret
 
+def split_device(device):
+    """ split device
+    devices that do not listen on port 22 are given as 'host:port'
+
+    output -> (host, port)
+    """
+
+    host, _, port = device.partition(':')
+
+    return host, int(port) if port else 22
+
+def compile_commands(commands, max_pipeline=10):
+    """ compile commands
+    walks the commands once and turns them into an immutable execution plan,
+    so that every device only has to replay the steps. consecutive show
+    commands are grouped, up to max_pipeline at a time, so that they can be
+    sent in a single channel write
+
+    input -> commands = ['show x', 'conf t', 'interface y', 'end', ...]
+    output -> plan = (Show('show x'), ConfigBlock(('interface y',)), ...)
+    """
+
+    # initialize the resultant datastructure
+    plan = []
+
+    # configuration set
+    config_set = []
+    # flag to check if configuration lines
+    config_flag = False
+    # consecutive show commands that are waiting to be grouped
+    show_set = []
+
+    def flush_show_set():
+        # a lone show command gains nothing from being pipelined
+        for i in range(0, len(show_set), max_pipeline):
+            group = tuple(show_set[i:i + max_pipeline])
+            if len(group) == 1:
+                plan.append(Show(group[0]))
+            else:
+                plan.append(ShowPipeline(group))
+        del show_set[:]
+
+    for line in commands:
+        line = line.strip()
+
+        # skip empty lines
+        if not line:
+            continue
+
+        # check if we need to enter configuration mode or not
+        if line.startswith('conf'):
+            flush_show_set()
+            config_flag = True
+        # check if we reached the end of the configuration terminal
+        elif line.startswith('end'):
+            flush_show_set()
+            config_flag = False
+            if config_set:
+                plan.append(ConfigBlock(tuple(config_set)))
+            config_set = []
+        # add line to configuration set if flag is turned up
+        elif config_flag:
+            config_set.append(line)
+        # show commands are read-only and can be pipelined together
+        elif line.startswith('sh'):
+            show_set.append(line)
+        # any other command runs on its own
+        else:
+            flush_show_set()
+            plan.append(Show(line))
+
+    flush_show_set()
+
+    # if there were configuration involved, yet not 'end'ed out...
+    if config_set:
+        plan.append(ConfigBlock(tuple(config_set)))
+
+    return tuple(plan)
+
+class ConnectionPool:
+    """ connection pool
+    keeps authenticated and enabled netmiko connections warm, keyed by device
+    and credentials, so that repeated jobs against the same devices do not
+    pay the ssh handshake and enable cost every time """
+
+    def __init__(self, max_idle=300, profiler=None):
+        # connections idle for longer than this many seconds are not reused
+        self.max_idle = max_idle
+
+        # optional profiler that records connecting and enabling
+        self.profiler = profiler
+
+        # idle connections -> {(device, port, device_type, user) : (net_connect, last_used)}
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, network_device_param):
+        """ acquire
+        returns a healthy idle connection or builds a new one """
+
+        key = (
+            network_device_param['ip'],
+            network_device_param.get('port', 22),
+            network_device_param['device_type'],
+            network_device_param['username'],
+            network_device_param['password'],
+            network_device_param['secret'],
+        )
+
+        # reuse the idle connection if it is still fresh and healthy
+        with self.lock:
+            idle_connection = self.connections.pop(key, None)
+
+        device = network_device_param['ip']
+        if network_device_param.get('port', 22) != 22:
+            device += ':' + str(network_device_param['port'])
+
+        if idle_connection:
+            net_connect, last_used = idle_connection
+
+            start = time.perf_counter()
+            healthy = time.time() - last_used <= self.max_idle and net_connect.is_alive()
+
+            if self.profiler is not None:
+                self.profiler.record(device, 'health_check', time.perf_counter() - start)
+
+            if healthy:
+                return net_connect
+
+            # stale connection, get rid of it and reconnect
+            self.disconnect(net_connect)
+
+        start = time.perf_counter()
+
+        # initialize the connect handler of netmiko, which covers the tcp
+        # connect, key exchange, authentication and session preparation
+        net_connect = ConnectHandler(**network_device_param)
+
+        if self.profiler is not None:
+            connected = time.perf_counter()
+            self.profiler.record(device, 'connect', connected - start)
+
+        # enter enable mode if required, a connection that cannot be
+        # enabled is of no use and is closed right away
+        try:
+            if net_connect.find_prompt().endswith('>'):
+                net_connect.enable()
+        except Exception:
+            self.disconnect(net_connect)
+            raise
+
+        if self.profiler is not None:
+            self.profiler.record(device, 'enable_mode', time.perf_counter() - connected)
+
+        # remember where this connection belongs for later release
+        net_connect.pool_key = key
+
+        return net_connect
+
+    def release(self, net_connect):
+        """ release
+        hands a connection back to the pool so that it can be reused """
+
+        with self.lock:
+            self.connections[net_connect.pool_key] = (net_connect, time.time())
+
+    def disconnect(self, net_connect):
+        """ disconnect
+        closes a connection that should not be reused """
+
+        try:
+            net_connect.disconnect()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """ close all
+        closes every idle connection in the pool """
+
+        with self.lock:
+            connections = self.connections
+            self.connections = {}
+
+        for net_connect, last_used in connections.values():
+            self.disconnect(net_connect)
+
 class QuickDeploy:
     """ quick deploy
     send specified commands over to specified devices """
 
-    def __init__(self):
-        # variable initialization
-        self.devices = self.read_devices_text_file()
-        self.commands = self.read_commands_text_file()
-        self.logname = self.ask_user_for_log()
-        self.print_screen = self.ask_user_if_print_to_screen()
-        self.user, self.password, self.secret = user_credentials_prompt()
-
-        # log data
+    def __init__(self, max_workers=10, pipeline_shows=True, profiler=None,
+                 devices=None, commands=None, logname=None, print_screen=None,
+                 credentials=None, output_cache=None):
+        # variable initialization, anything not handed in is read from the
+        # text files or asked from the user
+        if devices is None:
+            devices = self.read_devices_text_file()
+        if commands is None:
+            commands = self.read_commands_text_file()
+        if logname is None:
+            logname = self.ask_user_for_log()
+        if print_screen is None:
+            print_screen = self.ask_user_if_print_to_screen()
+        if credentials is None:
+            credentials = user_credentials_prompt()
+
+        self.devices = devices
+        self.commands = commands
+        self.plan = compile_commands(self.commands)
+        self.logname = logname
+        self.print_screen = print_screen
+        self.user, self.password, self.secret = credentials
+
+        # number of devices worked on at the same time
+        self.max_workers = max_workers
+
+        # send grouped show commands in a single channel write
+        self.pipeline_shows = pipeline_shows
+
+        # log data, every device streams into its own log file
+        # {device : device log filename}
         self.log = {}
 
+        # optional profiler that records the timing of every device and
+        # command, summarized at the end of run_commands
+        self.profiler = profiler
+
+        # warm connections, reused by repeated runs of run_commands
+        self.connection_pool = ConnectionPool(profiler=profiler)
+
+        # optional output cache, show commands still fresh in it are not
+        # sent to the devices again
+        self.output_cache = output_cache
+
     def ask_user_for_log(self):
         """ ask the user for what the log file will be stored as """
 
@@ -142,106 +385,274 @@ class QuickDeploy:
     def run_commands(self):
         """ run commands
         main method that runs the specified commands over
-        to the specified network devices """
-
-        # iterate through the devices dictionary
-        for device, device_type in sorted(self.devices.items()):
-            user_message = "\nRunning requested commands on " + device.upper()
-            print(Fore.CYAN + user_message + Fore.WHITE)
-
-            # build the appropriate device parameters
-            network_device_param = {
-                'device_type': device_type,
-                'ip': device,
-                'username': self.user,
-                'password': self.password,
-                'secret': self.secret,
-            }
-
-            # initialize the connect handler of netmiko
-            net_connect = ConnectHandler(**network_device_param)
-
-            # enter enable mode if required
-            if net_connect.find_prompt().endswith('>'):
-                net_connect.enable()
+        to the specified network devices, up to max_workers
+        devices at the same time """
+
+        # hand every device over to the bounded worker pool
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+            for device, device_type in sorted(self.devices.items()):
+                future = executor.submit(self.run_device, device, device_type)
+                futures[future] = device
+
+            # report each device as soon as it has finished
+            for future in as_completed(futures):
+                device = futures[future]
+                try:
+                    future.result()
+                except Exception as error:
+                    # one broken device should not stop the others
+                    user_message = "\nFailed on " + device.upper() + ": " + str(error)
+                    print(Fore.RED + user_message + Fore.WHITE)
+
+        # where the time went, per device and per phase
+        if self.profiler is not None:
+            self.profiler.summary()
+
+    def device_log_name(self, device):
+        """ device log name
+        name of the append only log file of a single device """
+
+        # no ':' of 'host:port' in file names, windows does not allow it
+        return self.logname + '.' + device.replace(':', '_') + '.part'
+
+    def run_device(self, device, device_type):
+        """ run device
+        runs the specified commands on a single device and streams the
+        output straight into the device log file as it arrives """
+
+        user_message = "\nRunning requested commands on " + device.upper()
+        print(Fore.CYAN + user_message + Fore.WHITE)
+
+        # build the appropriate device parameters
+        host, port = split_device(device)
+        network_device_param = {
+            'device_type': device_type,
+            'ip': host,
+            'port': port,
+            'username': self.user,
+            'password': self.password,
+            'secret': self.secret,
+        }
+
+        # borrow an enabled connection from the pool, only once something has
+        # to be sent to the device, which may be never with an output cache
+        net_connect = None
+
+        def connect():
+            nonlocal net_connect
+            if net_connect is None:
+                net_connect = self.connection_pool.acquire(network_device_param)
+            return net_connect
+
+        # device log file, only opened once there is something to log
+        log_file = None
+
+        try:
+            # replay the compiled execution plan
+            for step in self.plan:
+                # update configuration now
+                if isinstance(step, ConfigBlock):
+                    start = time.perf_counter()
+                    try:
+                        out = connect().send_config_set(list(step.commands))
+                    finally:
+                        # the configuration changed, even if only half way
+                        if self.output_cache is not None:
+                            self.output_cache.invalidate(device)
+                    self.record(device, 'config_block', start, None, out)
+                    if self.print_screen:
+                        user_message = Fore.MAGENTA + "\n" + device + " RUNNING CONFIGURATION:" + Fore.WHITE
+                        print(user_message)
+                        for config_line in step.commands:
+                            print(config_line)
+                    continue
 
-            # configuration set
-            config_set = []
-            # flag to check if configuration lines
-            config_flag = False
+                # group of show commands, all sent at once
+                if isinstance(step, ShowPipeline):
+                    commands = step.commands
+                # otherwise assume a normal show command
+                else:
+                    commands = (step.command,)
 
-            # iterate through the commands list
-            for line in self.commands:
-                # check if we need to enter configuration mode or not
-                if line.strip().startswith('conf'):
-                    config_flag = True
-                    continue
-                # check if we reached the end of the configuration terminal
-                elif line.strip().startswith('end'):
-                    config_flag = False
-                    # update configuration now and reset the value
-                    # this is just in case there are show commands we need to run
-                    # after performing the configuration updates
-                    net_connect.send_config_set(config_set)
+                outputs = self.send_show_commands(connect, commands, device)
+
+                # open the device log file if not already done, appending
+                # to it if an earlier run already logged this device
+                if log_file is None:
+                    log_mode = 'a' if device in self.log else 'w'
+                    log_file = open(self.device_log_name(device), log_mode)
+                    self.log[device] = self.device_log_name(device)
+
+                for command, out in outputs:
+                    # add to log, straight to disk
+                    log_file.write('\n\n' + device + "# " + command + "\n")
+                    log_file.write(out)
+
+                    # print the show command output
                     if self.print_screen:
-                        user_message = Fore.MAGENTA + "\nRUNNING CONFIGURATION:" + Fore.WHITE
+                        user_message = Fore.MAGENTA + "\n" + device + " RUNNING: " + Fore.WHITE + command
                         print(user_message)
-                        for line in config_set:
-                            print(line)
+                        print(out)
+
+                log_file.flush()
+        except Exception:
+            # the session is in an unknown state, do not reuse it
+            if net_connect is not None:
+                self.connection_pool.disconnect(net_connect)
+            raise
+        finally:
+            if log_file is not None:
+                log_file.close()
+
+        # keep the ssh session warm for the next run
+        if net_connect is not None:
+            self.connection_pool.release(net_connect)
+
+    def send_show_commands(self, connect, commands, device):
+        """ send show commands
+        output of every command, out of the output cache where possible.
+        the rest is sent to the device through the connection connect hands
+        back, pipelined when there is more than one. anything that is not a
+        show command is never cached, and since it may change what the show
+        commands return, it invalidates the cached outputs of the device
+
+        output -> outputs = [(command1, output1), (command2, output2), ...]
+        """
+
+        # one output per command, by position, so that a command that shows
+        # up twice keeps both of its outputs. the text is only the cache key
+        outputs = [None] * len(commands)
+
+        if self.output_cache is not None:
+            for index, command in enumerate(commands):
+                if command.startswith('sh'):
+                    cached = self.output_cache.get(device, command)
+                    if cached is not None:
+                        outputs[index] = cached[0]
+
+        # positions of the commands the cache could not answer
+        missing = [index for index, out in enumerate(outputs) if out is None]
+        missing_commands = [commands[index] for index in missing]
+
+        if len(missing_commands) > 1 and self.pipeline_shows:
+            sent = self.send_pipelined_commands(
+                connect(), missing_commands, device=device,
+                )
+        else:
+            sent = [
+                (command, self.send_command(connect(), command, device))
+                for command in missing_commands
+            ]
 
-                    config_set = []
-                    continue
-                # add line to configuration set if flag is turned up
-                elif config_flag:
-                    config_set.append(line.strip())
-                    continue
+        for index, (command, out) in zip(missing, sent):
+            outputs[index] = out
 
-                # generate log data structure if key does not exist
-                if device not in self.log:
-                    self.log[device] = ''
+            if self.output_cache is None:
+                continue
 
-                # otherwise assume a normal show command
-                out = net_connect.send_command(line.strip())
-                # add to log
-                self.log[device] += '\n\n' + device + "# " + line.strip() + "\n"
-                self.log[device] += out
-
-                # print the show command output
-                if self.print_screen:
-                    user_message = Fore.MAGENTA + "\nRUNNING: " + Fore.WHITE + line.strip()
-                    print(user_message)
-                    print(out)
-
-            # if there were configuration involved, yet not 'end'ed out...
-            if config_set:
-                # run the configuration now
-                net_connect.send_config_set(config_set)
+            if command.startswith('sh'):
+                self.output_cache.put(device, command, out)
+            else:
+                self.output_cache.invalidate(device)
 
-                if self.print_screen:
-                    user_message = Fore.MAGENTA + "\nRUNNING CONFIGURATION:" + Fore.WHITE
-                    print(user_message)
-                    for line in config_set:
-                        print(line)
+        return list(zip(commands, outputs))
 
-            # close existing ssh session
-            net_connect.disconnect()
+    def record(self, device, phase, start, command=None, out=''):
+        """ record
+        hands the event over to the profiler, if there is one """
+
+        if self.profiler is not None:
+            self.profiler.record(
+                device, phase, time.perf_counter() - start, command, len(out),
+                )
+
+    def send_command(self, net_connect, command, device=None):
+        """ send command
+        netmiko send command, timed when profiling """
+
+        start = time.perf_counter()
+        out = net_connect.send_command(command)
+        self.record(device, 'command', start, command, out)
+
+        return out
+
+    def send_pipelined_commands(self, net_connect, commands, read_timeout=30,
+                                device=None):
+        """ send pipelined commands
+        writes all show commands to the device in one go, then splits what
+        comes back into the output of each command using the echoed command
+        and the device prompt. this costs a single round trip instead of one
+        per command. when profiling, every command is timed from the end of
+        the previous one, the first one from the write
+
+        output -> outputs = [(command1, output1), (command2, output2), ...]
+        """
+
+        # the prompt separates the output of every command
+        prompt = net_connect.find_prompt()
+        prompt_pattern = re.escape(prompt)
+
+        # nothing left over from earlier commands may be mistaken for output
+        net_connect.clear_buffer()
+
+        start = time.perf_counter()
+
+        # send every command at the same time
+        net_connect.write_channel(
+            ''.join(net_connect.normalize_cmd(command) for command in commands)
+            )
+
+        outputs = []
+
+        for command in commands:
+            # skip anything up to the echo of this command, such as a late
+            # prompt or the echo of the previous command
+            net_connect.read_until_pattern(
+                pattern=re.escape(command), read_timeout=read_timeout,
+                )
+
+            # everything up to the next prompt belongs to this command
+            out = net_connect.read_until_pattern(
+                pattern=prompt_pattern, read_timeout=read_timeout,
+                )
+
+            # same clean up as netmiko's send_command
+            out = net_connect.normalize_linefeeds(out)
+            out = net_connect.strip_prompt(out).lstrip('\n')
+
+            outputs.append((command, out))
+
+            self.record(device, 'pipelined_command', start, command, out)
+            start = time.perf_counter()
+
+        return outputs
 
     def write_log(self):
-        """ write log """
+        """ write log
+        merges the device log files into the final log file,
+        one device at a time, and cleans them up afterwards """
 
         with open(self.logname, 'w') as fn:
-            for device, logdata in sorted(self.log.items()):
+            for device, device_log_name in sorted(self.log.items()):
                 # header information
                 fn.write("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n")
                 fn.write(device + "\n")
                 fn.write("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
 
                 # write actual log data
-                for line in logdata.splitlines():
-                    fn.write(line + '\n')
+                with open(device_log_name, 'r') as device_log:
+                    for line in device_log:
+                        fn.write(line.rstrip('\r\n') + '\n')
 
                 fn.write('\n')
 
+        # the device log files are now part of the final log file
+        for device_log_name in self.log.values():
+            os.remove(device_log_name)
+
+        self.log = {}
+
 def main():
     """ main function to run script """
 
@@ -250,13 +661,34 @@ def main():
 
     # initialize script
     quick_deploy_introduction()
-    qd_script = QuickDeploy()
+
+    # optional flags
+    # --profile -> times every device and command and logs them as json lines
+    # --cache   -> reuses the show outputs of the last ten minutes
+    profiler = None
+    if '--profile' in sys.argv[1:]:
+        profiler = SSHProfiler('quick_deploy_profile.jsonl')
+
+    output_cache = None
+    if '--cache' in sys.argv[1:]:
+        output_cache = OutputCache('quick_deploy_cache.db', ttl=600)
+
+    qd_script = QuickDeploy(profiler=profiler, output_cache=output_cache)
 
     # only run script if user is comfortable with suggested updates
     if qd_script.display_warning_to_user():
         qd_script.run_commands()
         qd_script.write_log()
 
+    # close all existing ssh sessions
+    qd_script.connection_pool.close_all()
+
+    if qd_script.profiler is not None:
+        qd_script.profiler.close()
+
+    if qd_script.output_cache is not None:
+        qd_script.output_cache.close()
+
     # pauses the script at the end to state message
     input("\nComplete!")
 
@@ -0,0 +1,155 @@
+""" benchmark parsebgp
+scales bgptable_sample.txt up to a table of the requested size and times
+the parse engines of parsebgp against it, followed by the per word cost of
+the address recognizer used by the line by line engines
+
+usage: python benchmark_parsebgp.py [prefixes] [engine ...]
+example: python benchmark_parsebgp.py 900000 fast
+"""
+
+import ipaddress
+import os
+import sys
+import tempfile
+import time
+
+import parsebgp
+
+
+def read_sample_paths(filename='bgptable_sample.txt'):
+    """ read sample paths
+    groups the path lines of the sample table by their prefix, with the
+    prefix itself cut off so that it can be replaced """
+
+    # {prefix : [rest of line1, rest of line2, ...]}
+    sample_paths = {}
+
+    with open(filename, 'r') as fn:
+        for line in fn:
+            words = line.split(None, 1)
+
+            # skip empty lines
+            if len(words) != 2:
+                continue
+
+            prefix = words[0].strip('>')
+            sample_paths.setdefault(prefix, []).append(words[1].rstrip('\n') + '\n')
+
+    return list(sample_paths.values())
+
+def generate_bgp_table(filename, prefixes):
+    """ generate bgp table
+    writes a table with the requested number of /24 prefixes, every prefix
+    reusing the paths of one of the sample prefixes """
+
+    sample_paths = read_sample_paths()
+
+    with open(filename, 'w') as fn:
+        for i in range(prefixes):
+            # walk through the ipv4 space one /24 at a time, from 1.0.0.0
+            network = (1 << 24) + (i << 8)
+            prefix = '%d.%d.%d.0/24' % (
+                network >> 24, (network >> 16) & 255, (network >> 8) & 255,
+                )
+
+            # best path first, just like the sample
+            paths = sample_paths[i % len(sample_paths)]
+            fn.write('>' + prefix + ' ' + paths[0])
+            for path in paths[1:]:
+                fn.write(' ' + prefix + ' ' + path)
+
+def time_engine(filename, parse_mode):
+    """ time engine
+    parses the table with the given engine and returns the elapsed time
+    together with the parsed database """
+
+    start_timer = time.time()
+
+    if parse_mode == 'fast':
+        bgp_db = parsebgp.fast_bgp_parse(filename)
+    elif parse_mode == 'parallel':
+        bgp_db = parsebgp.parallel_bgp_parse(filename)
+    elif parse_mode == 'strict':
+        bgp_db = parsebgp.line_bgp_parse(filename, parsebgp.strict_parse)
+    else:
+        bgp_db = parsebgp.line_bgp_parse(filename, parsebgp.flexible_parse)
+
+    return time.time() - start_timer, bgp_db
+
+def ipaddress_check(potential_address):
+    """ ipaddress check
+    the address check the line by line engines used before, kept here to
+    compare against """
+
+    try:
+        ipaddress.IPv4Interface(potential_address)
+        return True
+    except ipaddress.AddressValueError:
+        return False
+
+def time_recognizers(filename, max_words=200000):
+    """ time recognizers
+    times the address check on the words of the table, as the flexible
+    parse engine sees them, and prints the cost per word """
+
+    words = []
+
+    with open(filename, 'r') as fn:
+        for line in fn:
+            words.extend(
+                parsebgp.SPECIAL_CHARACTERS.sub('', word) for word in line.split()
+                )
+            if len(words) >= max_words:
+                break
+
+    addresses = sum(1 for word in words if parsebgp.parse_ipv4_token(word))
+
+    print('\nAddress check over ' + str(len(words)) + ' words, ' +
+          str(addresses) + ' of them addresses\n')
+
+    for name, check in (
+            ('ipaddress', ipaddress_check),
+            ('recognizer', parsebgp.parse_ipv4_token)):
+        start_timer = time.perf_counter()
+        for word in words:
+            check(word)
+        elapsed = time.perf_counter() - start_timer
+
+        print('%-10s %8.0f ns/word' % (name, elapsed / len(words) * 1e9))
+
+def main():
+    # number of prefixes, a full internet table is around 900000
+    prefixes = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    # engines to compare, the line by line engines take hours on a full table
+    engines = sys.argv[2:] or ['fast', 'parallel', 'flexible']
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filename = os.path.join(temp_dir, 'bgptable.txt')
+
+        print('Generating table with ' + str(prefixes) + ' prefixes...')
+        generate_bgp_table(filename, prefixes)
+
+        size = os.path.getsize(filename)
+        print('Table size: ' + str(size // (1024 * 1024)) + ' MB\n')
+
+        results = {}
+
+        for parse_mode in engines:
+            elapsed, bgp_db = time_engine(filename, parse_mode)
+            results[parse_mode] = bgp_db
+
+            print('%-10s %8.2f s %8.1f MB/s %10d prefixes' % (
+                parse_mode, elapsed, size / elapsed / (1024 * 1024), len(bgp_db),
+                ))
+
+        # every engine has to come up with the same answer
+        reference = results[engines[0]]
+        for parse_mode in engines[1:]:
+            if results[parse_mode] != reference:
+                print('\nMISMATCH: ' + parse_mode + ' differs from ' + engines[0])
+
+        time_recognizers(filename)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+""" bgp paths
+interned as paths of the parsed bgp table. a full table has millions of
+routes but only a fraction of that in distinct as paths, so every distinct
+path is stored once as a run of uint32 as numbers and every route only
+keeps the id of its path. once the table is parsed, the routes are grouped
+by prefix in the same order as the redundancy store, so the per prefix
+analytics come down to a few numpy operations over flat arrays.
+
+the paths are saved as a small versioned header followed by the raw arrays,
+which can be memory mapped straight back in
+
+    header   -> magic 'BGPA', uint16 version, uint16 reserved,
+                uint64 path count, uint64 as count,
+                uint64 prefix count, uint64 route count
+    paths    -> path count + 1 x uint32 offsets into the as numbers
+    asns     -> as count x uint32
+    prefixes -> prefix count + 1 x uint32 offsets into the path ids
+    routes   -> route count x uint32 path ids
+"""
+
+from array import array
+import os
+import struct
+
+import numpy as np
+
+from bgpstore import map_columns, map_file, write_columns
+
+
+# binary path file format
+PATHS_MAGIC = b'BGPA'
+PATHS_VERSION = 1
+PATHS_HEADER = struct.Struct('<4sHHQQQQ')
+
+# origin codes at the end of the cisco path column
+ORIGIN_CODES = (b'i', b'e', b'?')
+
+
+def parse_as_path(text):
+    """ parse as path
+    turns the path column of a route into its as numbers. asdot numbers
+    such as '3.5410' are packed into their 32 bit asplain value, as sets
+    such as '{64512,64513}' are flattened and the origin code is dropped
+
+    output -> (34224, 6939, 4826, 38803, 56203)
+    """
+
+    asns = []
+
+    for word in text.split():
+        if word in ORIGIN_CODES:
+            continue
+
+        for asn in word.strip(b'{}()[]').split(b','):
+            high, dot, low = asn.partition(b'.')
+
+            if not high.isdigit() or (dot and not low.isdigit()):
+                continue
+
+            if dot:
+                asns.append(int(high) << 16 | int(low))
+            else:
+                asns.append(int(high))
+
+    return tuple(asns)
+
+def store_position(bgp_store, prefix):
+    """ store position
+    position of the prefix within the redundancy store, -1 for a prefix
+    the store skipped as invalid """
+
+    try:
+        position = bgp_store.index(prefix)
+    except ValueError:
+        return -1
+
+    return -1 if position is None else position
+
+class ASPathTable:
+    """ as path table
+    every distinct as path once, routes as (prefix, path id) pairs """
+
+    def __init__(self, offsets=None, asns=None, prefix_offsets=None, path_ids=None):
+        # path i is asns[offsets[i]:offsets[i + 1]]
+        self.offsets = offsets if offsets is not None else array('I', [0])
+        self.asns = asns if asns is not None else array('I')
+
+        # paths of the prefix at position i of the redundancy store are
+        # path_ids[prefix_offsets[i]:prefix_offsets[i + 1]]
+        self.prefix_offsets = prefix_offsets
+        self.path_ids = path_ids
+
+        # only needed while parsing
+        # {raw path column : path id}, {as numbers : path id}
+        self.raw_ids = {}
+        self.path_lookup = {}
+
+        # {prefix : ordinal} in order of appearance, with one ordinal and
+        # one path id per route
+        self.prefixes = {}
+        self.route_prefixes = array('I')
+        self.route_paths = array('I')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def intern(self, text):
+        """ intern
+        id of the as path in the raw path column text, added to the table
+        the first time it is seen """
+
+        # the same column text comes up over and over
+        path_id = self.raw_ids.get(text)
+        if path_id is not None:
+            return path_id
+
+        # differently spaced text can still be the same path
+        asns = parse_as_path(text)
+
+        path_id = self.path_lookup.get(asns)
+        if path_id is None:
+            path_id = len(self)
+            self.path_lookup[asns] = path_id
+            self.asns.extend(asns)
+            self.offsets.append(len(self.asns))
+
+        self.raw_ids[bytes(text)] = path_id
+
+        return path_id
+
+    def add_route(self, prefix, text):
+        """ add route
+        records one route of the prefix with the path in text """
+
+        ordinal = self.prefixes.get(prefix)
+        if ordinal is None:
+            ordinal = self.prefixes[prefix] = len(self.prefixes)
+
+        self.route_prefixes.append(ordinal)
+        self.route_paths.append(self.intern(text))
+
+    def index(self, bgp_store):
+        """ index
+        groups the routes by prefix in the order of the redundancy store,
+        which is what every per prefix result lines up with. routes of
+        prefixes the store skipped as invalid are dropped, and so are the
+        parsing leftovers afterwards """
+
+        # store position of every prefix, by order of appearance, -1 for
+        # the prefixes that are not in the store
+        positions = np.array(
+            [store_position(bgp_store, prefix) for prefix in self.prefixes],
+            dtype=np.int64,
+            )[np.frombuffer(self.route_prefixes, dtype=np.uint32)]
+
+        path_ids = np.frombuffer(self.route_paths, dtype=np.uint32)
+
+        if (positions < 0).any():
+            path_ids = path_ids[positions >= 0]
+            positions = positions[positions >= 0]
+
+        # stable, so the routes of a prefix keep their order
+        order = np.argsort(positions, kind='stable')
+
+        self.path_ids = path_ids[order]
+        self.prefix_offsets = np.concatenate((
+            [0], np.cumsum(np.bincount(positions, minlength=len(bgp_store))),
+            )).astype(np.uint32)
+
+        self.raw_ids = {}
+        self.path_lookup = {}
+        self.prefixes = {}
+        self.route_prefixes = array('I')
+        self.route_paths = array('I')
+
+    def path(self, path_id):
+        """ path
+        as numbers of the path """
+
+        return tuple(self.asns[self.offsets[path_id]:self.offsets[path_id + 1]])
+
+    def prefix_paths(self, position):
+        """ prefix paths
+        as paths of the prefix at the given position of the redundancy store
+
+        output -> [(34224, 6939, ...), (37100, 6939, ...), ...]
+        """
+
+        start = self.prefix_offsets[position]
+        end = self.prefix_offsets[position + 1]
+
+        return [self.path(path_id) for path_id in self.path_ids[start:end]]
+
+    def path_lengths(self):
+        """ path lengths
+        number of as numbers in every path, by path id """
+
+        return np.diff(np.asarray(self.offsets, dtype=np.int64))
+
+    def upstream_asns(self):
+        """ upstream asns
+        first as number of every path, the neighbor the route was learned
+        from, by path id. 0 for an empty path, a route originated locally """
+
+        offsets = np.asarray(self.offsets, dtype=np.int64)
+        asns = np.append(np.asarray(self.asns, dtype=np.uint32), 0)
+
+        return np.where(np.diff(offsets) > 0, asns[offsets[:-1]], 0)
+
+    def route_prefix_positions(self):
+        """ route prefix positions
+        redundancy store position of the prefix of every route """
+
+        offsets = np.asarray(self.prefix_offsets, dtype=np.int64)
+
+        return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    def path_length_distribution(self):
+        """ path length distribution
+        number of routes per as path length across the table
+
+        output -> distribution[length] = routes
+        """
+
+        return np.bincount(self.path_lengths()[np.asarray(self.path_ids)])
+
+    def prefix_path_lengths(self):
+        """ prefix path lengths
+        shortest, average and longest as path of every prefix, in the order
+        of the redundancy store. prefixes without routes get zeros
+
+        output -> (shortest, average, longest)
+        """
+
+        offsets = np.asarray(self.prefix_offsets, dtype=np.int64)
+        routes = np.diff(offsets)
+        lengths = self.path_lengths()[np.asarray(self.path_ids)]
+
+        shortest = np.zeros(len(routes), dtype=np.int64)
+        average = np.zeros(len(routes), dtype=np.float64)
+        longest = np.zeros(len(routes), dtype=np.int64)
+
+        # reduceat only over the prefixes that have routes, their starts are
+        # strictly increasing and every segment runs up to the next one, so
+        # the empty prefixes in between are simply left at zero
+        has_routes = routes > 0
+        if not has_routes.any():
+            return shortest, average, longest
+
+        starts = offsets[:-1][has_routes]
+
+        shortest[has_routes] = np.minimum.reduceat(lengths, starts)
+        longest[has_routes] = np.maximum.reduceat(lengths, starts)
+        average[has_routes] = np.add.reduceat(lengths, starts) / routes[has_routes]
+
+        return shortest, average, longest
+
+    def upstream_diversity(self):
+        """ upstream diversity
+        number of distinct upstream as numbers of every prefix, in the order
+        of the redundancy store """
+
+        positions = self.route_prefix_positions()
+        upstreams = self.upstream_asns()[np.asarray(self.path_ids)]
+
+        # one key per (prefix, upstream) pair, duplicates dropped
+        pairs = np.unique(positions << 32 | upstreams.astype(np.int64))
+
+        return np.bincount(pairs >> 32, minlength=len(self.prefix_offsets) - 1)
+
+    def save(self, filename):
+        """ save
+        writes the indexed paths in the binary columnar format, swapped in
+        just like the store file """
+
+        temp_filename = filename + '.tmp'
+
+        with open(temp_filename, 'wb') as fn:
+            fn.write(PATHS_HEADER.pack(
+                PATHS_MAGIC, PATHS_VERSION, 0, len(self), len(self.asns),
+                len(self.prefix_offsets) - 1, len(self.path_ids),
+                ))
+
+            write_columns(fn, (
+                (self.offsets, 'I'), (self.asns, 'I'),
+                (self.prefix_offsets, 'I'), (self.path_ids, 'I'),
+                ))
+
+        os.replace(temp_filename, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """ load
+        memory maps paths saved in the binary columnar format """
+
+        data = map_file(filename)
+
+        magic, version, _, paths, asns, prefixes, routes = \
+            PATHS_HEADER.unpack_from(data)
+
+        if magic != PATHS_MAGIC:
+            raise ValueError(filename + ' is not a bgp paths file')
+        if version != PATHS_VERSION:
+            raise ValueError(
+                filename + ' has unsupported bgp paths version ' + str(version)
+                )
+
+        columns, _ = map_columns(data, PATHS_HEADER.size, (
+            (paths + 1, 'I'), (asns, 'I'), (prefixes + 1, 'I'), (routes, 'I'),
+            ))
+
+        return cls(*columns)
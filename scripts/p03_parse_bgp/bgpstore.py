@@ -0,0 +1,309 @@
+""" bgp store
+compact redundancy store for the parsed bgp table. every prefix is packed
+into a 32 bit network and an 8 bit prefix length, with the redundancy
+counts kept in a parallel array. the arrays are sorted once when the store
+is built, so the prefixes always come out in proper ip address order.
+
+the store is saved as a small versioned header followed by the raw arrays,
+which can be memory mapped straight back in without any parsing
+
+    header   -> magic 'BGPR', uint16 version, uint16 reserved, uint64 count
+    networks -> count x little endian uint32
+    counts   -> count x little endian uint32
+    lengths  -> count x uint8
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+import mmap
+import os
+import struct
+import sys
+
+
+# binary store file format
+STORE_MAGIC = b'BGPR'
+STORE_VERSION = 1
+STORE_HEADER = struct.Struct('<4sHHQ')
+
+
+def parse_prefix(prefix):
+    """ parse prefix
+    turns a prefix such as '1.0.4.0/22' (str or bytes) into its packed
+    network and prefix length, without going through the ipaddress library.
+    cisco leaves out the prefix length of classful networks, so it is
+    derived from the first octet in that case. raises a ValueError for
+    anything that is not a valid prefix, such as '1.0.400.0/22' or
+    '1.0.4.0/40', which the address shaped patterns of the fast parse
+    engines still let through
+
+    output -> (network, length) = (16778240, 22)
+    """
+
+    if isinstance(prefix, bytes):
+        prefix = prefix.decode('ascii')
+
+    address, _, length = prefix.partition('/')
+    octets = address.split('.')
+
+    try:
+        first, second, third, fourth = [int(octet) for octet in octets]
+        length = int(length) if length else None
+    except ValueError:
+        raise ValueError('invalid prefix ' + repr(prefix)) from None
+
+    if first > 255 or second > 255 or third > 255 or fourth > 255 or \
+            min(first, second, third, fourth) < 0:
+        raise ValueError('invalid prefix ' + repr(prefix) + ', octets must be 0-255')
+
+    if length is not None and not 0 <= length <= 32:
+        raise ValueError('invalid prefix ' + repr(prefix) + ', length must be 0-32')
+
+    network = (first << 24) | (second << 16) | (third << 8) | fourth
+
+    # explicit prefix length
+    if length is not None:
+        return network, length
+
+    # classful prefix length, class a, b or c
+    if network < 0x80000000:
+        return network, 8
+    elif network < 0xC0000000:
+        return network, 16
+    else:
+        return network, 24
+
+def format_prefix(network, length):
+    """ format prefix
+    turns a packed network and prefix length back into '1.0.4.0/22' """
+
+    return '%d.%d.%d.%d/%d' % (
+        network >> 24, (network >> 16) & 255, (network >> 8) & 255,
+        network & 255, length,
+        )
+
+def map_file(filename):
+    """ map file
+    read only memory map of an entire file """
+
+    with open(filename, 'rb') as fn:
+        return mmap.mmap(fn.fileno(), 0, access=mmap.ACCESS_READ)
+
+def write_columns(fn, columns):
+    """ write columns
+    writes (column, typecode) pairs one after the other as raw little
+    endian arrays """
+
+    for column, typecode in columns:
+        column = array(typecode, column)
+
+        # the file is always little endian
+        if sys.byteorder != 'little':
+            column.byteswap()
+
+        column.tofile(fn)
+
+def map_columns(data, offset, layout):
+    """ map columns
+    reads back (length, typecode) columns written by write_columns, starting
+    at offset. zero copy views on little endian machines, copies otherwise
+
+    output -> ([column1, column2, ...], offset right after the columns)
+    """
+
+    view = memoryview(data)
+    columns = []
+
+    for length, typecode in layout:
+        end = offset + length * array(typecode).itemsize
+
+        if sys.byteorder == 'little':
+            column = view[offset:end].cast(typecode)
+        else:
+            column = array(typecode)
+            column.frombytes(view[offset:end])
+            column.byteswap()
+
+        columns.append(column)
+        offset = end
+
+    return columns, offset
+
+class BGPRedundancyStore:
+    """ bgp redundancy store
+    sorted parallel arrays of networks, prefix lengths and redundancy counts,
+    roughly 9 bytes per prefix instead of 100+ for a dictionary entry """
+
+    def __init__(self, networks=None, lengths=None, counts=None):
+        # the arrays must already be sorted by network, then by length
+        self.networks = networks if networks is not None else array('I')
+        self.lengths = lengths if lengths is not None else array('B')
+        self.counts = counts if counts is not None else array('I')
+
+    @classmethod
+    def from_bgp_db(cls, bgp_db):
+        """ from bgp db
+        builds the store out of a {prefix : count} dictionary, the prefixes
+        can be str or bytes. this is the only time the prefixes are sorted.
+        prefixes that are not valid, left over from garbled lines, are not
+        routes and are skipped """
+
+        packed = []
+
+        for prefix, count in bgp_db.items():
+            try:
+                network, length = parse_prefix(prefix)
+            except ValueError:
+                continue
+
+            packed.append((network << 6 | length, count))
+
+        # sort on a single integer per prefix, network first then length
+        entries = sorted(packed)
+
+        networks = array('I', [key >> 6 for key, count in entries])
+        lengths = array('B', [key & 63 for key, count in entries])
+        counts = array('I', [count for key, count in entries])
+
+        return cls(networks, lengths, counts)
+
+    @classmethod
+    def concatenate(cls, parts):
+        """ concatenate
+        builds a store out of slices of other stores, the slices are given
+        as (store, start, end) and must already be in ip address order """
+
+        networks = array('I')
+        lengths = array('B')
+        counts = array('I')
+
+        for store, start, end in parts:
+            networks.extend(store.networks[start:end])
+            lengths.extend(store.lengths[start:end])
+            counts.extend(store.counts[start:end])
+
+        return cls(networks, lengths, counts)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __iter__(self):
+        """ iterates through the prefixes, in ip address order """
+
+        for network, length in zip(self.networks, self.lengths):
+            yield format_prefix(network, length)
+
+    def __contains__(self, prefix):
+        return self.index(prefix) is not None
+
+    def __getitem__(self, prefix):
+        i = self.index(prefix)
+        if i is None:
+            raise KeyError(prefix)
+        return self.counts[i]
+
+    def index(self, prefix):
+        """ index
+        position of the prefix within the arrays, or None if it is not
+        stored. binary search on the network, then a short scan through
+        the prefix lengths sharing that network """
+
+        network, length = parse_prefix(prefix)
+
+        i = bisect_left(self.networks, network)
+
+        while i < len(self.networks) and self.networks[i] == network:
+            if self.lengths[i] == length:
+                return i
+            i += 1
+
+        return None
+
+    def index_range(self, first_network, last_network):
+        """ index range
+        start and end positions of the prefixes whose network falls
+        between first_network and last_network, both included """
+
+        return (
+            bisect_left(self.networks, first_network),
+            bisect_right(self.networks, last_network),
+        )
+
+    def get(self, prefix, default=None):
+        """ get
+        redundancy count of the prefix, or default if it is not stored """
+
+        i = self.index(prefix)
+        if i is None:
+            return default
+        return self.counts[i]
+
+    def items(self):
+        """ items
+        iterates through (prefix, count), in ip address order """
+
+        for network, length, count in zip(self.networks, self.lengths, self.counts):
+            yield format_prefix(network, length), count
+
+    def save(self, filename):
+        """ save
+        writes the store in the binary columnar format. the file is written
+        next to the target and then swapped in, so a store that is still
+        memory mapped from the old file is never pulled from under it """
+
+        temp_filename = filename + '.tmp'
+
+        with open(temp_filename, 'wb') as fn:
+            fn.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, 0, len(self)))
+            self.write_columns(fn)
+
+        os.replace(temp_filename, filename)
+
+    def write_columns(self, fn):
+        """ write columns
+        writes the networks, counts and lengths columns to an open file """
+
+        write_columns(fn, (
+            (self.networks, 'I'), (self.counts, 'I'), (self.lengths, 'B'),
+            ))
+
+    @classmethod
+    def load(cls, filename):
+        """ load
+        memory maps a store saved in the binary columnar format. the columns
+        are used straight from the mapped file, nothing is parsed or copied,
+        so even a full table loads instantly """
+
+        data = map_file(filename)
+
+        magic, version, _, count = STORE_HEADER.unpack_from(data)
+
+        if magic != STORE_MAGIC:
+            raise ValueError(filename + ' is not a bgp store file')
+        if version != STORE_VERSION:
+            raise ValueError(
+                filename + ' has unsupported bgp store version ' + str(version)
+                )
+
+        return cls.map_columns(data, STORE_HEADER.size, count)[0]
+
+    @classmethod
+    def map_columns(cls, data, offset, count):
+        """ map columns
+        store made out of the columns written by write_columns, starting at
+        offset within the mapped data
+
+        output -> (bgp_store, offset right after the columns)
+        """
+
+        (networks, counts, lengths), offset = map_columns(
+            data, offset, ((count, 'I'), (count, 'I'), (count, 'B')),
+            )
+
+        return cls(networks, lengths, counts), offset
+
+    def to_dict(self):
+        """ to dict
+        plain {prefix : count} dictionary, in ip address order """
+
+        return dict(self.items())
@@ -0,0 +1,457 @@
+""" bgp trie
+immutable radix (patricia) trie over the bgp redundancy store, for the
+questions an exact prefix lookup can not answer, such as the route covering
+8.8.8.8 or every more specific under 1.0.0.0/8.
+
+the trie only has nodes for the stored prefixes plus the branching points
+between them, and every node is a row in a handful of flat arrays instead
+of a python object. since the store is sorted, the prefixes under any node
+are one contiguous slice of the store, so every node also keeps the start
+and end of its slice. together with a running total of the redundancy
+counts, any subtree is summed up without walking it. a jump table indexed
+by the first 16 bits of the address skips the top of the trie, which is
+where most of the walk would otherwise be spent.
+
+the trie is saved as a small versioned header followed by the raw arrays,
+the store included, which can be memory mapped straight back in
+
+    header   -> magic 'BGPT', uint16 version, uint16 reserved,
+                uint64 node count, uint64 prefix count
+    nodes    -> networks uint32, left uint32, right uint32, entries uint32,
+                firsts uint32, ends uint32, lengths uint8
+    jumps    -> 65536 x node uint32, 65536 x entry uint32
+    store    -> networks uint32, counts uint32, lengths uint8
+    totals   -> prefix count + 1 x uint64
+"""
+
+from array import array
+import os
+import struct
+import sys
+
+from bgpstore import (
+    BGPRedundancyStore, format_prefix, map_columns, map_file, write_columns,
+)
+
+
+# binary trie file format
+TRIE_MAGIC = b'BGPT'
+TRIE_VERSION = 1
+TRIE_HEADER = struct.Struct('<4sHHQQ')
+
+# missing child or a node without a stored prefix
+NO_NODE = 0xFFFFFFFF
+
+# number of leading address bits resolved by the jump table
+JUMP_BITS = 16
+
+
+def parse_query(prefix):
+    """ parse query
+    turns '8.8.8.8' or '1.0.0.0/8' into its packed network and prefix
+    length. unlike the table itself, an address without a prefix length
+    is a host route
+
+    output -> (network, length) = (134744072, 32)
+    """
+
+    # already packed address
+    if isinstance(prefix, int):
+        return prefix, 32
+
+    if isinstance(prefix, bytes):
+        prefix = prefix.decode('ascii')
+
+    address, _, length = prefix.partition('/')
+    octets = address.split('.')
+
+    network = (
+        (int(octets[0]) << 24) | (int(octets[1]) << 16) |
+        (int(octets[2]) << 8) | int(octets[3])
+    )
+    length = int(length) if length else 32
+
+    # host bits are ignored, 1.2.3.4/8 is 1.0.0.0/8
+    return network & (0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF, length
+
+class BGPPrefixTrie:
+    """ bgp prefix trie
+    flat array patricia trie, node 0 is the root 0.0.0.0/0 """
+
+    def __init__(self, store, networks, lengths, left, right, entries,
+                 firsts, ends, totals, jump_nodes, jump_entries):
+        # prefixes and redundancy counts, in ip address order
+        self.store = store
+
+        # one row per node, its prefix and its two children
+        self.networks = networks
+        self.lengths = lengths
+        self.left = left
+        self.right = right
+
+        # position of the node prefix within the store, NO_NODE for the
+        # branching nodes that only exist to split the trie
+        self.entries = entries
+
+        # slice of the store holding the prefixes under the node
+        self.firsts = firsts
+        self.ends = ends
+
+        # totals[i] = sum of the first i redundancy counts of the store
+        self.totals = totals
+
+        # for every /16, the deepest node covering it of at most 16 bits and
+        # the most specific stored prefix on the way down to that node
+        self.jump_nodes = jump_nodes
+        self.jump_entries = jump_entries
+
+    @classmethod
+    def from_store(cls, store):
+        """ from store
+        builds the trie in a single pass over the sorted store. the store
+        order visits every prefix before the prefixes under it, so only the
+        path from the root down to the previous prefix has to be kept """
+
+        networks = [0]
+        lengths = [0]
+        left = [NO_NODE]
+        right = [NO_NODE]
+        entries = [NO_NODE]
+        firsts = [0]
+        ends = [len(store)]
+
+        def add_node(network, length, entry, first):
+            networks.append(network)
+            lengths.append(length)
+            left.append(NO_NODE)
+            right.append(NO_NODE)
+            entries.append(entry)
+            firsts.append(first)
+            ends.append(first)
+            return len(networks) - 1
+
+        def add_child(parent, child):
+            # the first bit after the parent prefix picks the side
+            if networks[child] >> (31 - lengths[parent]) & 1:
+                right[parent] = child
+            else:
+                left[parent] = child
+
+        # nodes from the root down to the previous prefix
+        path = [0]
+
+        for i, (network, length) in enumerate(zip(store.networks, store.lengths)):
+            # leave every node that does not cover this prefix, the root
+            # covers everything so it is never left
+            child = NO_NODE
+            while True:
+                parent = path[-1]
+                parent_length = lengths[parent]
+                if parent_length <= length and \
+                        not (network ^ networks[parent]) >> (32 - parent_length):
+                    break
+                child = path.pop()
+                ends[child] = i
+
+            # default route, the root itself
+            if parent_length == length:
+                entries[parent] = i
+                continue
+
+            node = add_node(network, length, i, i)
+
+            # the previous child of the parent shares more bits with this
+            # prefix than the parent does, split them at a branching node
+            if child != NO_NODE:
+                common = 32 - (network ^ networks[child]).bit_length()
+                if common > parent_length:
+                    branch = add_node(
+                        network & (0xFFFFFFFF << (32 - common)) & 0xFFFFFFFF,
+                        common, NO_NODE, firsts[child],
+                        )
+                    add_child(parent, branch)
+                    add_child(branch, child)
+                    path.append(branch)
+                    parent = branch
+
+            add_child(parent, node)
+            path.append(node)
+
+        # whatever is left on the path runs up to the end of the store
+        for node in path:
+            ends[node] = len(store)
+
+        # running total of the redundancy counts
+        totals = [0]
+        for count in store.counts:
+            totals.append(totals[-1] + count)
+
+        # fill in the jump table from the top of the trie down, so that the
+        # more specific nodes overwrite the ones above them
+        jump_nodes = array('I', [0]) * (1 << JUMP_BITS)
+        jump_entries = array('I', [NO_NODE]) * (1 << JUMP_BITS)
+
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if lengths[node] > JUMP_BITS:
+                continue
+
+            start = networks[node] >> (32 - JUMP_BITS)
+            end = start + (1 << (JUMP_BITS - lengths[node]))
+
+            jump_nodes[start:end] = array('I', [node]) * (end - start)
+            if entries[node] != NO_NODE:
+                jump_entries[start:end] = array('I', [entries[node]]) * (end - start)
+
+            stack.extend(
+                child for child in (right[node], left[node]) if child != NO_NODE
+                )
+
+        return cls(
+            store,
+            array('I', networks), array('B', lengths),
+            array('I', left), array('I', right), array('I', entries),
+            array('I', firsts), array('I', ends), array('Q', totals),
+            jump_nodes, jump_entries,
+            )
+
+    def __len__(self):
+        return len(self.store)
+
+    def walk(self, prefix):
+        """ walk
+        follows the trie down towards the prefix, yielding every node on
+        the way whose prefix covers it, least specific first """
+
+        network, length = parse_query(prefix)
+
+        networks = self.networks
+        lengths = self.lengths
+        left = self.left
+        right = self.right
+
+        node = 0
+        while node != NO_NODE:
+            node_length = lengths[node]
+            if node_length > length or \
+                    (network ^ networks[node]) >> (32 - node_length):
+                return
+
+            yield node
+
+            if node_length == 32:
+                return
+
+            if network >> (31 - node_length) & 1:
+                node = right[node]
+            else:
+                node = left[node]
+
+    def longest_match(self, prefix):
+        """ longest match
+        most specific stored prefix covering the address or prefix, the
+        route the router would actually use
+
+        output -> (prefix, count) or None if nothing covers it
+        """
+
+        network, length = parse_query(prefix)
+
+        networks = self.networks
+        lengths = self.lengths
+        left = self.left
+        right = self.right
+        entries = self.entries
+
+        # skip the top of the trie for anything longer than the jump table
+        if length >= JUMP_BITS:
+            best = self.jump_entries[network >> (32 - JUMP_BITS)]
+            node = self.jump_nodes[network >> (32 - JUMP_BITS)]
+        else:
+            best = NO_NODE
+            node = 0
+
+        # same as walk, inlined since this is the hot query
+        while node != NO_NODE:
+            node_length = lengths[node]
+            if node_length > length or \
+                    (network ^ networks[node]) >> (32 - node_length):
+                break
+
+            if entries[node] != NO_NODE:
+                best = entries[node]
+
+            if node_length == 32:
+                break
+
+            if network >> (31 - node_length) & 1:
+                node = right[node]
+            else:
+                node = left[node]
+
+        if best == NO_NODE:
+            return None
+
+        return self.entry(best)
+
+    def covering(self, prefix):
+        """ covering
+        every stored prefix covering the address or prefix, itself
+        included, least specific first
+
+        output -> [(prefix, count), ...]
+        """
+
+        entries = self.entries
+
+        return [
+            self.entry(entries[node])
+            for node in self.walk(prefix)
+            if entries[node] != NO_NODE
+        ]
+
+    def covered_range(self, prefix):
+        """ covered range
+        start and end positions within the store of the stored prefixes
+        under the prefix, itself included """
+
+        network, length = parse_query(prefix)
+
+        networks = self.networks
+        lengths = self.lengths
+        left = self.left
+        right = self.right
+
+        # skip the top of the trie for anything longer than the jump table
+        if length >= JUMP_BITS:
+            node = self.jump_nodes[network >> (32 - JUMP_BITS)]
+        else:
+            node = 0
+
+        # first node at or below the prefix length on the way down
+        while node != NO_NODE:
+            node_length = lengths[node]
+            if node_length >= length:
+                break
+
+            if network >> (31 - node_length) & 1:
+                node = right[node]
+            else:
+                node = left[node]
+
+        # the trie skipped past the prefix into a different subtree
+        if node == NO_NODE or (network ^ networks[node]) >> (32 - length):
+            return 0, 0
+
+        return self.firsts[node], self.ends[node]
+
+    def covered(self, prefix):
+        """ covered
+        every stored prefix under the prefix, itself included, in ip address
+        order
+
+        output -> [(prefix, count), ...]
+        """
+
+        start, end = self.covered_range(prefix)
+
+        return [self.entry(i) for i in range(start, end)]
+
+    def aggregate(self, prefix):
+        """ aggregate
+        number of stored prefixes under the prefix, itself included, and the
+        sum of their redundancy counts. only the running totals are looked
+        at, so this costs the same for a /24 as for 0.0.0.0/0
+
+        output -> (prefixes, redundancy)
+        """
+
+        start, end = self.covered_range(prefix)
+
+        return end - start, self.totals[end] - self.totals[start]
+
+    def entry(self, i):
+        """ entry
+        prefix and redundancy count at position i of the store """
+
+        store = self.store
+
+        return format_prefix(store.networks[i], store.lengths[i]), store.counts[i]
+
+    def save(self, filename):
+        """ save
+        writes the trie in the binary columnar format, swapped in just like
+        the store file """
+
+        temp_filename = filename + '.tmp'
+
+        with open(temp_filename, 'wb') as fn:
+            fn.write(TRIE_HEADER.pack(
+                TRIE_MAGIC, TRIE_VERSION, 0, len(self.networks), len(self.store),
+                ))
+
+            write_columns(fn, (
+                (self.networks, 'I'), (self.left, 'I'), (self.right, 'I'),
+                (self.entries, 'I'), (self.firsts, 'I'), (self.ends, 'I'),
+                (self.lengths, 'B'),
+                (self.jump_nodes, 'I'), (self.jump_entries, 'I'),
+                ))
+            self.store.write_columns(fn)
+            write_columns(fn, ((self.totals, 'Q'),))
+
+        os.replace(temp_filename, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """ load
+        memory maps a trie saved in the binary columnar format, ready to be
+        queried without rebuilding anything """
+
+        data = map_file(filename)
+
+        magic, version, _, node_count, count = TRIE_HEADER.unpack_from(data)
+
+        if magic != TRIE_MAGIC:
+            raise ValueError(filename + ' is not a bgp trie file')
+        if version != TRIE_VERSION:
+            raise ValueError(
+                filename + ' has unsupported bgp trie version ' + str(version)
+                )
+
+        (networks, left, right, entries, firsts, ends, lengths,
+         jump_nodes, jump_entries), offset = \
+            map_columns(data, TRIE_HEADER.size, (
+                (node_count, 'I'), (node_count, 'I'), (node_count, 'I'),
+                (node_count, 'I'), (node_count, 'I'), (node_count, 'I'),
+                (node_count, 'B'),
+                (1 << JUMP_BITS, 'I'), (1 << JUMP_BITS, 'I'),
+                ))
+        store, offset = BGPRedundancyStore.map_columns(data, offset, count)
+        (totals,), offset = map_columns(data, offset, ((count + 1, 'Q'),))
+
+        return cls(
+            store, networks, lengths, left, right, entries, firsts, ends, totals,
+            jump_nodes, jump_entries,
+            )
+
+
+def main():
+    # usage: python bgptrie.py [8.8.8.8 1.0.0.0/8 ...]
+    # builds the trie out of the parsebgp store, then answers the queries
+    bgp_store = BGPRedundancyStore.load('fullbgpredundancy.bgpdb')
+
+    bgp_trie = BGPPrefixTrie.from_store(bgp_store)
+    bgp_trie.save('fullbgpredundancy.bgptrie')
+
+    for prefix in sys.argv[1:]:
+        print(prefix)
+        print('  longest match : ' + str(bgp_trie.longest_match(prefix)))
+        print('  covering      : ' + str(bgp_trie.covering(prefix)))
+
+        prefixes, redundancy = bgp_trie.aggregate(prefix)
+        print('  covered       : ' + str(prefixes) + ' prefixes, ' +
+              str(redundancy) + ' paths')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+""" check downsample
+checks downsample_min_max of graphbgp against a handful of synthetic
+redundancy curves, flat, random, spiky and stepped, at several sizes and
+target point counts. for every one of them the downsampled curve has to
+
+    - keep no more than target_points points, in order and without repeats
+    - keep the global lowest and highest value of the whole curve
+    - keep the lowest and highest value of every bucket
+
+a target of a single point has to be rejected, as it cannot hold both
+the lowest and the highest value. every failure is printed, and the
+script exits with an error if there was any, so that it can be run after
+any change to the downsampling
+
+usage: python check_downsample.py
+"""
+
+import sys
+
+import numpy as np
+
+from graphbgp import downsample_min_max
+
+
+def synthetic_curves(size, rng):
+    """ synthetic curves
+    redundancy count shaped curves of the given size
+
+    output -> {name : values}
+    """
+
+    spiky = rng.integers(1, 5, size)
+    if size:
+        spiky[rng.integers(0, size, 10)] = 5000
+        spiky[rng.integers(0, size, 10)] = 0
+
+    return {
+        'flat': np.full(size, 7),
+        'random': rng.integers(0, 1000, size),
+        'spiky': spiky,
+        'stepped': np.repeat(np.arange(10), -(-size // 10))[:size],
+        'descending': np.arange(size)[::-1],
+    }
+
+def bucket_starts(size, target_points):
+    """ bucket starts
+    start of every bucket, split the same way downsample_min_max does """
+
+    buckets = target_points // 2
+
+    return np.linspace(0, size, buckets, endpoint=False).astype(np.int64)
+
+def check_curve(values, target_points):
+    """ check curve
+    downsamples the curve and checks what was kept
+
+    output -> problems = [problem1, problem2, ...]
+    """
+
+    problems = []
+    indexes = downsample_min_max(values, target_points)
+    kept = set(indexes.tolist())
+
+    if len(indexes) > target_points:
+        problems.append(str(len(indexes)) + ' points kept')
+
+    if len(indexes) and (indexes[0] < 0 or indexes[-1] >= len(values)):
+        problems.append('indexes out of range')
+
+    if np.any(np.diff(indexes) <= 0):
+        problems.append('indexes not in order or repeated')
+
+    if not len(values):
+        return problems
+
+    kept_values = values[indexes]
+
+    if kept_values.min() != values.min() or kept_values.max() != values.max():
+        problems.append('global min / max lost')
+
+    # every point is kept when the curve is small enough already
+    if len(values) <= target_points:
+        if len(indexes) != len(values):
+            problems.append('points dropped from a small curve')
+        return problems
+
+    starts = bucket_starts(len(values), target_points)
+    ends = np.append(starts[1:], len(values))
+
+    for start, end in zip(starts, ends):
+        bucket = values[start:end]
+        bucket_kept = [values[i] for i in range(start, end) if i in kept]
+
+        if not bucket_kept or min(bucket_kept) != bucket.min() or \
+                max(bucket_kept) != bucket.max():
+            problems.append('bucket ' + str(start) + '-' + str(end) + ' min / max lost')
+            break
+
+    return problems
+
+def main():
+    rng = np.random.default_rng(2017)
+
+    failures = 0
+    checks = 0
+
+    for size in (0, 1, 7, 4000, 4001, 12345, 100000):
+        for target_points in (2, 3, 100, 999, 4000):
+            for name, values in synthetic_curves(size, rng).items():
+                checks += 1
+
+                for problem in check_curve(values, target_points):
+                    failures += 1
+                    print('FAILED %-10s size %6d target %4d: %s' % (
+                        name, size, target_points, problem,
+                        ))
+
+    # a single point cannot hold both the lowest and the highest value
+    checks += 1
+    try:
+        downsample_min_max(np.arange(10), 1)
+    except ValueError:
+        pass
+    else:
+        failures += 1
+        print('FAILED target 1: accepted')
+
+    print(str(checks) + ' checks, ' + str(failures) + ' failures')
+
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
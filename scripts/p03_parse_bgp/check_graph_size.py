@@ -0,0 +1,123 @@
+""" check graph size
+checks that the static page graph_bgp writes out of a sampled table grows
+with the number of points kept and not with the size of the table. the
+same number of points is sampled out of a small and a full sized
+synthetic table, and
+
+    - both pages have to be about the same size
+    - a page with ten times the points has to be clearly bigger
+
+every failure is printed, and the script exits with an error if there was
+any, so that it can be run after any change to the sampling or the graph.
+the pages are saved to a temporary folder instead of opened in a browser
+
+usage: python check_graph_size.py
+"""
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+from bokeh.io import save
+
+import graphbgp
+from bgpstore import BGPRedundancyStore
+
+# the pages of two tables sampled to the same number of points may differ
+# this much, the routes and counts kept are not the same
+TOLERANCE = 0.1
+
+
+def synthetic_store(size, rng):
+    """ synthetic store
+    bgp table shaped store of the given size, unique networks in ip address
+    order and mostly low redundancy counts with a few spikes and dips
+
+    output -> BGPRedundancyStore
+    """
+
+    networks = np.unique(rng.integers(0, 2 ** 32, size * 2, dtype=np.uint32))
+    networks = np.sort(rng.choice(networks, size, replace=False))
+
+    counts = rng.integers(1, 5, size).astype(np.uint32)
+    counts[rng.integers(0, size, 10)] = 5000
+    counts[rng.integers(0, size, 10)] = 0
+
+    lengths = rng.integers(8, 25, size).astype(np.uint8)
+
+    return BGPRedundancyStore(networks, lengths, counts)
+
+def page_size(bgp_db, target_points, folder):
+    """ page size
+    graphs the sampled store and measures the page written
+
+    output -> size of the page in bytes
+    """
+
+    route_labels, redundancy_counts, x_ticks = graphbgp.return_sampled_bgp_db(
+        bgp_db, target_points,
+        )
+
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        graphbgp.graph_bgp(route_labels, redundancy_counts, x_ticks)
+        return os.path.getsize('bgpgraph.html')
+    finally:
+        os.chdir(cwd)
+
+def main():
+    rng = np.random.default_rng(2017)
+
+    # write the page instead of opening it in a browser
+    graphbgp.show = save
+
+    stores = {size: synthetic_store(size, rng) for size in (10000, 1000000)}
+
+    failures = 0
+    checks = 0
+
+    with tempfile.TemporaryDirectory() as folder:
+        sizes = {}
+
+        for target_points in (400, 4000):
+            for table_size, bgp_db in stores.items():
+                sizes[table_size, target_points] = page_size(
+                    bgp_db, target_points, folder,
+                    )
+                print('table %7d points %4d: %8d bytes' % (
+                    table_size, target_points, sizes[table_size, target_points],
+                    ))
+
+    for target_points in (400, 4000):
+        checks += 1
+
+        small = sizes[10000, target_points]
+        full = sizes[1000000, target_points]
+
+        if abs(full - small) > TOLERANCE * small:
+            failures += 1
+            print('FAILED points %4d: %d bytes for the full table, %d for the small one' % (
+                target_points, full, small,
+                ))
+
+    for table_size in stores:
+        checks += 1
+
+        few = sizes[table_size, 400]
+        many = sizes[table_size, 4000]
+
+        if many < few * 2:
+            failures += 1
+            print('FAILED table %7d: %d bytes for 4000 points, %d for 400' % (
+                table_size, many, few,
+                ))
+
+    print(str(checks) + ' checks, ' + str(failures) + ' failures')
+
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
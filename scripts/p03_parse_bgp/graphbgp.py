@@ -1,15 +1,23 @@
-from bokeh.models import FuncTickFormatter
+import numpy as np
+from bokeh.events import RangesUpdate
+from bokeh.models import ColumnDataSource, FuncTickFormatter, Range1d
 from bokeh.plotting import figure, show, output_file
+from bokeh.server.server import Server
 from ruamel.yaml import YAML
-import socket
+from bgpstore import BGPRedundancyStore
 
 
-def graph_bgp(label_dict, redundancy_counts, x_ticks):
+def graph_bgp(route_labels, redundancy_counts, x_ticks):
     """ graph bgp
     the main graphing function used to graph the given dataset
     we will be graphing this two ways - full and downsampled
     for computers that cannot handle the full graph, please use the downsampled
-    data set in order to see the graph without hassle """
+    data set in order to see the graph without hassle
+
+    route_labels are the packed networks and prefix lengths of the routes,
+    the browser turns them back into '1.0.4.0/22' for the axis labels """
+
+    networks, lengths = route_labels
 
     # define output html file
     output_file("bgpgraph.html")
@@ -22,8 +30,17 @@ def graph_bgp(label_dict, redundancy_counts, x_ticks):
         output_backend="webgl", # allows us to utilize webgl to reduce load
         )
 
+    # every datapoint with its route, shipped to the browser once as binary
+    # columns that both the circles and the axis labels read from
+    source = ColumnDataSource(data={
+        'x': x_ticks,
+        'count': redundancy_counts,
+        'network': networks,
+        'length': lengths,
+        })
+
     # draw circles with size 1, color navy, and semi transparent for each datapoint
-    p.circle(x_ticks, redundancy_counts, size=1, color="navy", alpha=0.5)
+    p.circle('x', 'count', source=source, size=1, color="navy", alpha=0.5)
 
     # x axis label
     p.xaxis.axis_label = 'IPv4 Routes'
@@ -32,18 +49,30 @@ def graph_bgp(label_dict, redundancy_counts, x_ticks):
     p.yaxis.axis_label = 'AVAILABLE REDUNDANT PATHS'
 
     # this allows us to replace our x_ticks with real labels - ip routes
-    p.xaxis.formatter = FuncTickFormatter(code="""
-        var labels = %s;
-        return labels[tick];
-        """ % label_dict)
+    # the labels are built from the data source instead of being written
+    # into the javascript code as one big dictionary
+    p.xaxis.formatter = FuncTickFormatter(args={'source': source}, code="""
+        var network = source.data['network'][tick];
+        if (network === undefined) {
+            return '';
+        }
+        return [network >>> 24, (network >>> 16) & 255,
+                (network >>> 8) & 255, network & 255].join('.') +
+               '/' + source.data['length'][tick];
+        """)
 
     # displays graph on default browser
     show(p)
 
 def load_bgp_database(filename):
     """ load bgp database
-    we load our existing bgp information from the yaml file generated from
-    our first script here in order to graph that information """
+    we load our existing bgp information from the binary store file
+    generated from our first script here in order to graph that information.
+    the store file is memory mapped, yaml files are still supported """
+
+    # binary store file, memory mapped and ready to go
+    if not filename.endswith(('.yml', '.yaml')):
+        return BGPRedundancyStore.load(filename)
 
     # initialize our bgp db
     bgp_db = {}
@@ -53,115 +82,239 @@ def load_bgp_database(filename):
         yaml=YAML()
         bgp_db = yaml.load(fn)
 
-    return bgp_db
-
-def return_full_bgp_db(bgp_db):
-    """ return full bgp db
-    parses through the bgp db and returns the three parameters required
-    to graph the dataset, unfiltered and unsampled. using this function
-    is not recommended and will cause the script to take forever to finish
-    running """
-
-    # we need to be able to sort our ip routes properly
-    # there is an issue with sorting normally, for example 10.0.0.9 is treated
-    # to be greater than 10.0.0.255
-    # thankfully, python does allow us to perform custom sorts and the socket
-    # library has a wonderful built in sorter for ip addresses. it does not work
-    # with subnets (/20, etc) so we need to remove that before sorting
-
-    sorted_bgp_db = sorted(
-        bgp_db.items(),
-        key=lambda item: socket.inet_aton(item[0].split('/')[0]),
-        )
-
-    # initialize our datastructures
-    ip_routes = []
-    redundancy_counts = []
-    x_ticks = []
-    label_dict = {}
-
-    # iterate through the sorted bgp db, and store our routes and redundancy
-    # counts as a list
-    for ip_route, redundancy_count in sorted_bgp_db:
-        ip_routes.append(ip_route)
-        redundancy_counts.append(redundancy_count)
-
-    # iterate through the ip routes list, and store it as a dictionary with a
-    # specific numerical value for graphing and labeling purposes
-    for i, s in enumerate(ip_routes):
-        # required to label the x axis with the routes
-        label_dict[i] = s
+    # pack it into the compact store, which also sorts it by ip address
+    return BGPRedundancyStore.from_bgp_db(bgp_db)
 
-        # used to map the x axis with numerical increments 1, 2, 3...
-        # this is then replaced with the label information as stored above
-        # required as we cannot do custom labels of the x-axis by default
-        x_ticks.append(i)
+def return_bgp_routes(bgp_db, indexes):
+    """ return bgp routes
+    returns the three parameters required to graph the routes found at the
+    given positions of the bgp db, as packed numpy arrays """
 
-    return label_dict, redundancy_counts, x_ticks
-
-def return_sampled_bgp_db(bgp_db):
-    """ return sampled bgp db
-    parses through the bgp db and returns the three parameters required
-    to graph the dataset, filtered and sampled. """
-
-    # we need to be able to sort our ip routes properly
-    # there is an issue with sorting normally, for example 10.0.0.9 is treated
-    # to be greater than 10.0.0.255
-    # thankfully, python does allow us to perform custom sorts and the socket
-    # library has a wonderful built in sorter for ip addresses. it does not work
-    # with subnets (/20, etc) so we need to remove that before sorting
-
-    sorted_bgp_db = sorted(
-        bgp_db.items(),
-        key=lambda item: socket.inet_aton(item[0].split('/')[0]),
+    # the store already keeps our ip routes sorted properly by ip address,
+    # for example 10.0.0.9 comes before 10.0.0.255, so there is nothing
+    # left to sort here
+    route_labels = (
+        np.asarray(bgp_db.networks, dtype=np.uint32)[indexes],
+        np.asarray(bgp_db.lengths, dtype=np.uint8)[indexes],
         )
+    redundancy_counts = np.asarray(bgp_db.counts, dtype=np.uint32)[indexes]
 
-    # initialize our datastructures
-    ip_routes = []
-    redundancy_counts = []
-    x_ticks = []
-    label_dict = {}
-
-    # sample counter
-    sample_count = 0
-
-    # iterate through the sorted bgp db, and store our routes and redundancy
-    # counts as a list
-    for ip_route, redundancy_count in sorted_bgp_db:
-        # every 10th entry will be stored, making the dataset 10x smaller
-        if sample_count % 10 == 0:
-            ip_routes.append(ip_route)
-            redundancy_counts.append(redundancy_count)
-
-        # increment sample counter
-        sample_count += 1
+    # used to map the x axis with numerical increments 1, 2, 3...
+    # this is then replaced with the route labels as stored above
+    # required as we cannot do custom labels of the x-axis by default
+    x_ticks = np.arange(len(indexes), dtype=np.int32)
 
-    # iterate through the ip routes list, and store it as a dictionary with a
-    # specific numerical value for graphing and labeling purposes
-    for i, s in enumerate(ip_routes):
-        # required to label the x axis with the routes
-        label_dict[i] = s
-
-        # used to map the x axis with numerical increments 1, 2, 3...
-        # this is then replaced with the label information as stored above
-        # required as we cannot do custom labels of the x-axis by default
-        x_ticks.append(i)
-
-    return label_dict, redundancy_counts, x_ticks
+    return route_labels, redundancy_counts, x_ticks
 
+def return_full_bgp_db(bgp_db):
+    """ return full bgp db
+    returns the three parameters required to graph the dataset, unfiltered
+    and unsampled. using this function is not recommended, the browser will
+    struggle with a full table """
+
+    return return_bgp_routes(bgp_db, np.arange(len(bgp_db)))
+
+def downsample_min_max(values, target_points=4000):
+    """ downsample min max
+    picks the points to keep out of values, so that the graph still looks
+    the same. values are split into target_points / 2 equal buckets and the
+    lowest and highest point of every bucket are kept, in their original
+    order, so every spike and dip survives no matter how narrow it is.
+    fully vectorized, a full table takes a few milliseconds. it takes at
+    least 2 points to keep both the lowest and the highest value
+
+    output -> indexes = numpy array of the positions to keep
+    """
+
+    if target_points < 2:
+        raise ValueError('target_points must be at least 2, got ' + str(target_points))
+
+    values = np.asarray(values, dtype=np.int64)
+    size = len(values)
+
+    # small enough already
+    if size <= target_points:
+        return np.arange(size)
+
+    # start of every bucket
+    buckets = target_points // 2
+    starts = np.linspace(0, size, buckets, endpoint=False).astype(np.int64)
+
+    # pack value and position into a single key, so that one reduction per
+    # bucket finds both the extreme value and where it is
+    positions = np.arange(size, dtype=np.int64)
+    lowest = np.minimum.reduceat(values * size + positions, starts) % size
+    highest = size - 1 - np.maximum.reduceat(
+        values * size + (size - 1 - positions), starts,
+        ) % size
+
+    # a bucket with a flat line has the same point as its lowest and highest
+    return np.unique(np.concatenate((lowest, highest)))
+
+def return_sampled_bgp_db(bgp_db, target_points=4000):
+    """ return sampled bgp db
+    returns the three parameters required to graph the dataset, downsampled
+    to about target_points points with the redundancy spikes and dips kept
+    intact. """
+
+    # the counts are used as they are, no copy
+    return return_bgp_routes(bgp_db, downsample_min_max(bgp_db.counts, target_points))
+
+
+class BGPRedundancyPyramid:
+    """ bgp redundancy pyramid
+    the redundancy counts at every zoom level, precomputed once. level 0 is
+    every route on its own, and every level above halves the one below it,
+    keeping the min, max and sum of the two buckets it merges. any part of
+    the table can then be graphed with a bounded number of buckets by
+    picking the right level, about twice the size of the counts in total """
+
+    def __init__(self, bgp_db):
+        self.networks = np.asarray(bgp_db.networks, dtype=np.uint32)
+        self.lengths = np.asarray(bgp_db.lengths, dtype=np.uint8)
+
+        counts = np.asarray(bgp_db.counts, dtype=np.uint32)
+
+        # [(mins, maxs, sums, sizes), ...] from level 0 upwards
+        self.levels = [(counts, counts, counts.astype(np.uint64),
+                        np.ones(len(counts), dtype=np.uint32))]
+
+        while len(self.levels[-1][0]) > 1:
+            mins, maxs, sums, sizes = self.levels[-1]
+
+            # odd bucket out, pair it up with an empty bucket
+            if len(mins) % 2:
+                mins = np.append(mins, np.iinfo(np.uint32).max)
+                maxs = np.append(maxs, 0)
+                sums = np.append(sums, 0)
+                sizes = np.append(sizes, 0)
+
+            self.levels.append((
+                mins.reshape(-1, 2).min(axis=1),
+                maxs.reshape(-1, 2).max(axis=1),
+                sums.reshape(-1, 2).sum(axis=1),
+                sizes.reshape(-1, 2).sum(axis=1),
+                ))
+
+    def __len__(self):
+        return len(self.networks)
+
+    def window(self, start, end, max_points=2000):
+        """ window
+        the buckets covering routes start to end, from the lowest level that
+        needs no more than max_points buckets, give or take the two partial
+        buckets at the edges. every bucket is labeled with its first route
+
+        output -> {'x' : [...], 'min' : [...], 'max' : [...], 'mean' : [...],
+                   'network' : [...], 'length' : [...]}
+        """
+
+        start = min(max(int(start), 0), len(self))
+        end = min(max(int(np.ceil(end)), start + 1), len(self))
+
+        # each level up halves the number of buckets
+        level = 0
+        while (end - start) >> level > max_points:
+            level += 1
+
+        mins, maxs, sums, sizes = self.levels[level]
+
+        first = start >> level
+        last = ((end - 1) >> level) + 1
+
+        # position of the first route of every bucket
+        x = np.arange(first, last, dtype=np.int64) << level
+
+        return {
+            'x': x,
+            'min': mins[first:last],
+            'max': maxs[first:last],
+            'mean': sums[first:last] / np.maximum(sizes[first:last], 1),
+            'network': self.networks[x],
+            'length': self.lengths[x],
+            }
+
+def graph_bgp_server(bgp_db, max_points=2000, port=5006):
+    """ graph bgp server
+    graphs the whole table on a local bokeh server. every pan and zoom asks
+    the server for the buckets of the visible routes only, so the browser
+    never holds more than max_points of them, from the whole ipv4 space
+    down to the individual routes """
+
+    pyramid = BGPRedundancyPyramid(bgp_db)
+
+    def make_document(doc):
+        source = ColumnDataSource(data=pyramid.window(0, len(pyramid), max_points))
+
+        # define the figure initial parameters, same as the static graph
+        p = figure(
+            title="INTERNET'S REDUNDANCY", # title
+            toolbar_location="above",  # toolbar location
+            sizing_mode='stretch_both',  # sizing parameters of the graph
+            output_backend="webgl", # allows us to utilize webgl to reduce load
+            x_range=Range1d(0, len(pyramid), bounds=(0, len(pyramid))),
+            )
+
+        # lowest to highest redundancy within every bucket, and its mean
+        p.segment('x', 'min', 'x', 'max', source=source, color="navy", alpha=0.3)
+        p.circle('x', 'mean', source=source, size=2, color="navy", alpha=0.5)
+
+        # x axis label
+        p.xaxis.axis_label = 'IPv4 Routes'
+
+        # y axis label
+        p.yaxis.axis_label = 'AVAILABLE REDUNDANT PATHS'
+
+        # the ticks fall anywhere between the buckets, so each tick is
+        # labeled with the closest bucket at or before it
+        p.xaxis.formatter = FuncTickFormatter(args={'source': source}, code="""
+            var x = source.data['x'];
+            var low = 0;
+            var high = x.length;
+            while (low < high) {
+                var middle = (low + high) >> 1;
+                if (x[middle] <= tick) {
+                    low = middle + 1;
+                } else {
+                    high = middle;
+                }
+            }
+            if (low == 0) {
+                return '';
+            }
+            var network = source.data['network'][low - 1];
+            return [network >>> 24, (network >>> 16) & 255,
+                    (network >>> 8) & 255, network & 255].join('.') +
+                   '/' + source.data['length'][low - 1];
+            """)
+
+        # swap in the buckets of the visible routes after every pan and zoom
+        def update(event):
+            source.data = pyramid.window(event.x0, event.x1, max_points)
+
+        p.on_event(RangesUpdate, update)
+
+        doc.add_root(p)
+
+    # serve the graph and open it on default browser
+    server = Server({'/': make_document}, port=port)
+    server.start()
+    server.io_loop.add_callback(server.show, '/')
+    server.io_loop.start()
 
 def main():
     # load bgp database
-    bgp_db = load_bgp_database('fullbgpredundancy.yml')
+    bgp_db = load_bgp_database('fullbgpredundancy.bgpdb')
 
     # run full and unfiltered sampling, not recommended!
-    #label_dict, redundancy_counts, x_ticks = return_full_bgp_db(bgp_db)
+    #route_labels, redundancy_counts, x_ticks = return_full_bgp_db(bgp_db)
 
-    # run sampled bgp database
-    label_dict, redundancy_counts, x_ticks = return_sampled_bgp_db(bgp_db)
+    # run sampled bgp database, as a static html page
+    #route_labels, redundancy_counts, x_ticks = return_sampled_bgp_db(bgp_db)
+    #graph_bgp(route_labels, redundancy_counts, x_ticks)
 
-    # graph the information generated
-    graph_bgp(label_dict, redundancy_counts, x_ticks)
+    # graph the full table with zoom on a local bokeh server
+    graph_bgp_server(bgp_db)
 
 if __name__ == '__main__':
     main()
@@ -1,7 +1,104 @@
-import ipaddress
+import hashlib
+import mmap
+import multiprocessing
+import os
 import re
+import struct
+from contextlib import contextmanager
 from ruamel.yaml import YAML
-
+from bgpstore import BGPRedundancyStore, parse_prefix, format_prefix
+
+
+# size of the windows the fast parse engine scans the file in
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# precompiled pattern used by the fast parse engine, anchored on the prefix
+# and next hop columns at the start of every route line
+# " 1.0.4.0/22 94.156.252.18 34224 ..." <- prefix and next hop
+# "*                   105.16.0.247 ..." <- next hop only, cisco continuation
+# "*> 100.100.100.0/24" <- prefix only, cisco wraps long prefixes
+BGP_ROUTE_LINE = re.compile(
+    rb'^[^\d\n]*'
+    rb'(?:'
+    rb'(?:(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(?:/\d{1,2})?)[ \t]+)?'
+    rb'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})(?![\d./])'
+    rb'|'
+    rb'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}/\d{1,2})[ \t]*\r?$'
+    rb')',
+    re.MULTILINE,
+    )
+
+# same as above, but also keeps the rest of the line after the next hop,
+# which holds the as path
+BGP_ROUTE_PATH_LINE = re.compile(
+    rb'^[^\d\n]*'
+    rb'(?:'
+    rb'(?:(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(?:/\d{1,2})?)[ \t]+)?'
+    rb'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})(?![\d./])([^\n]*)'
+    rb'|'
+    rb'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}/\d{1,2})[ \t]*\r?$'
+    rb')',
+    re.MULTILINE,
+    )
+
+# cisco header line, the as path starts below the 'Path' column
+# "     Network          Next Hop            Metric LocPrf Weight Path"
+BGP_HEADER_LINE = re.compile(rb'^([^\n]*Next Hop[^\n]*?)Path', re.MULTILINE)
+
+# same as above, but only for the lines that start a new prefix
+BGP_PREFIX_LINE = re.compile(
+    rb'^[^\d\n]*'
+    rb'(?:'
+    rb'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(?:/\d{1,2})?)[ \t]+'
+    rb'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(?![\d./])'
+    rb'|'
+    rb'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}/\d{1,2})[ \t]*\r?$'
+    rb')',
+    re.MULTILINE,
+    )
+
+# gap between two fields of a route line
+WHITESPACE = re.compile(rb'[ \t]')
+
+# shape of an address or prefix token used by the line parse engines, the
+# octet and prefix length ranges are checked separately on the numbers
+IPV4_TOKEN = re.compile(r'(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})(?:/(\d{1,2}))?')
+
+# any character except digits, '.' and '/'
+SPECIAL_CHARACTERS = re.compile(r'[^\d./]+')
+
+
+def parse_ipv4_token(word):
+    """ parse ipv4 token
+    recognizes an address or prefix such as '1.0.4.0/22' or '10.0.0.1' in
+    one go and packs it. a regex checks the shape first, which throws out
+    the as numbers and other words right away, and only then are the
+    numbers checked to be in range. an address without a prefix length is
+    a /32
+
+    output -> (network, length) = (16778240, 22) or None if not an address
+    """
+
+    # most words are as numbers, without a single dot
+    if '.' not in word:
+        return None
+
+    match = IPV4_TOKEN.fullmatch(word)
+    if match is None:
+        return None
+
+    first, second, third, fourth, length = match.groups()
+
+    first = int(first)
+    second = int(second)
+    third = int(third)
+    fourth = int(fourth)
+    length = 32 if length is None else int(length)
+
+    if first > 255 or second > 255 or third > 255 or fourth > 255 or length > 32:
+        return None
+
+    return (first << 24) | (second << 16) | (third << 8) | fourth, length
 
 def strict_parse(line):
     """ strict parse
@@ -12,43 +109,40 @@ def strict_parse(line):
     # store all valid addresses in list
     valid_addresses = []
 
+    words = line.split()
+
+    # empty lines have nothing to offer
+    if len(words) < 2:
+        return valid_addresses
+
     # assume the ipaddress is the first word in the output!
-    route_address = line.split()[0]
+    route_address = words[0]
 
     # remove ">" if it exists in a strict manner
     if route_address.startswith('>'):
         route_address = route_address.strip('>')
 
-    # store address in valid addresses
-    valid_addresses.append(route_address)
-
     # assume the next hop address is second word
-    next_hop_address = line.split()[1]
+    next_hop_address = words[1]
 
-    # store address in valid addresses
-    valid_addresses.append(next_hop_address)
+    # store both only if they really are addresses, which skips the headers
+    if parse_ipv4_token(route_address) and parse_ipv4_token(next_hop_address):
+        valid_addresses.append(route_address)
+        valid_addresses.append(next_hop_address)
 
     return valid_addresses
 
 def check_if_ipv4address(potential_address):
     """ check if ipv4address
-    this is used in conjunction with the flexible parse function
-    and determines if the word is an ipaddress in a smart way """
+    determines if the word is an ipaddress or prefix in a smart way """
 
-    try:
-        ipaddress.IPv4Interface(potential_address)
-        return True
-    except ipaddress.AddressValueError:
-        return False
+    return parse_ipv4_token(potential_address) is not None
 
 def flexible_parse(line):
     """ flexible parse
     function that will take the data from the bgp table and determine
     validity by checking the address if it is a valid ip address! """
 
-    # regex compile removals of any character (except '.' and '/')
-    remove_special_char = re.compile(r'[^\d./]+')
-
     # store all valid addresses in list
     valid_addresses = []
 
@@ -59,18 +153,536 @@ def flexible_parse(line):
 
     for word in line.split():
         # strip any symbols from output except '.'
-        word = remove_special_char.sub('', word)
+        word = SPECIAL_CHARACTERS.sub('', word)
 
         # check if our word is a valid address!
-        if check_if_ipv4address(word):
+        if parse_ipv4_token(word):
             valid_addresses.append(word)
 
 
     return valid_addresses
 
-def bgp_parse_logic(filename):
-    """ bgp parse logic
-    parse function to run in this example exercise """
+@contextmanager
+def mapped_file(filename):
+    """ mapped file
+    memory maps the file read-only so that it can be scanned as bytes
+    straight from the page cache, without reading it into memory or
+    decoding it. resident memory stays small no matter the file size """
+
+    with open(filename, 'rb') as fn:
+        # an empty file cannot be mapped, and has nothing to parse anyway
+        if os.fstat(fn.fileno()).st_size == 0:
+            yield b''
+            return
+
+        data = mmap.mmap(fn.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # let the kernel know we only go forward, so it can read ahead
+        # and drop the pages we are done with
+        if hasattr(data, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            data.madvise(mmap.MADV_SEQUENTIAL)
+
+        try:
+            yield data
+        finally:
+            data.close()
+
+def iterate_windows(data, start, end, window_size=CHUNK_SIZE):
+    """ iterate windows
+    splits the start to end byte range into windows that always end on a
+    line boundary, so that no line is ever split between two windows
+
+    output -> (window_start, window_end), ...
+    """
+
+    while start < end:
+        window_end = min(start + window_size, end)
+
+        # cut right after the last complete line of the window
+        if window_end < end:
+            cut = data.rfind(b'\n', start, window_end)
+
+            # a single line longer than the window, take all of it
+            if cut == -1:
+                cut = data.find(b'\n', window_end, end)
+
+            if cut != -1:
+                window_end = cut + 1
+            else:
+                window_end = end
+
+        yield start, window_end
+
+        start = window_end
+
+def fast_parse_chunk(chunk, bgp_db, route_address=b'', start=0, end=None):
+    """ fast parse chunk
+    runs the precompiled route line pattern over an entire chunk at once and
+    counts the paths of every prefix. no ipaddress objects are built here,
+    the pattern only accepts address shaped words in the right columns and
+    only those words are copied out of the chunk, never the whole line.
+    the chunk can be a window of a memory mapped file given by start and end.
+    the route address is returned so that the next chunk can carry on
+    with cisco continuation lines """
+
+    get = bgp_db.get
+
+    if end is None:
+        end = len(chunk)
+
+    for prefix, next_hop, wrapped_prefix in BGP_ROUTE_LINE.findall(chunk, start, end):
+        # cisco wrapped a long prefix, the next hop is on the next line
+        if wrapped_prefix:
+            route_address = wrapped_prefix
+            continue
+
+        # new prefix, otherwise a continuation line of the previous one
+        if prefix:
+            route_address = prefix
+
+        # nothing to count until the first prefix has been seen
+        if route_address:
+            bgp_db[route_address] = get(route_address, 0) + 1
+
+    return route_address
+
+def find_path_column(data, end=65536):
+    """ find path column
+    column the as path starts at, taken from the cisco header line near
+    the top of the table. None for tables without a header, where the
+    whole rest of the line after the next hop is the as path """
+
+    match = BGP_HEADER_LINE.search(data, 0, min(end, len(data)))
+
+    if match is None:
+        return None
+
+    return len(match.group(1))
+
+def fast_parse_chunk_paths(chunk, bgp_db, path_table, route_address=b'',
+                           start=0, end=None, path_column=None):
+    """ fast parse chunk paths
+    same as fast parse chunk, but also hands the as path of every route
+    over to the path table. cisco puts the metric, local preference and
+    weight between the next hop and the as path, so on a cisco table the
+    as path is cut out at the column of the 'Path' header """
+
+    get = bgp_db.get
+    add_route = path_table.add_route
+
+    if end is None:
+        end = len(chunk)
+
+    for match in BGP_ROUTE_PATH_LINE.finditer(chunk, start, end):
+        prefix, next_hop, path, wrapped_prefix = match.groups()
+
+        # cisco wrapped a long prefix, the next hop is on the next line
+        if wrapped_prefix:
+            route_address = wrapped_prefix
+            continue
+
+        # new prefix, otherwise a continuation line of the previous one
+        if prefix:
+            route_address = prefix
+
+        # nothing to count until the first prefix has been seen
+        if not route_address:
+            continue
+
+        bgp_db[route_address] = get(route_address, 0) + 1
+
+        # skip whatever comes before the as path column, a field that is
+        # wider than its column pushes the rest of the line to the right,
+        # so the cut moves on to the next whitespace instead of splitting
+        # a number in half
+        if path_column is not None:
+            cut = max(match.start() + path_column - match.start(3), 0)
+
+            if 0 < cut < len(path) and path[cut - 1] not in b' \t':
+                boundary = WHITESPACE.search(path, cut)
+                cut = boundary.start() if boundary is not None else len(path)
+
+            path = path[cut:]
+
+        add_route(route_address, path)
+
+    return route_address
+
+def fast_bgp_parse(filename, path_table=None):
+    """ fast bgp parse
+    fast parse engine, scans the memory mapped file as bytes one large
+    window at a time and only decodes the prefixes once at the very end.
+    the as paths are interned into path_table as well if one is given """
+
+    # initialize final reliability datastructure, keyed by bytes for now
+    bgp_db = {}
+
+    # route address carried over between windows
+    route_address = b''
+
+    with mapped_file(filename) as data:
+        path_column = find_path_column(data)
+
+        for start, end in iterate_windows(data, 0, len(data)):
+            if path_table is None:
+                route_address = fast_parse_chunk(
+                    data, bgp_db, route_address, start, end,
+                    )
+            else:
+                route_address = fast_parse_chunk_paths(
+                    data, bgp_db, path_table, route_address, start, end,
+                    path_column,
+                    )
+
+    return {
+        route_address.decode('ascii'): count
+        for route_address, count in bgp_db.items()
+    }
+
+def find_shard_boundaries(filename, shards):
+    """ find shard boundaries
+    splits the file into byte ranges of roughly equal size. every range is
+    moved forward to the start of a line with a prefix on it, so that cisco
+    continuation lines, which rely on the previous prefix, always stay in
+    the same range as their prefix
+
+    output -> boundaries = [0, offset1, offset2, ..., file size]
+    """
+
+    size = os.path.getsize(filename)
+
+    boundaries = [0]
+
+    with open(filename, 'rb') as fn:
+        for shard in range(1, shards):
+            # skip the rest of the line we landed in
+            fn.seek(max(size * shard // shards, boundaries[-1]))
+            fn.readline()
+
+            # skip forward until a line that starts a new prefix
+            while True:
+                position = fn.tell()
+                line = fn.readline()
+
+                # reached the end of the file
+                if not line:
+                    break
+
+                match = BGP_ROUTE_LINE.match(line)
+                if match and (match.group(1) or match.group(3)):
+                    break
+
+            boundaries.append(position)
+
+    boundaries.append(size)
+
+    return boundaries
+
+def parse_shard(shard):
+    """ parse shard
+    parses a single byte range of the file, run inside a worker process
+
+    input -> shard = (filename, start offset, end offset)
+    output -> partial_bgp_db = {prefix1 : count1, prefix2 : count2, ...}
+    """
+
+    filename, start, end = shard
+
+    # partial reliability datastructure of this range only
+    partial_bgp_db = {}
+
+    # every range starts on a prefix line, nothing to carry over
+    route_address = b''
+
+    with mapped_file(filename) as data:
+        for window_start, window_end in iterate_windows(data, start, end):
+            route_address = fast_parse_chunk(
+                data, partial_bgp_db, route_address, window_start, window_end,
+                )
+
+    return partial_bgp_db
+
+def parallel_bgp_parse(filename, processes=None):
+    """ parallel bgp parse
+    fast parse engine spread over several processes. the file is split in
+    one byte range per process, every range is parsed on its own and the
+    partial counts are merged back in file order, which gives the exact same
+    result as the serial fast parse engine """
+
+    # one range per core by default
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    boundaries = find_shard_boundaries(filename, processes)
+
+    shards = [
+        (filename, start, end)
+        for start, end in zip(boundaries, boundaries[1:])
+        if end > start
+    ]
+
+    # parse every range in its own process
+    with multiprocessing.Pool(processes) as pool:
+        partial_bgp_dbs = pool.map(parse_shard, shards)
+
+    # merge the partial counts, in file order to keep the prefix order
+    bgp_db = {}
+    get = bgp_db.get
+
+    for partial_bgp_db in partial_bgp_dbs:
+        for route_address, count in partial_bgp_db.items():
+            bgp_db[route_address] = get(route_address, 0) + count
+
+    return {
+        route_address.decode('ascii'): count
+        for route_address, count in bgp_db.items()
+    }
+
+def next_prefix_line(data, offset, end):
+    """ next prefix line
+    finds the first line at or after offset that starts a new prefix
+
+    output -> (line offset, network) or (end, None) if there is none
+    """
+
+    # move to the start of the next line unless already there
+    if offset > 0 and data[offset - 1:offset] != b'\n':
+        newline = data.find(b'\n', offset, end)
+        offset = end if newline == -1 else newline + 1
+
+    while True:
+        match = BGP_PREFIX_LINE.search(data, offset, end)
+
+        if match is None:
+            return end, None
+
+        # a prefix out of range is no route, carry on with the next line
+        try:
+            return match.start(), parse_prefix(match.group(1) or match.group(2))[0]
+        except ValueError:
+            offset = match.end()
+
+def find_block_boundaries(data, block_bits):
+    """ find block boundaries
+    splits a prefix sorted table into one byte range per block of the ipv4
+    space, for example every /12 with block_bits = 12. the start of each
+    block is found with a binary search over the file, narrowed down block
+    by block, so only a handful of lines are looked at. since the blocks
+    follow the prefixes and not the byte offsets, a change in one block
+    never moves the others
+
+    output -> boundaries = [0, block 1 offset, ..., file size]
+    """
+
+    blocks = 1 << block_bits
+
+    boundaries = [0] * (blocks + 1)
+    boundaries[blocks] = len(data)
+
+    # boundaries of the blocks between first_block and last_block, which
+    # both already have theirs, lo and hi
+    def split(first_block, last_block, lo, hi):
+        if last_block - first_block < 2:
+            return
+
+        middle_block = (first_block + last_block) // 2
+
+        # nothing in between, every block in the middle is empty
+        if lo == hi:
+            for block in range(first_block + 1, last_block):
+                boundaries[block] = lo
+            return
+
+        first_network = middle_block << (32 - block_bits)
+
+        # first prefix line with a network inside the middle block or later
+        low, high = lo, hi
+        while low < high:
+            middle = (low + high) // 2
+            line_offset, network = next_prefix_line(data, middle, hi)
+            if network is not None and network < first_network:
+                low = line_offset + 1
+            else:
+                high = middle
+
+        boundary = next_prefix_line(data, low, hi)[0]
+        boundaries[middle_block] = boundary
+
+        split(first_block, middle_block, lo, boundary)
+        split(middle_block, last_block, boundary, hi)
+
+    split(0, blocks, 0, len(data))
+
+    return boundaries
+
+# checkpoint file of the incremental parse
+# header -> magic 'BGPC', uint16 version, uint16 block bits,
+#           16 byte blake2b digest of the store file it belongs to
+# digests -> one 16 byte blake2b digest per block
+CHECKPOINT_MAGIC = b'BGPC'
+CHECKPOINT_VERSION = 1
+CHECKPOINT_DIGEST_SIZE = 16
+CHECKPOINT_HEADER = struct.Struct('<4sHH16s')
+
+def file_digest(filename):
+    """ file digest
+    blake2b digest of an entire file """
+
+    with mapped_file(filename) as data:
+        return hashlib.blake2b(data, digest_size=CHECKPOINT_DIGEST_SIZE).digest()
+
+def load_checkpoint(checkpoint_filename, store_filename, block_bits):
+    """ load checkpoint
+    block digests of the previous run, or None if there is no usable one """
+
+    if not os.path.exists(checkpoint_filename):
+        return None
+
+    with open(checkpoint_filename, 'rb') as fn:
+        data = fn.read()
+
+    magic, version, checkpoint_block_bits, store_digest = \
+        CHECKPOINT_HEADER.unpack_from(data)
+
+    # an old or different checkpoint is as good as none
+    if magic != CHECKPOINT_MAGIC or version != CHECKPOINT_VERSION or \
+            checkpoint_block_bits != block_bits:
+        return None
+
+    # the store was rewritten since, for example by a full parse
+    if store_digest != file_digest(store_filename):
+        return None
+
+    digests = data[CHECKPOINT_HEADER.size:]
+
+    return [
+        digests[i:i + CHECKPOINT_DIGEST_SIZE]
+        for i in range(0, len(digests), CHECKPOINT_DIGEST_SIZE)
+    ]
+
+def save_checkpoint(checkpoint_filename, store_filename, block_bits, digests):
+    """ save checkpoint
+    writes the block digests of this run for the next one """
+
+    with open(checkpoint_filename, 'wb') as fn:
+        fn.write(CHECKPOINT_HEADER.pack(
+            CHECKPOINT_MAGIC, CHECKPOINT_VERSION, block_bits,
+            file_digest(store_filename),
+            ))
+        fn.write(b''.join(digests))
+
+def incremental_bgp_parse(filename, store_filename='fullbgpredundancy.bgpdb',
+                          block_bits=12):
+    """ incremental bgp parse
+    re-parses only the parts of the table that changed since the last run.
+    the table, which 'show ip bgp' prints sorted by prefix, is split into
+    blocks of the ipv4 space and every block is hashed. blocks with the same
+    hash as last time take their counts straight from the previous store,
+    the others are parsed again and compared with the previous counts.
+    the cost is a hash over the file plus parsing the churned blocks only
+
+    output -> bgp_store, delta = {'added' : {prefix : count},
+                                  'withdrawn' : [prefix, ...],
+                                  'changed' : {prefix : [old count, new count]}}
+    delta is None when there is no previous state to compare against
+    """
+
+    checkpoint_filename = store_filename + '.checkpoint'
+
+    # previous state, an empty store if there is none
+    previous_digests = None
+    previous_store = BGPRedundancyStore()
+
+    if os.path.exists(store_filename):
+        previous_digests = load_checkpoint(
+            checkpoint_filename, store_filename, block_bits,
+            )
+        previous_store = BGPRedundancyStore.load(store_filename)
+
+    delta = {'added': {}, 'withdrawn': [], 'changed': {}}
+
+    # pieces of the new store, in ip address order
+    parts = []
+    digests = []
+
+    with mapped_file(filename) as data:
+        boundaries = find_block_boundaries(data, block_bits)
+
+        for block, (start, end) in enumerate(zip(boundaries, boundaries[1:])):
+            first_network = block << (32 - block_bits)
+            last_network = first_network + (1 << (32 - block_bits)) - 1
+
+            digest = hashlib.blake2b(
+                memoryview(data)[start:end], digest_size=CHECKPOINT_DIGEST_SIZE,
+                ).digest()
+            digests.append(digest)
+
+            # where this block sits within the previous store
+            previous_start, previous_end = previous_store.index_range(
+                first_network, last_network,
+                )
+
+            # unchanged block, reuse the previous counts as they are
+            if previous_digests is not None and previous_digests[block] == digest:
+                parts.append((previous_store, previous_start, previous_end))
+                continue
+
+            # changed block, parse it again
+            block_db = {}
+            route_address = b''
+            for window_start, window_end in iterate_windows(data, start, end):
+                route_address = fast_parse_chunk(
+                    data, block_db, route_address, window_start, window_end,
+                    )
+
+            block_store = BGPRedundancyStore.from_bgp_db(block_db)
+
+            # the blocks rely on the table being sorted by prefix
+            if len(block_store) and (
+                    block_store.networks[0] < first_network or
+                    block_store.networks[-1] > last_network):
+                raise ValueError(
+                    filename + ' is not sorted by prefix, '
+                    'use the full parse instead of the incremental parse'
+                    )
+
+            parts.append((block_store, 0, len(block_store)))
+
+            # compare the new counts of this block against the previous ones
+            previous_block = dict(
+                (format_prefix(network, length), count)
+                for network, length, count in zip(
+                    previous_store.networks[previous_start:previous_end],
+                    previous_store.lengths[previous_start:previous_end],
+                    previous_store.counts[previous_start:previous_end],
+                    )
+                )
+
+            for prefix, count in block_store.items():
+                previous_count = previous_block.pop(prefix, None)
+                if previous_count is None:
+                    delta['added'][prefix] = count
+                elif previous_count != count:
+                    delta['changed'][prefix] = [previous_count, count]
+
+            delta['withdrawn'].extend(previous_block)
+
+    bgp_store = BGPRedundancyStore.concatenate(parts)
+
+    # nothing to compare against on the very first run
+    if previous_digests is None:
+        delta = None
+
+    # the checkpoint always goes together with the store it describes
+    save_bgp_database(bgp_store, store_filename)
+    save_checkpoint(checkpoint_filename, store_filename, block_bits, digests)
+
+    return bgp_store, delta
+
+def line_bgp_parse(filename, parse_function=flexible_parse):
+    """ line bgp parse
+    original parse engine, goes through the file line by line with either
+    the flexible or the strict parse function """
 
     # initialize final reliability datastructure
     bgp_db = {}
@@ -83,9 +695,7 @@ def bgp_parse_logic(filename):
         # iterate through the file
         for line in fn:
             # store valid addresses
-            valid_addresses = flexible_parse(line)
-            print(valid_addresses)
-            #valid_addresses = strict_parse(line)
+            valid_addresses = parse_function(line)
 
             # check number of valid addresses is 2
             if len(valid_addresses) == 2:
@@ -104,7 +714,7 @@ def bgp_parse_logic(filename):
             # this should only be invoked with a different format of
             # 'show ip bgp' - aka CISCO DEVICES
             # this will also break strict parsing FYI
-            elif len(valid_addresses) == 1:
+            elif len(valid_addresses) == 1 and route_address:
                 # initialize valid addresses
                 next_hop_address = valid_addresses[0]
 
@@ -115,12 +725,101 @@ def bgp_parse_logic(filename):
                 # increment redundancy count
                 bgp_db[route_address] += 1
 
+    return bgp_db
 
-    # save our data as a yaml file to be reused for graping purposes!
-    with open('fullbgpredundancy.yml', 'w') as fn:
+def save_bgp_database(bgp_store, filename='fullbgpredundancy.bgpdb'):
+    """ save bgp database
+    save our data as a binary store file to be reused for graping purposes!
+    it is memory mapped by the graphing script, so it loads instantly """
+
+    bgp_store.save(filename)
+
+def export_bgp_database(bgp_store, filename='fullbgpredundancy.yml'):
+    """ export bgp database
+    export our data as a yaml file, human readable but very slow to load
+    back for a full table """
+
+    with open(filename, 'w') as fn:
+        yaml=YAML()
+        yaml.default_flow_style = False
+        yaml.dump(bgp_store.to_dict(), fn)
+
+def export_bgp_delta(delta, filename='fullbgpredundancy.delta.yml'):
+    """ export bgp delta
+    export the changes since the previous run as a yaml file """
+
+    with open(filename, 'w') as fn:
         yaml=YAML()
         yaml.default_flow_style = False
-        yaml.dump(bgp_db, fn)
+        yaml.dump(delta, fn)
+
+def save_bgp_paths(path_table, filename='fullbgpredundancy.bgppaths'):
+    """ save bgp paths
+    save the interned as paths as a binary file, lined up with the store """
+
+    path_table.save(filename)
+
+def bgp_parse_logic(filename, parse_mode='fast', processes=1, export_yaml=False,
+                    collect_paths=False):
+    """ bgp parse logic
+    parse function to run in this example exercise
+    parse_mode is either 'fast', 'flexible', 'strict' or 'incremental', the
+    fast engine is spread over several processes when processes is more
+    than 1. the incremental engine only re-parses what changed since the
+    previous run and writes the delta next to the full result.
+    collect_paths keeps the as paths too, which always uses the single
+    process fast engine """
+
+    if collect_paths:
+        # only needed for the as paths, which need numpy
+        from bgppaths import ASPathTable
+
+        path_table = ASPathTable()
+        bgp_db = fast_bgp_parse(filename, path_table)
+
+        bgp_store = BGPRedundancyStore.from_bgp_db(bgp_db)
+        path_table.index(bgp_store)
+
+        save_bgp_database(bgp_store)
+        save_bgp_paths(path_table)
+
+        if export_yaml:
+            export_bgp_database(bgp_store)
+
+        return bgp_store
+
+    if parse_mode == 'incremental':
+        # saves the store together with its checkpoint
+        bgp_store, delta = incremental_bgp_parse(filename)
+
+        if delta is not None:
+            export_bgp_delta(delta)
+
+        if export_yaml:
+            export_bgp_database(bgp_store)
+
+        return bgp_store
+
+    if parse_mode == 'fast' and processes != 1:
+        bgp_db = parallel_bgp_parse(filename, processes)
+    elif parse_mode == 'fast':
+        bgp_db = fast_bgp_parse(filename)
+    elif parse_mode == 'strict':
+        bgp_db = line_bgp_parse(filename, strict_parse)
+    else:
+        bgp_db = line_bgp_parse(filename, flexible_parse)
+
+    # pack the results into the compact store, sorted by ip address once
+    bgp_store = BGPRedundancyStore.from_bgp_db(bgp_db)
+
+    # save our data as a binary file to be reused for graping purposes!
+    save_bgp_database(bgp_store)
+
+    # the yaml file is only written when asked for
+    if export_yaml:
+        export_bgp_database(bgp_store)
+
+    return bgp_store
 
 def main():
     # replace the below string with your filename